@@ -1,21 +1,109 @@
+import click
+import hashlib
 import mimetypes
-from flask import Flask, render_template, request, redirect, url_for, send_from_directory, flash, abort
+from flask import Flask, render_template, request, redirect, url_for, send_from_directory, flash, abort, jsonify, session, g
 import os
+import shutil
+import tarfile
+import time
 import uuid
-from PIL import Image, ImageOps
+import zipfile
+from collections import namedtuple
+from urllib.parse import quote
+from werkzeug.exceptions import RequestEntityTooLarge
 from werkzeug.middleware.proxy_fix import ProxyFix
+from werkzeug.utils import safe_join
+
+import atomic
+import cleanup
+import derivatives
+import jobs
+import metrics
+import similarity
+import storage
+import svg
+import uploads
+import warmup
+from asset_index import SORT_COLUMNS, InvalidCursor, is_built, open_index
+from pipeline import (THUMBNAIL_SIZE, RASTER_EXTENSIONS, alias_asset, create_thumbnail, compress_and_convert_image,
+                      parse_variants, process_upload, rebuild_index, supported_variant_formats, thumbnail_size, variant_name)
 
 UPLOAD_FOLDER = os.getenv('UPLOAD_FOLDER', '/app/content')
 THUMBNAIL_FOLDER = os.getenv('THUMBNAIL_FOLDER', '/app/content/thumbnails')
+VARIANT_FOLDER = os.getenv('VARIANT_FOLDER', '/app/content/variants')
 PUBLIC_DNS_DOMAIN = os.getenv('PUBLIC_DNS_DOMAIN', 'localhost')
 APPLICATION_ROOT = os.getenv('APPLICATION_ROOT', '/cdn/admin')
+DATA_FOLDER = os.getenv('DATA_FOLDER', '/app/data')
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'svg', 'webp'}
-THUMBNAIL_SIZE = (250, 250)
+ARCHIVE_EXTENSIONS = ('.zip', '.tar', '.tar.gz', '.tgz')
+MAX_ARCHIVE_MEMBERS = int(os.getenv('MAX_ARCHIVE_MEMBERS', '5000'))
+MAX_BATCH_DELETE = int(os.getenv('MAX_BATCH_DELETE', '1000'))
+# Límites que se revisan mientras se recibe cada archivo
+MAX_UPLOAD_MB = int(os.getenv('MAX_UPLOAD_MB', '50'))
+MAX_IMAGE_PIXELS = int(os.getenv('MAX_IMAGE_PIXELS', '50000000'))
+# Límite del cuerpo completo de la petición (lotes y archivos comprimidos)
+MAX_REQUEST_MB = int(os.getenv('MAX_REQUEST_MB', '2048'))
+# Procesos para convertir imágenes en segundo plano (0 = procesar dentro de la petición)
+PROCESSING_WORKERS = int(os.getenv('PROCESSING_WORKERS', os.cpu_count() or 1))
+PROCESSING_QUEUE_SIZE = int(os.getenv('PROCESSING_QUEUE_SIZE', '64'))
+PAGE_SIZE = int(os.getenv('PAGE_SIZE', '50'))
+# Anchos y formatos de las variantes responsive (srcset) generadas al subir
+VARIANT_WIDTHS = [int(w) for w in os.getenv('VARIANT_WIDTHS', '320,640,1280,2048').split(',') if w]
+VARIANT_FORMATS = supported_variant_formats(os.getenv('VARIANT_FORMATS', 'webp').split(','))
+# Miniaturas de GIF/WebP animados: 'animated' o 'poster' (primer cuadro, más barata)
+ANIMATED_THUMBNAILS = os.getenv('ANIMATED_THUMBNAILS', 'animated')
+# Tamaños permitidos en /cdn/<ancho>x<alto>/ para que no se pueda llenar la caché con tamaños arbitrarios
+DERIVATIVE_SIZES = derivatives.parse_sizes(os.getenv('DERIVATIVE_SIZES', '64x64,128x128,320x320,640x640,800x600,1280x1280'))
+DERIVATIVE_QUALITIES = {int(q) for q in os.getenv('DERIVATIVE_QUALITIES', '60,80,90').split(',')}
+DERIVATIVE_CACHE_MAX_MB = int(os.getenv('DERIVATIVE_CACHE_MAX_MB', '1024'))
+# Los nombres son UUID y nunca cambian de contenido: se pueden cachear indefinidamente
+CDN_CACHE_CONTROL = os.getenv('CDN_CACHE_CONTROL', 'public, max-age=31536000, immutable')
+# Si está definido (ej. /_accel), nginx entrega los archivos con sendfile vía X-Accel-Redirect
+X_ACCEL_REDIRECT_PREFIX = os.getenv('X_ACCEL_REDIRECT_PREFIX', '')
+# Dónde se guardan los archivos publicados: 'local' (carpetas de arriba) o 's3'
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'local')
+S3_BUCKET = os.getenv('S3_BUCKET', '')
+S3_PREFIX = os.getenv('S3_PREFIX', '')
+S3_ENDPOINT_URL = os.getenv('S3_ENDPOINT_URL', '')  # MinIO u otro servicio compatible
+S3_REGION = os.getenv('S3_REGION', '')
+S3_MAX_POOL_CONNECTIONS = int(os.getenv('S3_MAX_POOL_CONNECTIONS', '32'))
+S3_MULTIPART_THRESHOLD_MB = int(os.getenv('S3_MULTIPART_THRESHOLD_MB', '8'))
+S3_MAX_CONCURRENCY = int(os.getenv('S3_MAX_CONCURRENCY', '8'))
+# Copia local de los archivos leídos del bucket (por nodo)
+STORAGE_CACHE_MAX_MB = int(os.getenv('STORAGE_CACHE_MAX_MB', '2048'))
+# Qué se sincroniza a disco al publicar: 'none', 'file' (datos) o 'full' (datos y carpeta)
+FSYNC_MODE = atomic.check_mode(os.getenv('FSYNC_MODE', 'file'))
 
 app = Flask(__name__)
 app.secret_key = 'supersecretkey'
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['THUMBNAIL_FOLDER'] = THUMBNAIL_FOLDER
+app.config['VARIANT_FOLDER'] = VARIANT_FOLDER
+app.config['DATA_FOLDER'] = DATA_FOLDER
+app.config['PROCESSING_WORKERS'] = PROCESSING_WORKERS
+app.config['MAX_UPLOAD_MB'] = MAX_UPLOAD_MB
+app.config['MAX_IMAGE_PIXELS'] = MAX_IMAGE_PIXELS
+app.config['MAX_CONTENT_LENGTH'] = MAX_REQUEST_MB * 1024 * 1024
+app.config['PROCESSING_QUEUE_SIZE'] = PROCESSING_QUEUE_SIZE
+app.config['PAGE_SIZE'] = PAGE_SIZE
+app.config['VARIANT_WIDTHS'] = VARIANT_WIDTHS
+app.config['VARIANT_FORMATS'] = VARIANT_FORMATS
+app.config['ANIMATED_THUMBNAILS'] = ANIMATED_THUMBNAILS
+app.config['DERIVATIVE_SIZES'] = DERIVATIVE_SIZES
+app.config['DERIVATIVE_QUALITIES'] = DERIVATIVE_QUALITIES
+app.config['DERIVATIVE_CACHE_MAX_MB'] = DERIVATIVE_CACHE_MAX_MB
+app.config['CDN_CACHE_CONTROL'] = CDN_CACHE_CONTROL
+app.config['X_ACCEL_REDIRECT_PREFIX'] = X_ACCEL_REDIRECT_PREFIX
+app.config['STORAGE_BACKEND'] = STORAGE_BACKEND
+app.config['S3_BUCKET'] = S3_BUCKET
+app.config['S3_PREFIX'] = S3_PREFIX
+app.config['S3_ENDPOINT_URL'] = S3_ENDPOINT_URL
+app.config['S3_REGION'] = S3_REGION
+app.config['S3_MAX_POOL_CONNECTIONS'] = S3_MAX_POOL_CONNECTIONS
+app.config['S3_MULTIPART_THRESHOLD_MB'] = S3_MULTIPART_THRESHOLD_MB
+app.config['S3_MAX_CONCURRENCY'] = S3_MAX_CONCURRENCY
+app.config['STORAGE_CACHE_MAX_MB'] = STORAGE_CACHE_MAX_MB
+app.config['FSYNC_MODE'] = FSYNC_MODE
 app.config['APPLICATION_ROOT'] = APPLICATION_ROOT
 
 # Configurar ProxyFix para manejar headers del proxy
@@ -26,114 +114,802 @@ def inject_application_root():
     return {'APPLICATION_ROOT': APPLICATION_ROOT}
 
 mimetypes.add_type('image/webp', '.webp')
-
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-os.makedirs(THUMBNAIL_FOLDER, exist_ok=True)
+mimetypes.add_type('image/avif', '.avif')
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def create_thumbnail(image_path, thumb_path):
+def is_archive(filename):
+    return filename.lower().endswith(ARCHIVE_EXTENSIONS)
+
+def iter_archive_members(path):
+    """Itera ``(nombre, stream)`` de los archivos de un zip/tar sin extraerlo completo."""
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                if not info.is_dir():
+                    with archive.open(info) as stream:
+                        yield info.filename, stream
+    else:
+        # Modo stream: lee los miembros en orden sin cargar el índice completo
+        with tarfile.open(path, mode='r|*') as archive:
+            for member in archive:
+                if member.isfile():
+                    yield member.name, archive.extractfile(member)
+
+_job_queues = {}
+
+def get_job_queue():
+    key = (app.config['PROCESSING_WORKERS'], app.config['PROCESSING_QUEUE_SIZE'])
+    if key not in _job_queues:
+        _job_queues[key] = jobs.JobQueue(*key)
+    return _job_queues[key]
+
+def jobs_folder():
+    return os.path.join(app.config['DATA_FOLDER'], 'jobs')
+
+def asset_index_path():
+    return os.path.join(app.config['DATA_FOLDER'], 'assets.sqlite3')
+
+# Índices ya revisados por este proceso (ver ``build_asset_index``)
+_built_indexes = set()
+
+def get_asset_index():
+    path = asset_index_path()
+    asset_index = open_index(path)
+    if path not in _built_indexes:
+        if not is_built(path):
+            # Sin prepare_startup (flask run, pruebas): se indexa en la primera petición
+            asset_index.rebuild(get_storage())
+        _built_indexes.add(path)
+    return asset_index
+
+def build_asset_index():
+    """Indexa lo que ya está publicado si el índice nunca terminó una reconstrucción completa.
+
+    Corre al arrancar y no en la primera petición: con muchos archivos (o en
+    S3) tardaría más que el timeout del worker. Se hace en un proceso aparte
+    para que el master no abra el índice ni el backend. Devuelve cuántos
+    archivos se indexaron, o ``None`` si el índice ya estaba completo.
+    """
+    path = asset_index_path()
+    if is_built(path):
+        return None
+    queue = jobs.JobQueue(1, 1)
     try:
-        img = Image.open(image_path)
-        
-        # Método moderno: corrige automáticamente la orientación EXIF
-        img = ImageOps.exif_transpose(img)
-        
-        img.thumbnail(THUMBNAIL_SIZE)
-        img.save(thumb_path)
-        print(f"✅ Miniatura creada: {thumb_path}")
-    except Exception as e:
-        print(f"❌ Error creando miniatura: {e}")
+        return queue.submit(rebuild_index, path, storage_config()).result()
+    finally:
+        queue.shutdown()
+
+def storage_config():
+    """Configuración serializable del backend; viaja en cada trabajo hacia el pool de procesos."""
+    if app.config['STORAGE_BACKEND'] == 's3':
+        part_size = app.config['S3_MULTIPART_THRESHOLD_MB'] * 1024 * 1024
+        return {
+            'backend': 's3',
+            'bucket': app.config['S3_BUCKET'],
+            'prefix': app.config['S3_PREFIX'],
+            'endpoint_url': app.config['S3_ENDPOINT_URL'],
+            'region': app.config['S3_REGION'],
+            'max_pool_connections': app.config['S3_MAX_POOL_CONNECTIONS'],
+            'multipart_threshold': part_size,
+            'multipart_chunksize': part_size,
+            'max_concurrency': app.config['S3_MAX_CONCURRENCY'],
+            'cache_folder': os.path.abspath(os.path.join(app.config['DATA_FOLDER'], 'storage-cache')),
+            'cache_max_bytes': app.config['STORAGE_CACHE_MAX_MB'] * 1024 * 1024,
+            'fsync': app.config['FSYNC_MODE'],
+        }
+    return {
+        'backend': 'local',
+        'folders': {
+            'content': os.path.abspath(app.config['UPLOAD_FOLDER']),
+            'thumbnails': os.path.abspath(app.config['THUMBNAIL_FOLDER']),
+            'variants': os.path.abspath(app.config['VARIANT_FOLDER']),
+        },
+        'fsync': app.config['FSYNC_MODE'],
+    }
+
+def get_storage():
+    return storage.open_storage(storage_config())
+
+_derivative_caches = {}
+
+def get_derivative_cache():
+    folder = os.path.join(app.config['DATA_FOLDER'], 'derivatives')
+    max_bytes = app.config['DERIVATIVE_CACHE_MAX_MB'] * 1024 * 1024
+    cache = _derivative_caches.get(folder)
+    if cache is None:
+        cache = _derivative_caches[folder] = derivatives.DerivativeCache(folder, max_bytes, app.config['FSYNC_MODE'])
+    cache.max_bytes = max_bytes
+    return cache
+
+def recover_interrupted_writes():
+    """Borra los temporales de escrituras que un worker muerto (timeout, OOM) dejó a medias."""
+    config = storage_config()
+    data_folder = app.config['DATA_FOLDER']
+    folders = list(config.get('folders', {}).values()) + [jobs_folder()]
+    cache_folders = [os.path.join(data_folder, 'derivatives')]
+    if 'cache_folder' in config:
+        cache_folders.append(config['cache_folder'])
+    try:
+        report = cleanup.recover(folders, cache_folders)
+    except OSError as e:
+        print(f"❌ No se pudieron revisar los archivos temporales: {e}")
+        return None
+    if report.total_files:
+        print(f"✅ Borrados {report.total_files} archivos temporales de escrituras interrumpidas")
+    return report
+
+def startup_problems():
+    """Revisa la configuración y las carpetas; devuelve la lista de problemas (vacía si todo está bien)."""
+    problems = []
+    config = storage_config()
+    if app.config['STORAGE_BACKEND'] not in ('local', 's3'):
+        problems.append(f"STORAGE_BACKEND desconocido: {app.config['STORAGE_BACKEND']} (usa local o s3)")
+    elif app.config['STORAGE_BACKEND'] == 's3':
+        if not app.config['S3_BUCKET']:
+            problems.append('STORAGE_BACKEND=s3 requiere S3_BUCKET.')
+        if storage.boto3 is None:
+            problems.append('STORAGE_BACKEND=s3 requiere boto3 (pip install boto3).')
+    folders = list(config.get('folders', {}).values()) + [app.config['DATA_FOLDER']]
+    return problems + warmup.check_folders(folders)
+
+def prepare_startup():
+    """Valida, recupera escrituras interrumpidas y precalienta Pillow antes de atender peticiones.
+
+    Con gunicorn corre una sola vez en el master (``gunicorn.conf.py`` usa
+    ``preload_app``) y los workers lo heredan con el fork. No abre el índice
+    ni el backend: las conexiones no se deben compartir entre procesos (el
+    índice se construye en un proceso aparte, ver ``build_asset_index``).
+    Lanza ``RuntimeError`` si la configuración no sirve.
+    """
+    started = time.perf_counter()
+    problems = startup_problems()
+    if problems:
+        raise RuntimeError('\n'.join(problems))
+    recover_interrupted_writes()
+    indexed = build_asset_index()
+    if indexed is not None:
+        print(f"✅ Índice construido: {indexed} archivos")
+    codecs = warmup.warm_up_codecs()
+    warmup.warm_up_mimetypes()
+    app.jinja_env.get_template('index.html')
+    print(f"✅ Arranque preparado en {time.perf_counter() - started:.3f} s (códecs: {', '.join(codecs)})")
+
+def wants_json():
+    return request.accept_mimetypes.best_match(['text/html', 'application/json']) == 'application/json'
+
+def incoming_folder():
+    folder = os.path.join(app.config['DATA_FOLDER'], 'incoming')
+    os.makedirs(folder, exist_ok=True)
+    return folder
+
+def iter_request_files():
+    """Recorre los archivos del cuerpo multipart a medida que llegan (sin ``request.files``)."""
+    boundary = request.mimetype_params.get('boundary')
+    if request.mimetype != 'multipart/form-data' or not boundary:
+        return iter(())
+    try:
+        stream = request.stream
+    except RequestEntityTooLarge:  # Content-Length mayor que MAX_CONTENT_LENGTH
+        raise uploads.InvalidBody('La petición supera el tamaño máximo permitido.', 413)
+    return uploads.iter_multipart_files(stream, boundary)
 
-def compress_and_convert_image(filepath):
+def save_upload(chunks, path, validator):
+    """Guarda el archivo por bloques validándolo y devuelve el SHA-256 de sus bytes.
+
+    Si el validador lo rechaza se borra lo escrito y se deja de leer el resto.
+    """
+    digest = hashlib.sha256()
+    try:
+        with open(path, 'wb') as f:
+            for chunk in chunks:
+                validator.feed(chunk)
+                digest.update(chunk)
+                f.write(chunk)
+        validator.finish()
+    except BaseException:
+        os.remove(path)
+        raise
+    return digest.hexdigest()
+
+def enqueue_upload(filename, chunks, block=False):
+    """Guarda el archivo recibido y encola su conversión.
+
+    Devuelve el estado del trabajo; en modo en línea (sin workers) el trabajo
+    ya viene terminado. Lanza ``uploads.UploadRejected`` si el contenido no es
+    válido y ``jobs.QueueFull`` si la cola no admite más trabajos (con
+    ``block=True`` primero espera un lugar libre).
+    """
+    ext = filename.rsplit('.', 1)[1].lower()
+    job_id = str(uuid.uuid4())
+    unique_name = f"{job_id}.webp" if ext in RASTER_EXTENSIONS else f"{job_id}.{ext}"
+    upload_folder_abs = os.path.abspath(app.config['UPLOAD_FOLDER'])
+    filepath = os.path.normpath(os.path.join(upload_folder_abs, unique_name))
+    if not filepath.startswith(upload_folder_abs):
+        return {'job_id': job_id, 'status': jobs.FAILED, 'error': 'Nombre de archivo no permitido.'}
+
+    source = os.path.join(incoming_folder(), f"{job_id}.{ext}")
+    validator = uploads.UploadValidator(ext, app.config['MAX_UPLOAD_MB'] * 1024 * 1024, app.config['MAX_IMAGE_PIXELS'])
+    timings = {}
+    with metrics.timed(timings, 'receive'):
+        source_hash = save_upload(chunks, source, validator)
+    metrics.observe_stages(timings)
+
+    # Mismos bytes que un archivo ya publicado: se crea un alias sin convertir de nuevo
+    asset_index = get_asset_index()
+    existing = asset_index.find_by_source_hash(source_hash)
+    if existing:
+        unique_name = job_id + os.path.splitext(existing['filename'])[1]
+        metadata = alias_asset(existing, unique_name, get_storage())
+        if metadata:
+            os.remove(source)
+            asset_index.add(unique_name, **metadata)
+            return jobs.write_status(jobs_folder(), job_id, status=jobs.DONE, filename=unique_name,
+                                     duplicate_of=existing['filename'])
+
+    job = {
+        'job_id': job_id,
+        'ext': ext,
+        'source': source,
+        'filename': unique_name,
+        'work_folder': os.path.join(incoming_folder(), job_id),
+        'storage': storage_config(),
+        'variant_widths': app.config['VARIANT_WIDTHS'],
+        'variant_formats': app.config['VARIANT_FORMATS'],
+        'animated_thumbnails': app.config['ANIMATED_THUMBNAILS'] != 'poster',
+        'jobs_folder': jobs_folder(),
+        'index_path': asset_index_path(),
+        'source_hash': source_hash,
+    }
+    queue = get_job_queue()
+    if not queue.workers:
+        status = process_upload(job)
+        record_job(status)
+        return status
+
+    status = jobs.write_status(job['jobs_folder'], job_id, status=jobs.QUEUED, filename=unique_name)
     try:
-        with Image.open(filepath) as img:
-            # Método moderno: corrige automáticamente la orientación EXIF
-            img = ImageOps.exif_transpose(img)
-            
-            webp_path = os.path.splitext(filepath)[0] + '.webp'
-            # Guardar sin metadatos EXIF para evitar problemas futuros
-            img.save(webp_path, format='WEBP', quality=80, exif=b'')
-            os.remove(filepath)  # Elimina el original si se convierte
-            print(f"✅ Imagen convertida a WebP: {webp_path}")
-            return os.path.basename(webp_path)
+        future = queue.submit(process_upload, job, block=block, timeout=60)
+    except jobs.QueueFull:
+        discard_job_files(job)
+        jobs.write_status(job['jobs_folder'], job_id, status=jobs.FAILED, filename=unique_name,
+                          error='La cola de procesamiento está llena.')
+        raise
     except Exception as e:
-        print(f"❌ [ERROR] No se pudo comprimir/convertir la imagen: {e}")
+        print(f"❌ [ERROR] No se pudo encolar la conversión: {e}")
+        discard_job_files(job)
+        return jobs.write_status(job['jobs_folder'], job_id, status=jobs.FAILED, filename=unique_name,
+                                 error='No se pudo iniciar la conversión.')
+    metrics.QUEUE_DEPTH.set(queue.depth)
+
+    def job_finished(future):
+        error = None if future.cancelled() else future.exception()
+        failed = future.cancelled() or error is not None
+        if failed:
+            # El worker murió (BrokenProcessPool) o falló fuera de process_upload:
+            # sin esto el trabajo quedaría "queued" y la página consultaría para siempre
+            print(f"❌ [ERROR] Falló el trabajo {job_id}: {error!r}")
+            discard_job_files(job)
+            jobs.write_status(job['jobs_folder'], job_id, status=jobs.FAILED, filename=unique_name,
+                              error='No se pudo procesar la imagen.')
+        record_job(None if failed else future.result(), queue)
+    future.add_done_callback(job_finished)
+    return status
+
+def discard_job_files(job):
+    """Borra el archivo recibido y la carpeta de trabajo de un trabajo que no se completó."""
+    if os.path.exists(job['source']):
+        os.remove(job['source'])
+    shutil.rmtree(job['work_folder'], ignore_errors=True)
+
+def record_job(status, queue=None):
+    """Registra en las métricas las etapas medidas por el worker de conversión."""
+    if queue is not None:
+        metrics.QUEUE_DEPTH.set(queue.depth)
+    if status is None or status['status'] == jobs.FAILED:
+        metrics.CONVERSION_FAILURES.inc()
+    if status is not None:
+        metrics.observe_stages(status.get('timings'))
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def observe_request(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        # Las respuestas con archivos (stream) ya traen el tamaño en Content-Length
+        metrics.observe_request(request.endpoint, time.perf_counter() - started,
+                                request.content_length, response.content_length)
+    return response
+
+def asset_srcset(asset, base=''):
+    """Arma el atributo ``srcset`` de cada formato a partir de las variantes indexadas."""
+    srcset = {}
+    for width, fmt in parse_variants(asset.get('variants')):
+        srcset.setdefault(fmt, []).append(f"{base}/cdn/variants/{variant_name(asset['filename'], width, fmt)} {width}w")
+    if asset.get('width') and asset.get('mime_type') == 'image/webp':
+        srcset.setdefault('webp', []).append(f"{base}/cdn/{asset['filename']} {asset['width']}w")
+    return {fmt: ', '.join(entries) for fmt, entries in srcset.items()}
+
+def job_response(status):
+    data = dict(status, status_url=url_for('job_status', job_id=status['job_id']))
+    if status['status'] == jobs.DONE:
+        data['url'] = url_for('serve_file', filename=status['filename'])
+    return data
+
+# Página del índice pedida en la URL (página principal y /api/files)
+Listing = namedtuple('Listing', 'files next_cursor sort order mime_type limit')
+
+def list_assets():
+    """Página del índice según ``sort``, ``order``, ``type``, ``cursor`` y ``limit``; ``None`` si no son válidos."""
+    sort = request.args.get('sort', 'created')
+    order = request.args.get('order', 'desc')
+    mime_type = request.args.get('type') or None
+    if sort not in SORT_COLUMNS or order not in ('asc', 'desc'):
         return None
+    limit = max(1, min(request.args.get('limit', app.config['PAGE_SIZE'], type=int), 200))
+    try:
+        files, next_cursor = get_asset_index().page(sort, order, request.args.get('cursor'), limit, mime_type)
+    except InvalidCursor:
+        return None
+    return Listing(files, next_cursor, sort, order, mime_type, limit)
+
+def asset_summary(asset):
+    """Lo que la galería muestra de un archivo; con las dimensiones reserva su lugar antes de cargar la miniatura."""
+    filename = asset['filename']
+    thumbnail = asset.get('thumbnail')
+    thumbnail_width = thumbnail_height = None
+    if thumbnail and asset.get('width') and asset.get('height'):
+        thumbnail_width, thumbnail_height = thumbnail_size((asset['width'], asset['height']))
+    return {
+        'filename': filename,
+        'mime_type': asset.get('mime_type'),
+        'size': asset.get('size'),
+        'width': asset.get('width'),
+        'height': asset.get('height'),
+        'created_at': asset.get('created_at'),
+        'thumbnail': thumbnail,
+        'thumbnail_width': thumbnail_width,
+        'thumbnail_height': thumbnail_height,
+        'url': url_for('serve_file', filename=filename),
+        'thumbnail_url': url_for('serve_thumbnail', filename=thumbnail) if thumbnail else None,
+        'cdn_url': f"{PUBLIC_DNS_DOMAIN}/cdn/{filename}",
+        'thumbnail_cdn_url': f"{PUBLIC_DNS_DOMAIN}/cdn/thumbnails/{thumbnail}" if thumbnail else None,
+        'srcset': asset_srcset(asset, PUBLIC_DNS_DOMAIN),
+    }
 
 @app.route('/')
 def index():
-    files = os.listdir(app.config['UPLOAD_FOLDER'])
-    files = [f for f in files if f != 'thumbnails']
-    return render_template('index.html', files=files, public_dns_domain=PUBLIC_DNS_DOMAIN)
+    listing = list_assets()
+    if listing is None:
+        abort(400)
+    files = [asset_summary(asset) for asset in listing.files]
+    # La galería toma esta primera página y pide las siguientes a /api/files
+    gallery = {
+        'files': files,
+        'next_cursor': listing.next_cursor,
+        'query': {'sort': listing.sort, 'order': listing.order, 'type': listing.mime_type or '', 'limit': listing.limit},
+    }
+    pending_jobs = session.pop('pending_jobs', [])
+    return render_template('index.html', files=files, total=get_asset_index().count(), next_cursor=listing.next_cursor,
+                           sort=listing.sort, order=listing.order, mime_type=listing.mime_type, gallery=gallery,
+                           pending_jobs=pending_jobs, public_dns_domain=PUBLIC_DNS_DOMAIN)
+
+@app.route('/api/files')
+def list_files():
+    """Listado paginado en JSON (mismos parámetros que la página principal)."""
+    listing = list_assets()
+    if listing is None:
+        return jsonify(error='Parámetros de listado no válidos.'), 400
+    return jsonify(files=[asset_summary(asset) for asset in listing.files], next_cursor=listing.next_cursor,
+                   total=get_asset_index().count())
+
+@app.route('/api/files/<filename>/similar')
+def similar_files(filename):
+    """Copias casi idénticas de un archivo (``?distance=`` bits de su hash perceptual, ``?limit=``)."""
+    asset = get_asset_index().get(filename)
+    if asset is None:
+        return jsonify(error='Archivo no encontrado.'), 404
+    max_distance = request.args.get('distance', similarity.DEFAULT_DISTANCE, type=int)
+    if not 0 <= max_distance <= similarity.MAX_DISTANCE:
+        return jsonify(error=f'La distancia debe estar entre 0 y {similarity.MAX_DISTANCE}.'), 400
+    limit = max(1, min(request.args.get('limit', app.config['PAGE_SIZE'], type=int), 200))
+    value = asset[similarity.HASH_COLUMN]
+    # Sin miniatura (ej. SVG sin cairo) no hay hash con qué comparar
+    matches = [] if value is None else get_asset_index().similar(value, max_distance, limit, exclude=filename)
+    return jsonify(filename=filename, hash=similarity.format_hash(value), distance=max_distance,
+                   files=[dict(asset_summary(match), distance=match['distance']) for match in matches])
+
+def reject_upload(e):
+    if wants_json():
+        return jsonify(error=e.message), e.status
+    flash(e.message, 'danger')
+    return redirect(url_for('index'))
 
 @app.route('/upload', methods=['POST'])
 def upload_file():
-    file = request.files.get('file')
-    if file and allowed_file(file.filename):
-        ext = file.filename.rsplit('.', 1)[1].lower()
-        unique_name = f"{uuid.uuid4()}.{ext}"
-        upload_folder_abs = os.path.abspath(app.config['UPLOAD_FOLDER'])
-        filepath = os.path.normpath(os.path.join(upload_folder_abs, unique_name))
-        if not filepath.startswith(upload_folder_abs):
-            flash('Nombre de archivo no permitido.', 'danger')
-            return redirect(url_for('index'))
-        file.save(filepath)
-
-        # Comprimir y convertir a WebP si es necesario
-        if ext in ALLOWED_EXTENSIONS:
-            compressed_filename = compress_and_convert_image(filepath)
-            if compressed_filename:
-                unique_name = compressed_filename
-                filepath = os.path.join(upload_folder_abs, unique_name)
-                flash(f'Imagen convertida y comprimida como {compressed_filename}.', 'success')
-            else:
-                flash('Error al comprimir la imagen.', 'danger')
-        else:
-            flash('Archivo subido sin compresión.', 'info')
-
-        # Generar miniatura solo si es imagen raster (no para svg, etc.)
-        if ext in {'png', 'jpg', 'jpeg', 'gif', 'webp'}:
-            thumb_path = os.path.join(app.config['THUMBNAIL_FOLDER'], unique_name)
-            create_thumbnail(filepath, thumb_path)
+    try:
+        file = next((f for f in iter_request_files() if f.name == 'file'), None)
+    except uploads.InvalidBody as e:
+        return reject_upload(e)
+    if not (file and allowed_file(file.filename)):
+        if wants_json():
+            return jsonify(error='Archivo no permitido.'), 400
+        flash('Archivo no permitido.', 'danger')
+        return redirect(url_for('index'))
+
+    try:
+        status = enqueue_upload(file.filename, file.chunks())
+    except uploads.UploadRejected as e:
+        return reject_upload(e)
+    except jobs.QueueFull:
+        if wants_json():
+            return jsonify(error='La cola de procesamiento está llena, intenta de nuevo.'), 503
+        flash('El servidor está ocupado procesando imágenes, intenta de nuevo en unos segundos.', 'danger')
+        return redirect(url_for('index'))
+
+    if wants_json():
+        code = {jobs.QUEUED: 202, jobs.DONE: 201}.get(status['status'], 422)
+        return jsonify(job_response(status)), code
+
+    if status['status'] == jobs.FAILED:
+        flash(status.get('error') or 'Error al comprimir la imagen.', 'danger')
+    elif status.get('duplicate_of'):
+        flash(f"Contenido idéntico a {status['duplicate_of']}; se publicó como {status['filename']} sin volver a convertirlo.", 'info')
+        flash('Archivo subido correctamente.', 'success')
+    elif status['status'] == jobs.DONE:
+        if status['filename'].endswith('.webp'):
+            flash(f"Imagen convertida y comprimida como {status['filename']}.", 'success')
         flash('Archivo subido correctamente.', 'success')
     else:
-        flash('Archivo no permitido.', 'danger')
+        session['pending_jobs'] = session.get('pending_jobs', []) + [status['job_id']]
+        flash('Archivo subido correctamente.', 'success')
+        flash(f"Procesando {status['filename']} en segundo plano.", 'info')
     return redirect(url_for('index'))
 
+def batch_entry(name, filename, chunks):
+    if not (filename and allowed_file(filename)):
+        return {'name': name, 'status': 'rejected', 'error': 'Archivo no permitido.'}
+    try:
+        status = enqueue_upload(filename, chunks, block=True)
+    except uploads.InvalidBody:
+        raise  # Afecta a toda la petición, no solo a este archivo
+    except uploads.UploadRejected as e:
+        return {'name': name, 'status': 'rejected', 'error': e.message}
+    except jobs.QueueFull:
+        return {'name': name, 'status': jobs.FAILED, 'error': 'La cola de procesamiento está llena.'}
+    return dict(job_response(status), name=name)
+
+def import_archive(file):
+    """Encola cada imagen de un zip/tar subido; los demás miembros se omiten."""
+    archive_path = os.path.join(incoming_folder(), f"{uuid.uuid4()}.archive")
+    try:
+        with open(archive_path, 'wb') as f:
+            for chunk in file.chunks():
+                f.write(chunk)
+    except BaseException:
+        os.remove(archive_path)
+        raise
+    entries = []
+    try:
+        for count, (name, stream) in enumerate(iter_archive_members(archive_path)):
+            if count >= MAX_ARCHIVE_MEMBERS:
+                entries.append({'name': file.filename, 'status': 'rejected',
+                                'error': f'El archivo tiene más de {MAX_ARCHIVE_MEMBERS} elementos.'})
+                break
+            basename = os.path.basename(name)
+            if basename.startswith('.') or '__MACOSX' in name or not allowed_file(basename):
+                entries.append({'name': name, 'status': 'skipped'})
+                continue
+            entries.append(batch_entry(name, basename, uploads.iter_stream(stream)))
+    except (zipfile.BadZipFile, tarfile.TarError) as e:
+        entries.append({'name': file.filename, 'status': jobs.FAILED, 'error': f'Archivo comprimido inválido: {e}'})
+    finally:
+        os.remove(archive_path)
+    return entries
+
+@app.route('/upload/batch', methods=['POST'])
+def upload_batch():
+    entries = []
+    try:
+        for file in iter_request_files():
+            if file.name not in ('files', 'file') or not file.filename:
+                continue
+            if is_archive(file.filename):
+                entries.extend(import_archive(file))
+            else:
+                entries.append(batch_entry(file.filename, file.filename, file.chunks()))
+    except uploads.InvalidBody as e:
+        # Los archivos anteriores ya se encolaron: se informan junto con el error
+        return jsonify(error=e.message, files=entries), e.status
+    if not entries:
+        return jsonify(error='No se recibieron archivos.'), 400
+
+    summary = {}
+    for entry in entries:
+        summary[entry['status']] = summary.get(entry['status'], 0) + 1
+    return jsonify(files=entries, summary=summary)
+
+@app.route('/metrics')
+def metrics_endpoint():
+    body, content_type = metrics.render()
+    return body, 200, {'Content-Type': content_type}
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    try:
+        uuid.UUID(job_id)
+    except ValueError:
+        abort(404)
+    status = jobs.read_status(jobs_folder(), job_id)
+    if status is None:
+        return jsonify(error='Trabajo no encontrado.'), 404
+    return jsonify(job_response(status))
+
+def delete_assets(filenames):
+    """Borra varios archivos con su miniatura, variantes, copias precomprimidas y caché.
+
+    Primero salen del índice (dejan de servirse) y después se borran los
+    archivos; si el proceso muere entre ambos pasos, ``flask gc`` recupera el
+    espacio. Devuelve los nombres que estaban indexados.
+    """
+    store = get_storage()
+    asset_index = get_asset_index()
+    assets = asset_index.get_many(filenames)
+    asset_index.remove_many(assets)
+
+    content, thumbnails, variants = list(filenames), [], []
+    for filename in filenames:
+        thumbnails.append(svg.thumbnail_name(filename))
+        asset = assets.get(filename)
+        if asset:
+            variants.extend(variant_name(filename, width, fmt) for width, fmt in parse_variants(asset['variants']))
+            content.extend(svg.encoded_name(filename, encoding) for encoding in (asset['encodings'] or '').split(',') if encoding)
+    store.delete_many('variants', variants)
+    store.delete_many('thumbnails', thumbnails)
+    store.delete_many('content', content)
+    derivative_cache = get_derivative_cache()
+    for filename in filenames:
+        derivative_cache.discard(filename)
+    return set(assets)
+
 @app.route('/delete/<filename>', methods=['POST'])
 def delete_file(filename):
-    # Normalize and validate file_path
-    upload_folder_abs = os.path.abspath(app.config['UPLOAD_FOLDER'])
-    thumbnail_folder_abs = os.path.abspath(app.config['THUMBNAIL_FOLDER'])
-    file_path = os.path.normpath(os.path.join(upload_folder_abs, filename))
-    thumb_path = os.path.normpath(os.path.join(thumbnail_folder_abs, filename))
-
-    # Ensure the paths are within the intended directories
-    if not file_path.startswith(upload_folder_abs) or not thumb_path.startswith(thumbnail_folder_abs):
+    if not storage.valid_name(filename):
         flash('Nombre de archivo no permitido.', 'danger')
         return redirect(url_for('index'))
 
-    if os.path.exists(file_path):
-        os.remove(file_path)
-    if os.path.exists(thumb_path):
-        os.remove(thumb_path)
+    delete_assets([filename])
 
     flash('Archivo eliminado.', 'warning')
     return redirect(url_for('index'))
 
+@app.route('/delete/batch', methods=['POST'])
+def delete_batch():
+    """Borra varios archivos: JSON ``{"filenames": [...]}`` o campos de formulario ``filenames``."""
+    if request.is_json:
+        filenames = (request.get_json(silent=True) or {}).get('filenames')
+    else:
+        filenames = request.form.getlist('filenames')
+    if not isinstance(filenames, list) or not filenames:
+        return jsonify(error='No se recibieron nombres de archivo.'), 400
+    if len(filenames) > MAX_BATCH_DELETE:
+        return jsonify(error=f'Se pueden borrar hasta {MAX_BATCH_DELETE} archivos por petición.'), 413
+
+    valid = list(dict.fromkeys(name for name in filenames if isinstance(name, str) and storage.valid_name(name)))
+    invalid = [name for name in filenames if not isinstance(name, str) or not storage.valid_name(name)]
+    deleted = delete_assets(valid)
+    return jsonify(deleted=[name for name in valid if name in deleted],
+                   not_found=[name for name in valid if name not in deleted],
+                   invalid=invalid)
+
+def asset_etag(filename, kind='content'):
+    """ETag fuerte a partir del hash guardado en el índice, sin tocar el archivo."""
+    if kind == 'thumbnails':
+        # Miniatura rasterizada de un SVG: <uuid>.svg.webp
+        filename = svg.thumbnail_source(filename)
+    asset = get_asset_index().get(filename)
+    if asset is None:
+        return None
+    if kind == 'thumbnails':
+        return asset['thumbnail_hash']
+    return asset['content_hash']
+
+def variant_etag(filename):
+    # <uuid>-<ancho>w.<formato>: el ETag se deriva del hash del original
+    stem, _, suffix = filename.rpartition('-')
+    content_hash = asset_etag(f"{stem}.webp")
+    return f"{content_hash}-{suffix}" if content_hash else None
+
+# Formatos del mismo archivo que se negocian con Accept, del preferido al menos preferido
+NEGOTIATED_FORMATS = ('avif', 'webp')
+# Para clientes sin WebP: copia a tamaño original generada bajo demanda en la caché de variantes
+FALLBACK_FORMAT = 'jpeg'
+FALLBACK_QUALITY = 80
+
+# Copia de /cdn/<archivo> elegida para una petición: ``area`` es un área de
+# almacenamiento o ``'derivatives'`` (caché); ``vary`` lista las cabeceras de las que depende
+Representation = namedtuple('Representation', 'area name etag encoding vary')
+
+def accepted_format(accept_mimetypes, available):
+    """Formato a enviar según ``Accept``; solo cuentan los tipos listados explícitamente.
+
+    ``image/*`` no dice si el cliente decodifica AVIF o WebP. Sin tipos de
+    imagen en ``Accept`` (sin cabecera, ``*/*``: curl, scripts) se entrega
+    el WebP publicado.
+    """
+    explicit = dict(accept_mimetypes)
+    # El de mayor q; en empate gana el primero (AVIF, WebP, JPEG)
+    candidates = [fmt for fmt in NEGOTIATED_FORMATS if fmt in available] + [FALLBACK_FORMAT]
+    best = max(candidates, key=lambda fmt: explicit.get(f'image/{fmt}', 0))
+    if explicit.get(f'image/{best}', 0) > 0:
+        return best
+    if any(value.startswith('image/') for value in explicit):
+        return FALLBACK_FORMAT
+    return 'webp'
+
+def content_representation(filename, accept_mimetypes, accept_encodings):
+    """Elige qué copia de ``/cdn/<filename>`` enviar según ``Accept`` y ``Accept-Encoding``.
+
+    Los WebP se negocian por formato (AVIF guardado al ancho original, el WebP
+    o un JPEG de la caché) y los SVG por compresión (brotli, gzip). Las copias
+    disponibles salen de la fila del índice, que ya se lee para el ETag: no se
+    busca ningún archivo en disco. Cada copia tiene su propio ETag para que
+    las cachés no mezclen representaciones.
+    """
+    asset = get_asset_index().get(filename)
+    if asset is None:
+        return Representation('content', filename, None, None, ())
+    if asset['encodings']:
+        encoding = accept_encodings.best_match(asset['encodings'].split(',') + ['identity'])
+        if encoding in (None, 'identity'):
+            return Representation('content', filename, asset['content_hash'], None, ('Accept-Encoding',))
+        return Representation('content', svg.encoded_name(filename, encoding), f"{asset['content_hash']}-{encoding}",
+                              encoding, ('Accept-Encoding',))
+    if asset['mime_type'] != 'image/webp' or not asset['width']:
+        return Representation('content', filename, asset['content_hash'], None, ())
+
+    available = {'webp'} | {fmt for width, fmt in parse_variants(asset['variants']) if width == asset['width']}
+    fmt = accepted_format(accept_mimetypes, available)
+    if fmt == 'webp':
+        return Representation('content', filename, asset['content_hash'], None, ('Accept',))
+    if fmt == FALLBACK_FORMAT:
+        name = derivatives.conversion_name(FALLBACK_QUALITY, fmt)
+        return Representation('derivatives', name, f"{asset['content_hash']}-{name}", None, ('Accept',))
+    # Mismo ETag que la variante en /cdn/variants/
+    name = variant_name(filename, asset['width'], fmt)
+    return Representation('variants', name, f"{asset['content_hash']}-{asset['width']}w.{fmt}", None, ('Accept',))
+
+def representation_location(filename, representation):
+    """``(ruta local, destino de X-Accel)`` de la copia elegida; ``(None, None)`` si no existe.
+
+    El JPEG para clientes sin WebP se genera la primera vez que se pide.
+    """
+    if representation.area != 'derivatives':
+        return stored_file_location(representation.area, representation.name)
+    source_path = get_storage().local_path('content', filename)
+    if source_path is None:
+        return None, None
+    path = get_derivative_cache().get_or_create(filename, representation.name, lambda f: derivatives.render_derivative(
+        source_path, f, quality=FALLBACK_QUALITY, fmt=FALLBACK_FORMAT))
+    return path, f"derivatives/{quote(filename)}"
+
+def send_cdn_file(folder, filename, etag=None, location='content'):
+    """Entrega un archivo del CDN con ETag, Cache-Control inmutable, 304 y rangos.
+
+    Las peticiones condicionales se responden antes de abrir el archivo. Con
+    ``X_ACCEL_REDIRECT_PREFIX`` la transferencia la hace nginx (sendfile).
+    """
+    if etag and request.if_none_match.contains_weak(etag):
+        response = app.response_class(status=304)
+    elif app.config['X_ACCEL_REDIRECT_PREFIX']:
+        path = safe_join(folder, filename)
+        if path is None or not os.path.isfile(path):
+            abort(404)
+        response = app.response_class(mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+        response.headers['X-Accel-Redirect'] = f"{app.config['X_ACCEL_REDIRECT_PREFIX']}/{location}/{quote(filename)}"
+    else:
+        response = send_from_directory(folder, filename, etag=etag or True)
+    if etag:
+        response.set_etag(etag)
+    response.headers['Cache-Control'] = app.config['CDN_CACHE_CONTROL']
+    return response
+
+def stored_file_location(area, filename):
+    """``(ruta local, destino de X-Accel)`` de un archivo guardado; ``(None, None)`` si no existe."""
+    store = get_storage()
+    path = store.local_path(area, filename)
+    # Con un backend remoto la copia local vive en la caché (/_accel/cache/ en nginx)
+    return path, area if store.is_local else f'cache/{area}'
+
+def send_stored_file(area, filename, etag):
+    if etag and request.if_none_match.contains_weak(etag):
+        # No hace falta buscar el archivo (ni descargarlo del bucket)
+        return send_cdn_file(None, filename, etag)
+    path, location = stored_file_location(area, filename)
+    if path is None:
+        abort(404)
+    return send_cdn_file(os.path.dirname(path), filename, etag, location=location)
+
 @app.route('/cdn/<filename>')
 def serve_file(filename):
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    representation = content_representation(filename, request.accept_mimetypes, request.accept_encodings)
+    if representation.etag and request.if_none_match.contains_weak(representation.etag):
+        response = send_cdn_file(None, representation.name, representation.etag)
+    else:
+        try:
+            path, location = representation_location(filename, representation)
+        except derivatives.DerivativeError:
+            abort(415)
+        if path is None:
+            abort(404)
+        response = send_cdn_file(os.path.dirname(path), representation.name, representation.etag, location=location)
+        if representation.encoding:
+            response.headers['Content-Encoding'] = representation.encoding
+    for header in representation.vary:
+        response.vary.add(header)
+    return response
+
+@app.route('/cdn/<int:width>x<int:height>/<filename>')
+def serve_derivative(width, height, filename):
+    fit = request.args.get('fit', 'contain')
+    fmt = request.args.get('format', 'webp')
+    quality = request.args.get('q', 80, type=int)
+    if ((width, height) not in app.config['DERIVATIVE_SIZES'] or fit not in derivatives.FIT_MODES
+            or fmt not in derivatives.FORMATS or quality not in app.config['DERIVATIVE_QUALITIES']):
+        abort(400)
+
+    name = derivatives.derivative_name(width, height, fit, quality, fmt)
+    content_hash = asset_etag(filename)
+    etag = f"{content_hash}-{name}" if content_hash else None
+    if etag and request.if_none_match.contains_weak(etag):
+        return send_cdn_file(None, name, etag)
+
+    source_path = get_storage().local_path('content', filename)
+    if source_path is None:
+        abort(404)
+
+    try:
+        path = get_derivative_cache().get_or_create(filename, name, lambda f: derivatives.render_derivative(
+            source_path, f, width, height, fit, quality, fmt))
+    except derivatives.DerivativeError:
+        abort(415)
+    return send_cdn_file(os.path.dirname(path), name, etag, location=f"derivatives/{quote(filename)}")
+
+@app.route('/cdn/variants/<filename>')
+def serve_variant(filename):
+    return send_stored_file('variants', filename, variant_etag(filename))
 
 @app.route('/cdn/thumbnails/<filename>')
 def serve_thumbnail(filename):
-    return send_from_directory(app.config['THUMBNAIL_FOLDER'], filename)
+    return send_stored_file('thumbnails', filename, asset_etag(filename, 'thumbnails'))
 
 @app.route('/static/<filename>')
 def serve_static(filename):
     return send_from_directory('static', filename)
 
+@app.cli.command('reindex')
+def reindex_command():
+    """Reconstruye el índice de archivos a partir del almacenamiento."""
+    total = open_index(asset_index_path()).rebuild(get_storage())
+    print(f"✅ Índice reconstruido: {total} archivos")
+
+@app.cli.command('gc')
+@click.option('--dry-run', is_flag=True, help='Solo informa lo que se borraría.')
+@click.option('--grace-minutes', default=cleanup.DEFAULT_GRACE_SECONDS // 60, show_default=True,
+              help='No toca nada más reciente que esto (subidas en curso).')
+def gc_command(dry_run, grace_minutes):
+    """Borra miniaturas, variantes, cachés y subidas que quedaron sin archivo principal."""
+    report = cleanup.collect_garbage(get_storage(), open_index(asset_index_path()), app.config['DATA_FOLDER'],
+                                     get_derivative_cache(), grace_minutes * 60, dry_run)
+    for kind, count in sorted(report.counts.items()):
+        print(f"   {kind}: {count} ({report.bytes[kind] / (1024 * 1024):.1f} MB)")
+    verb = 'Se liberarían' if dry_run else 'Liberados'
+    print(f"✅ {verb} {report.total_bytes / (1024 * 1024):.1f} MB en {report.total_files} archivos")
+
 if __name__ == '__main__':
+    prepare_startup()
     app.run(host='0.0.0.0', port=5000)
@@ -0,0 +1,206 @@
+"""Punto de entrada ASGI para servir ``/cdn/`` sin nginx delante.
+
+Uso::
+
+    uvicorn asgi:application --host 0.0.0.0 --port 8000
+
+Las descargas de ``/cdn/<archivo>``, ``/cdn/thumbnails/`` y ``/cdn/variants/``
+se atienden en el event loop: un solo proceso mantiene miles de conexiones
+keep-alive abiertas, aunque los clientes sean lentos. El resto de las rutas
+(panel, subidas, variantes redimensionadas) sigue siendo la app Flask. Corre
+en un pool de hilos, así el trabajo de imágenes no bloquea el loop.
+"""
+import asyncio
+import mimetypes
+import os
+import re
+import stat
+import time
+from urllib.parse import quote
+
+from a2wsgi import WSGIMiddleware
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import http_date, parse_accept_header, parse_etags, parse_range_header, quote_etag
+
+import derivatives
+import metrics
+from app import (Representation, app, asset_etag, content_representation, prepare_startup, representation_location,
+                 variant_etag)
+
+CHUNK_SIZE = 256 * 1024
+# Hilos para las peticiones que atiende Flask (subidas, panel, redimensionado)
+WSGI_THREADS = int(os.getenv('ASGI_WSGI_THREADS', '16'))
+
+# (patrón, área de almacenamiento, endpoint para las métricas)
+CDN_ROUTES = (
+    (re.compile(r'^/cdn/thumbnails/([^/]+)$'), 'thumbnails', 'serve_thumbnail'),
+    (re.compile(r'^/cdn/variants/([^/]+)$'), 'variants', 'serve_variant'),
+    (re.compile(r'^/cdn/([^/]+)$'), 'content', 'serve_file'),
+)
+
+
+def cdn_representation(area, endpoint, filename, accept, accept_encoding):
+    if endpoint == 'serve_thumbnail':
+        return Representation(area, filename, asset_etag(filename, 'thumbnails'), None, ())
+    if endpoint == 'serve_variant':
+        return Representation(area, filename, variant_etag(filename), None, ())
+    return content_representation(filename, parse_accept_header(accept, MIMEAccept), parse_accept_header(accept_encoding))
+
+def open_representation(filename, representation):
+    """Abre la copia elegida y devuelve ``(archivo, stat, destino X-Accel)``, o ``None``.
+
+    Con un backend remoto la primera lectura la descarga a la caché local (y
+    el JPEG para clientes sin WebP se genera), por eso se llama desde el pool
+    de hilos.
+    """
+    path, location = representation_location(filename, representation)
+    if path is None:
+        return None
+    try:
+        f = open(path, 'rb')
+    except (FileNotFoundError, IsADirectoryError, NotADirectoryError):
+        return None
+    file_stat = os.fstat(f.fileno())
+    if not stat.S_ISREG(file_stat.st_mode):
+        f.close()
+        return None
+    return f, file_stat, location
+
+def encode_headers(headers):
+    return [(name.lower().encode('latin-1'), str(value).encode('latin-1')) for name, value in headers]
+
+async def send_empty(send, status, headers):
+    await send({'type': 'http.response.start', 'status': status, 'headers': encode_headers(headers)})
+    await send({'type': 'http.response.body', 'body': b''})
+    return 0
+
+async def wait_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+async def send_file(scope, receive, send, f, start, length):
+    """Envía ``length`` bytes desde ``start`` con la mejor opción que ofrezca el servidor.
+
+    Con las extensiones ``pathsend``/``zerocopysend`` el servidor usa sendfile
+    (sin copiar a Python); si no, se lee por bloques en el pool de hilos para
+    no bloquear el loop con el disco.
+    """
+    extensions = scope.get('extensions') or {}
+    if 'http.response.pathsend' in extensions and start == 0 and length == os.fstat(f.fileno()).st_size:
+        await send({'type': 'http.response.pathsend', 'path': os.path.abspath(f.name)})
+        return
+    if 'http.response.zerocopysend' in extensions:
+        await send({'type': 'http.response.zerocopysend', 'file': f, 'offset': start, 'count': length})
+        return
+
+    loop = asyncio.get_running_loop()
+    # Si el cliente se desconecta se deja de leer el disco
+    disconnected = asyncio.ensure_future(wait_disconnect(receive))
+    try:
+        await loop.run_in_executor(None, f.seek, start)
+        remaining = length
+        while remaining > 0 and not disconnected.done():
+            chunk = await loop.run_in_executor(None, f.read, min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': remaining > 0})
+        if remaining and not disconnected.done():
+            # El archivo se acortó mientras se enviaba: se cierra la respuesta igual
+            await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        disconnected.cancel()
+
+async def serve_cdn(scope, receive, send, area, endpoint, filename):
+    """Mismas reglas que ``send_cdn_file``: ETag del índice, 304, rangos e inmutable."""
+    loop = asyncio.get_running_loop()
+    request_headers = {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope['headers']}
+    representation = await loop.run_in_executor(None, cdn_representation, area, endpoint, filename,
+                                                request_headers.get('accept'), request_headers.get('accept-encoding'))
+    etag = representation.etag
+    headers = [('Cache-Control', app.config['CDN_CACHE_CONTROL'])]
+    if etag:
+        headers.append(('ETag', quote_etag(etag)))
+    if representation.vary:
+        headers.append(('Vary', ', '.join(representation.vary)))
+
+    if etag and parse_etags(request_headers.get('if-none-match')).contains_weak(etag):
+        return await send_empty(send, 304, headers)
+
+    try:
+        opened = await loop.run_in_executor(None, open_representation, filename, representation)
+    except derivatives.DerivativeError:
+        return await send_empty(send, 415, [('Content-Type', 'text/plain')])
+    if opened is None:
+        return await send_empty(send, 404, [('Content-Type', 'text/plain')])
+    f, file_stat, location = opened
+    try:
+        headers += [
+            ('Content-Type', mimetypes.guess_type(representation.name)[0] or 'application/octet-stream'),
+            ('Last-Modified', http_date(file_stat.st_mtime)),
+            ('Accept-Ranges', 'bytes'),
+        ]
+        if representation.encoding:
+            headers.append(('Content-Encoding', representation.encoding))
+        if app.config['X_ACCEL_REDIRECT_PREFIX']:
+            headers.append(('X-Accel-Redirect',
+                            f"{app.config['X_ACCEL_REDIRECT_PREFIX']}/{location}/{quote(representation.name)}"))
+            return await send_empty(send, 200, headers)
+
+        status, start, length = 200, 0, file_stat.st_size
+        range_header = parse_range_header(request_headers.get('range'))
+        if_range = request_headers.get('if-range')
+        if range_header and (not if_range or (etag and parse_etags(if_range).contains(etag))):
+            byte_range = range_header.range_for_length(file_stat.st_size)
+            if byte_range is None:
+                return await send_empty(send, 416, headers + [('Content-Range', f'bytes */{file_stat.st_size}')])
+            start, stop = byte_range
+            status, length = 206, stop - start
+            headers.append(('Content-Range', f'bytes {start}-{stop - 1}/{file_stat.st_size}'))
+        headers.append(('Content-Length', length))
+
+        await send({'type': 'http.response.start', 'status': status, 'headers': encode_headers(headers)})
+        if scope['method'] == 'HEAD' or not length:
+            await send({'type': 'http.response.body', 'body': b''})
+            return 0
+        await send_file(scope, receive, send, f, start, length)
+        return length
+    finally:
+        await loop.run_in_executor(None, f.close)
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            # Validación y precalentamiento (ver gunicorn.conf.py) antes de aceptar conexiones
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, prepare_startup)
+            except RuntimeError as e:
+                await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                return
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+wsgi_application = WSGIMiddleware(app, workers=WSGI_THREADS)
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+
+    if scope['type'] == 'http' and scope['method'] in ('GET', 'HEAD'):
+        path = scope['path']
+        root_path = scope.get('root_path', '')
+        if root_path and path.startswith(root_path):
+            path = path[len(root_path):]
+        for pattern, area, endpoint in CDN_ROUTES:
+            match = pattern.match(path)
+            if match:
+                started = time.perf_counter()
+                sent = await serve_cdn(scope, receive, send, area, endpoint, match.group(1))
+                metrics.observe_request(endpoint, time.perf_counter() - started, 0, sent)
+                return
+
+    await wsgi_application(scope, receive, send)
@@ -0,0 +1,320 @@
+import base64
+import hashlib
+import json
+import mimetypes
+import os
+import sqlite3
+import threading
+import time
+from PIL import Image
+
+import similarity
+import svg
+
+SORT_COLUMNS = {'created': 'created_at', 'name': 'filename', 'size': 'size'}
+# Parámetros por consulta (SQLite antiguo admite hasta 999)
+BATCH_SIZE = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS assets (
+    filename TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    width INTEGER,
+    height INTEGER,
+    content_hash TEXT,
+    source_hash TEXT,
+    mime_type TEXT,
+    thumbnail TEXT,
+    thumbnail_hash TEXT,
+    variants TEXT,
+    encodings TEXT,
+    created_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+INSERT OR IGNORE INTO counters (name, value) VALUES ('assets', 0);
+-- Reconstrucciones completas; mientras sea 0 el índice puede no tener todo lo publicado
+INSERT OR IGNORE INTO counters (name, value) VALUES ('rebuilds', 0);
+CREATE TRIGGER IF NOT EXISTS assets_count_insert AFTER INSERT ON assets
+BEGIN UPDATE counters SET value = value + 1 WHERE name = 'assets'; END;
+CREATE TRIGGER IF NOT EXISTS assets_count_delete AFTER DELETE ON assets
+BEGIN UPDATE counters SET value = value - 1 WHERE name = 'assets'; END;
+"""
+
+# Columnas agregadas después de la primera versión del esquema
+MIGRATIONS = {
+    'source_hash': 'TEXT',
+    'thumbnail_hash': 'TEXT',
+    'variants': 'TEXT',
+    'encodings': 'TEXT',
+    'dhash': 'INTEGER',
+    'dhash_0': 'INTEGER',
+    'dhash_1': 'INTEGER',
+    'dhash_2': 'INTEGER',
+    'dhash_3': 'INTEGER',
+}
+
+INDEXES = """
+CREATE INDEX IF NOT EXISTS assets_created ON assets (created_at, filename);
+CREATE INDEX IF NOT EXISTS assets_size ON assets (size, filename);
+CREATE INDEX IF NOT EXISTS assets_mime ON assets (mime_type, created_at, filename);
+CREATE INDEX IF NOT EXISTS assets_content_hash ON assets (content_hash);
+CREATE INDEX IF NOT EXISTS assets_source_hash ON assets (source_hash);
+CREATE INDEX IF NOT EXISTS assets_dhash_0 ON assets (dhash_0);
+CREATE INDEX IF NOT EXISTS assets_dhash_1 ON assets (dhash_1);
+CREATE INDEX IF NOT EXISTS assets_dhash_2 ON assets (dhash_2);
+CREATE INDEX IF NOT EXISTS assets_dhash_3 ON assets (dhash_3);
+"""
+
+COLUMNS = ('size', 'width', 'height', 'content_hash', 'source_hash', 'mime_type', 'thumbnail', 'thumbnail_hash', 'variants',
+           'encodings', 'dhash', 'dhash_0', 'dhash_1', 'dhash_2', 'dhash_3', 'created_at')
+
+
+class InvalidCursor(ValueError):
+    """El cursor de paginación no es válido para el orden solicitado."""
+
+
+_open_indexes = {}
+
+def open_index(path):
+    """Devuelve la instancia compartida del índice guardado en ``path``."""
+    if path not in _open_indexes:
+        _open_indexes[path] = AssetIndex(path)
+    return _open_indexes[path]
+
+def is_built(path):
+    """``True`` si el índice en ``path`` ya terminó una reconstrucción completa.
+
+    Usa una conexión propia que se cierra enseguida, así el master de gunicorn
+    no se queda con una abierta que heredarían los workers.
+    """
+    if not os.path.exists(path):
+        return False
+    conn = sqlite3.connect(path, timeout=30)
+    try:
+        row = conn.execute("SELECT value FROM counters WHERE name = 'rebuilds'").fetchone()
+    except sqlite3.OperationalError:  # todavía sin tablas
+        return False
+    finally:
+        conn.close()
+    return bool(row and row[0])
+
+def file_hash(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def describe_file(path, thumbnail_path=None, created_at=None):
+    """Obtiene los metadatos que se guardan en el índice para un archivo publicado.
+
+    ``thumbnail_path`` es la ruta local de su miniatura, si la tiene; de ella
+    sale el hash perceptual (ver ``similarity``).
+    """
+    stat = os.stat(path)
+    filename = os.path.basename(path)
+    width = height = None
+    try:
+        # Solo lee la cabecera, no decodifica los pixeles
+        with Image.open(path) as img:
+            width, height = img.size
+    except Exception:
+        pass
+    thumbnail = thumbnail_hash = perceptual_hash = None
+    if thumbnail_path and os.path.exists(thumbnail_path):
+        thumbnail = os.path.basename(thumbnail_path)
+        thumbnail_hash = file_hash(thumbnail_path)
+        perceptual_hash = similarity.image_hash(thumbnail_path)
+    return {
+        'size': stat.st_size,
+        'width': width,
+        'height': height,
+        'content_hash': file_hash(path),
+        'mime_type': mimetypes.guess_type(filename)[0] or 'application/octet-stream',
+        'thumbnail': thumbnail,
+        'thumbnail_hash': thumbnail_hash,
+        'created_at': created_at if created_at is not None else stat.st_mtime,
+        **similarity.hash_columns(perceptual_hash),
+    }
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        raise InvalidCursor(cursor)
+    if not isinstance(values, list) or len(values) != 2:
+        raise InvalidCursor(cursor)
+    return values
+
+
+class AssetIndex:
+    """Índice persistente (SQLite) de los archivos publicados.
+
+    Cada hilo usa su propia conexión; el modo WAL permite que los workers de
+    gunicorn y los procesos de conversión escriban a la vez.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    @property
+    def db(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript(SCHEMA)
+            existing = {row['name'] for row in conn.execute('PRAGMA table_info(assets)')}
+            for column, column_type in MIGRATIONS.items():
+                if column not in existing:
+                    conn.execute(f'ALTER TABLE assets ADD COLUMN {column} {column_type}')
+            conn.executescript(INDEXES)
+            self._local.conn = conn
+        return conn
+
+    def add(self, filename, **metadata):
+        """Agrega o actualiza un archivo; solo se modifican las columnas recibidas.
+
+        La fecha de creación de un archivo ya indexado se conserva.
+        """
+        metadata.setdefault('created_at', time.time())
+        columns = [column for column in COLUMNS if column in metadata]
+        updates = ', '.join(f'{column} = excluded.{column}' for column in columns if column != 'created_at')
+        self.db.execute(
+            f"INSERT INTO assets (filename, {', '.join(columns)}) VALUES (?{', ?' * len(columns)}) "
+            f"ON CONFLICT (filename) DO UPDATE SET {updates}",
+            [filename] + [metadata[column] for column in columns],
+        )
+
+    def remove(self, filename):
+        self.db.execute('DELETE FROM assets WHERE filename = ?', (filename,))
+
+    def remove_many(self, filenames):
+        """Borra varias filas en una sola transacción."""
+        db = self.db
+        db.execute('BEGIN')
+        try:
+            db.executemany('DELETE FROM assets WHERE filename = ?', [(filename,) for filename in filenames])
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+
+    def get(self, filename):
+        row = self.db.execute('SELECT * FROM assets WHERE filename = ?', (filename,)).fetchone()
+        return dict(row) if row else None
+
+    def get_many(self, filenames):
+        """Devuelve ``{nombre: fila}`` de los nombres indexados, en consultas de hasta 500 nombres."""
+        filenames = list(filenames)
+        found = {}
+        for start in range(0, len(filenames), BATCH_SIZE):
+            batch = filenames[start:start + BATCH_SIZE]
+            rows = self.db.execute(f"SELECT * FROM assets WHERE filename IN ({', '.join('?' * len(batch))})", batch)
+            found.update((row['filename'], dict(row)) for row in rows)
+        return found
+
+    def filenames(self, created_before=None):
+        if created_before is None:
+            return [row[0] for row in self.db.execute('SELECT filename FROM assets')]
+        return [row[0] for row in self.db.execute('SELECT filename FROM assets WHERE created_at < ?', (created_before,))]
+
+    def find_by_source_hash(self, source_hash):
+        """Busca un archivo ya publicado que se generó a partir de los mismos bytes.
+
+        Solo ve archivos ya indexados: dos subidas idénticas que llegan a la
+        vez se convierten las dos (trabajo repetido, no un error; cada una
+        queda con su propio nombre y sus propios bytes).
+        """
+        row = self.db.execute('SELECT * FROM assets WHERE source_hash = ? LIMIT 1', (source_hash,)).fetchone()
+        return dict(row) if row else None
+
+    def similar(self, value, max_distance=similarity.DEFAULT_DISTANCE, limit=50, exclude=None):
+        """Archivos cuyo hash perceptual está a ``max_distance`` bits o menos de ``value``, del más parecido al menos.
+
+        Cada fila devuelta incluye ``distance``. Solo se leen las filas que
+        comparten un bloque cercano (ver ``similarity``), no el índice completo.
+        """
+        seen = {exclude}
+        found = {}
+        for column, values in similarity.probes(value, max_distance):
+            for start in range(0, len(values), BATCH_SIZE):
+                batch = values[start:start + BATCH_SIZE]
+                rows = self.db.execute(
+                    f"SELECT filename, dhash FROM assets WHERE {column} IN ({', '.join('?' * len(batch))})", batch)
+                for filename, stored in rows:
+                    if filename in seen:
+                        continue
+                    seen.add(filename)
+                    distance = similarity.distance(value, stored)
+                    if distance <= max_distance:
+                        found[filename] = distance
+        ranked = sorted(found.items(), key=lambda item: (item[1], item[0]))[:limit]
+        rows = self.get_many(filename for filename, _ in ranked)
+        return [dict(rows[filename], distance=distance) for filename, distance in ranked if filename in rows]
+
+    def count(self):
+        return self.db.execute("SELECT value FROM counters WHERE name = 'assets'").fetchone()[0]
+
+    def page(self, sort='created', order='desc', cursor=None, limit=50, mime_type=None):
+        """Devuelve ``(filas, siguiente_cursor)`` usando paginación por llave (keyset).
+
+        El costo no depende de cuántos archivos hay antes de la página pedida.
+        """
+        column = SORT_COLUMNS[sort]
+        direction = 'ASC' if order == 'asc' else 'DESC'
+        where, params = [], []
+        if mime_type:
+            where.append('mime_type = ?')
+            params.append(mime_type)
+        if cursor:
+            value, filename = decode_cursor(cursor)
+            where.append(f"({column}, filename) {'>' if direction == 'ASC' else '<'} (?, ?)")
+            params.extend([value, filename])
+        sql = 'SELECT * FROM assets'
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += f' ORDER BY {column} {direction}, filename {direction} LIMIT ?'
+        params.append(limit + 1)
+
+        rows = [dict(row) for row in self.db.execute(sql, params)]
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor([rows[-1][column], rows[-1]['filename']])
+        return rows, next_cursor
+
+    def rebuild(self, storage):
+        """Reconstruye el índice a partir de los archivos publicados en ``storage``.
+
+        Con un backend remoto cada archivo se descarga a la caché local para leerlo.
+        """
+        seen = set()
+        names = set(storage.list('content'))
+        for name in names:
+            if svg.is_encoded_copy(name):
+                continue
+            path = storage.local_path('content', name)
+            stored = storage.stat('content', name)
+            if path is None or stored is None:
+                continue
+            metadata = describe_file(path, storage.local_path('thumbnails', svg.thumbnail_name(name)), stored.mtime)
+            metadata['encodings'] = ','.join(encoding for encoding in svg.ENCODINGS
+                                             if svg.encoded_name(name, encoding) in names) or None
+            self.add(name, **metadata)
+            seen.add(name)
+        for row in self.db.execute('SELECT filename FROM assets').fetchall():
+            if row['filename'] not in seen:
+                self.remove(row['filename'])
+        # Solo al final: si el proceso muere a mitad, el próximo arranque lo vuelve a intentar
+        self.db.execute("UPDATE counters SET value = value + 1 WHERE name = 'rebuilds'")
+        return len(seen)
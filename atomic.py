@@ -0,0 +1,100 @@
+"""Escrituras atómicas: temporal en la misma carpeta, ``fsync`` y ``os.replace``.
+
+Quien lee un archivo publicado (``/cdn/``, nginx con sendfile) ve la versión
+anterior o la nueva completa, nunca una a medio escribir: el temporal tiene
+un nombre oculto (``.<nombre>.<aleatorio>.tmp``) que no se sirve ni se lista,
+y el rename dentro de un mismo sistema de archivos es atómico. El modo de
+``fsync`` decide qué sobrevive a un corte de luz:
+
+- ``none``: solo el rename; tras un corte el archivo puede quedar vacío.
+- ``file``: los datos llegan al disco antes del rename (por defecto).
+- ``full``: además se sincroniza la carpeta, así el rename también persiste.
+"""
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+FSYNC_MODES = ('none', 'file', 'full')
+TEMP_SUFFIX = '.tmp'
+CHUNK_SIZE = 1024 * 1024
+
+# mkstemp crea los archivos con permisos 0600: se usan los mismos que open()
+# para que nginx (otro usuario) pueda leer lo publicado
+_umask = os.umask(0)
+os.umask(_umask)
+FILE_MODE = 0o666 & ~_umask
+
+# fdatasync no escribe metadatos que no hacen falta para leer (ej. fecha de acceso)
+_datasync = getattr(os, 'fdatasync', os.fsync)
+
+
+def check_mode(fsync):
+    if fsync not in FSYNC_MODES:
+        raise ValueError(f"Modo de fsync desconocido: {fsync} (usa {', '.join(FSYNC_MODES)})")
+    return fsync
+
+def is_temporary(name):
+    return name.startswith('.') and name.endswith(TEMP_SUFFIX)
+
+def sync_file(f, fsync):
+    if fsync != 'none':
+        f.flush()
+        _datasync(f.fileno())
+
+def sync_folder(folder, fsync):
+    """Persiste las entradas de ``folder`` (el rename) en modo ``full``."""
+    if fsync != 'full':
+        return
+    try:
+        fd = os.open(folder, os.O_RDONLY)
+    except OSError:  # Windows no permite abrir carpetas
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+@contextmanager
+def atomic_write(path, fsync='file', mode='wb'):
+    """Abre un temporal junto a ``path``; al salir sin errores lo sincroniza y lo renombra a ``path``.
+
+    Si hay una excepción el temporal se borra y ``path`` queda como estaba.
+    """
+    folder = os.path.dirname(path) or '.'
+    fd, tmp_path = tempfile.mkstemp(dir=folder, prefix=f'.{os.path.basename(path)}.', suffix=TEMP_SUFFIX)
+    try:
+        with os.fdopen(fd, mode) as f:
+            if hasattr(os, 'fchmod'):
+                os.fchmod(f.fileno(), FILE_MODE)
+            yield f
+            sync_file(f, fsync)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+    sync_folder(folder, fsync)
+
+def copy_file(source_path, path, fsync='file'):
+    with open(source_path, 'rb') as source, atomic_write(path, fsync) as f:
+        shutil.copyfileobj(source, f, CHUNK_SIZE)
+
+def move_file(source_path, path, fsync='file'):
+    """Mueve un archivo ya escrito a ``path`` de forma atómica, sincronizándolo antes según ``fsync``."""
+    if fsync != 'none':
+        with open(source_path, 'r+b') as f:
+            _datasync(f.fileno())
+    try:
+        os.replace(source_path, path)
+    except OSError:
+        # Otro sistema de archivos (ej. DATA_FOLDER en otro volumen): se copia
+        # a un temporal junto al destino en vez de escribir sobre ``path``
+        copy_file(source_path, path, fsync)
+        os.remove(source_path)
+        return
+    sync_folder(os.path.dirname(path) or '.', fsync)
@@ -0,0 +1,308 @@
+"""Benchmarks de las rutas críticas: conversión, miniaturas, subida, listado y entrega.
+
+Uso::
+
+    python benchmark.py --output resultados.json
+    python benchmark.py --baseline resultados.json --max-regression 0.25
+
+Con ``--baseline`` compara la mediana (p50) de cada caso contra una corrida
+anterior y termina con código 1 si alguno empeoró más del umbral.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+from io import BytesIO
+
+import PIL
+from PIL import Image
+
+SIZES = {'small': (640, 480), 'medium': (1920, 1080), 'large': (4000, 3000)}
+INDEX_SIZES = (10000, 100000)
+
+
+def percentile(values, pct):
+    """Percentil por rango más cercano (``pct`` entre 0 y 100)."""
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+def summarize(durations, size_bytes=None):
+    total = sum(durations)
+    result = {
+        'iterations': len(durations),
+        'mean': total / len(durations),
+        'p50': percentile(durations, 50),
+        'p99': percentile(durations, 99),
+        'ops_per_sec': len(durations) / total if total else None,
+    }
+    if size_bytes:
+        result['mb_per_sec'] = size_bytes * len(durations) / total / (1024 * 1024) if total else None
+    return result
+
+def measure(fn, iterations, setup=None, warmup=1):
+    """Ejecuta ``fn(setup())`` y devuelve las duraciones; ``setup`` no se mide."""
+    durations = []
+    for i in range(warmup + iterations):
+        arg = setup() if setup else None
+        start = time.perf_counter()
+        fn(arg)
+        elapsed = time.perf_counter() - start
+        if i >= warmup:
+            durations.append(elapsed)
+    return durations
+
+
+def synthetic_image(size):
+    """Imagen determinista con detalle (fractal + degradados) para que comprimir cueste como una foto."""
+    detail = Image.effect_mandelbrot(size, (-2.0, -1.2, 0.8, 1.2), 64)
+    horizontal = Image.linear_gradient('L').resize(size)
+    vertical = Image.linear_gradient('L').rotate(90).resize(size)
+    return Image.merge('RGB', (detail, horizontal, vertical))
+
+def build_corpus(folder, sizes):
+    """Genera el corpus sintético y devuelve ``{nombre: ruta}``."""
+    os.makedirs(folder, exist_ok=True)
+    corpus = {}
+    for label, size in sizes.items():
+        img = synthetic_image(size)
+        for ext, fmt in (('jpg', 'JPEG'), ('png', 'PNG'), ('webp', 'WEBP')):
+            path = os.path.join(folder, f'{label}.{ext}')
+            img.save(path, fmt, quality=90) if fmt != 'PNG' else img.save(path, fmt)
+            corpus[f'{label}.{ext}'] = path
+        # JPEG de cámara girado: la orientación EXIF obliga a transponer
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        path = os.path.join(folder, f'{label}-rotated.jpg')
+        img.save(path, 'JPEG', quality=90, exif=exif.tobytes())
+        corpus[f'{label}-rotated.jpg'] = path
+
+    frames = [synthetic_image((320, 240)).rotate(angle) for angle in range(0, 360, 30)]
+    path = os.path.join(folder, 'animated.gif')
+    frames[0].save(path, save_all=True, append_images=frames[1:], duration=80, loop=0)
+    corpus['animated.gif'] = path
+
+    path = os.path.join(folder, 'icon.svg')
+    circles = ''.join(f'<circle cx="{i * 7 % 500}" cy="{i * 13 % 500}" r="{i % 40 + 5}" fill="#{i * 99991 % 0xffffff:06x}"/>'
+                      for i in range(500))
+    with open(path, 'w') as f:
+        f.write(f'<?xml version="1.0"?><svg xmlns="http://www.w3.org/2000/svg" width="500" height="500">{circles}</svg>')
+    corpus['icon.svg'] = path
+    return corpus
+
+
+def bench_pipeline(corpus, work_dir, iterations):
+    from pipeline import compress_and_convert_image, create_thumbnail
+
+    results = {}
+    for name, path in corpus.items():
+        if name.endswith('.svg'):
+            continue
+        size = os.path.getsize(path)
+        copy_path = os.path.join(work_dir, 'source' + os.path.splitext(name)[1])
+        webp_path = os.path.join(work_dir, 'converted.webp')
+
+        def copy_source(_path=path, _copy=copy_path):
+            # compress_and_convert_image borra el original: se copia en cada iteración
+            shutil.copyfile(_path, _copy)
+            return _copy
+
+        durations = measure(lambda source: compress_and_convert_image(source, webp_path), iterations, copy_source)
+        results[f'compress_and_convert_image[{name}]'] = summarize(durations, size)
+
+        thumb_path = os.path.join(work_dir, 'thumb.webp')
+        durations = measure(lambda _, _path=path: create_thumbnail(_path, thumb_path), iterations)
+        results[f'create_thumbnail[{name}]'] = summarize(durations, size)
+    return results
+
+def bench_http(app, corpus, iterations):
+    client = app.test_client()
+    results = {}
+    uploaded = {}
+    for name, path in corpus.items():
+        with open(path, 'rb') as f:
+            payload = f.read()
+        filenames = []
+
+        def upload(body, _name=name, _filenames=filenames):
+            response = client.post('/upload', data={'file': (BytesIO(body), _name)},
+                                   headers={'Accept': 'application/json'})
+            if response.status_code != 201:
+                raise RuntimeError(f'{_name}: {response.status_code} {response.get_data(as_text=True)}')
+            _filenames.append(response.get_json()['filename'])
+
+        counter = iter(range(sys.maxsize))
+
+        def unique_payload(_payload=payload):
+            # Bytes extra al final (los decodificadores los ignoran) para que la
+            # deduplicación no convierta las subidas repetidas en alias
+            return _payload + f'<!--{next(counter)}-->'.encode()
+
+        durations = measure(upload, iterations, unique_payload, warmup=0)
+        results[f'upload[{name}]'] = summarize(durations, len(payload))
+        uploaded[name] = filenames[0]
+
+    for name, filename in uploaded.items():
+        def serve(_, _filename=filename):
+            response = client.get(f'/cdn/{_filename}')
+            response.close()
+        results[f'serve_file[{name}]'] = summarize(measure(serve, iterations))
+
+        etag = client.get(f'/cdn/{filename}').headers.get('ETag')
+
+        def revalidate(_, _filename=filename, _etag=etag):
+            client.get(f'/cdn/{_filename}', headers={'If-None-Match': _etag}).close()
+        results[f'serve_file_304[{name}]'] = summarize(measure(revalidate, iterations))
+    return results
+
+def seed_index(asset_index, count):
+    """Llena el índice con ``count`` filas ficticias en una sola transacción."""
+    import random
+    import similarity
+
+    rng = random.Random(count)
+    now = time.time()
+    asset_index.db.execute('BEGIN')
+    for i in range(count):
+        asset_index.add(f'{i:08d}-seed.webp', size=1000 + i % 5000, width=800, height=600,
+                        content_hash=f'{i:064x}', mime_type='image/webp', created_at=now - i,
+                        **similarity.hash_columns(rng.getrandbits(64)))
+    asset_index.db.execute('COMMIT')
+
+def bench_index(app, data_root, index_sizes, iterations):
+    from asset_index import open_index
+
+    client = app.test_client()
+    results = {}
+    for count in index_sizes:
+        app.config['DATA_FOLDER'] = os.path.join(data_root, f'index-{count}')
+        os.makedirs(app.config['DATA_FOLDER'], exist_ok=True)
+        seed_index(open_index(os.path.join(app.config['DATA_FOLDER'], 'assets.sqlite3')), count)
+
+        for label, query in (('first_page', '/'), ('by_name', '/?sort=name&order=asc'), ('by_size', '/?sort=size'),
+                             ('api', '/api/files'), ('similar', '/api/files/00000000-seed.webp/similar'),
+                             ('similar_max', '/api/files/00000000-seed.webp/similar?distance=10')):
+            def listing(_, _query=query):
+                response = client.get(_query)
+                if response.status_code != 200:
+                    raise RuntimeError(f'{_query}: {response.status_code}')
+            results[f'index[{count}][{label}]'] = summarize(measure(listing, iterations))
+
+        # Página profunda: el costo no debe crecer con el número de archivos anteriores
+        cursor_query = '/?limit=200'
+        for _ in range(5):
+            html = client.get(cursor_query).get_data(as_text=True)
+            marker = 'cursor='
+            if marker not in html:
+                break
+            cursor = html.split(marker, 1)[1].split('"', 1)[0].split('&', 1)[0]
+            cursor_query = f'/?limit=200&cursor={cursor}'
+        results[f'index[{count}][deep_page]'] = summarize(measure(lambda _: client.get(cursor_query), iterations))
+    return results
+
+
+def compare(results, baseline, max_regression):
+    """Devuelve la lista de casos cuya mediana empeoró más de ``max_regression`` (fracción)."""
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get('results', {}).get(name)
+        if not previous or not previous.get('p50'):
+            continue
+        change = current['p50'] / previous['p50'] - 1
+        if change > max_regression:
+            regressions.append({'name': name, 'baseline_p50': previous['p50'], 'p50': current['p50'], 'change': change})
+    return regressions
+
+def run(args):
+    from app import app
+
+    work_dir = tempfile.mkdtemp(prefix='cdn-bench-')
+    previous = dict(app.config)
+    # Siempre carpetas temporales y disco local, aunque el entorno (ej. dentro del
+    # contenedor) apunte a /app/content, al índice real o a un bucket
+    content_folder = os.path.join(work_dir, 'content')
+    app.config.update(
+        TESTING=True,
+        PROCESSING_WORKERS=0,
+        STORAGE_BACKEND='local',
+        X_ACCEL_REDIRECT_PREFIX='',
+        UPLOAD_FOLDER=content_folder,
+        THUMBNAIL_FOLDER=os.path.join(content_folder, 'thumbnails'),
+        VARIANT_FOLDER=os.path.join(content_folder, 'variants'),
+        DATA_FOLDER=os.path.join(work_dir, 'data'),
+    )
+    try:
+        for key in ('UPLOAD_FOLDER', 'THUMBNAIL_FOLDER', 'VARIANT_FOLDER', 'DATA_FOLDER'):
+            os.makedirs(app.config[key], exist_ok=True)
+        sizes = {label: SIZES[label] for label in args.sizes}
+        corpus = build_corpus(os.path.join(work_dir, 'corpus'), sizes)
+        scratch = os.path.join(work_dir, 'scratch')
+        os.makedirs(scratch)
+
+        results = {}
+        results.update(bench_pipeline(corpus, scratch, args.iterations))
+        results.update(bench_http(app, corpus, args.iterations))
+        results.update(bench_index(app, os.path.join(work_dir, 'indexes'), args.index_sizes, args.iterations))
+    finally:
+        app.config.clear()
+        app.config.update(previous)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {
+        'meta': {
+            'timestamp': time.time(),
+            'python': platform.python_version(),
+            'pillow': PIL.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'iterations': args.iterations,
+        },
+        'results': results,
+    }
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--output', help='Archivo JSON donde guardar los resultados (por defecto, salida estándar)')
+    parser.add_argument('--baseline', help='Resultados de una corrida anterior para comparar')
+    parser.add_argument('--max-regression', type=float, default=0.25,
+                        help='Empeoramiento máximo permitido de la mediana, como fracción (por defecto 0.25)')
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--sizes', type=lambda v: v.split(','), default=list(SIZES),
+                        help=f"Tamaños del corpus a usar ({','.join(SIZES)})")
+    parser.add_argument('--index-sizes', type=lambda v: [int(n) for n in v.split(',')], default=list(INDEX_SIZES),
+                        help='Número de archivos en el índice para medir el listado')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    # Los mensajes de la app (✅/❌) van a stderr para no mezclarse con el JSON
+    with redirect_stdout(sys.stderr):
+        report = run(args)
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+        print(f"✅ Resultados guardados en {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(report['results'], baseline, args.max_regression)
+        for item in regressions:
+            print(f"❌ {item['name']}: p50 {item['baseline_p50'] * 1000:.1f} ms -> {item['p50'] * 1000:.1f} ms "
+                  f"(+{item['change']:.0%})", file=sys.stderr)
+        if regressions:
+            return 1
+        print(f"✅ Sin regresiones mayores a {args.max_regression:.0%}", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,195 @@
+"""Recolección de basura: borra lo que quedó sin dueño tras fallas o borrados a medias.
+
+Cada área del almacenamiento y cada carpeta local se recorre una sola vez
+(``os.scandir`` en disco, ``ListObjectsV2`` en S3) y se cruza con los nombres
+publicados usando conjuntos en memoria, así el costo crece linealmente con el
+número de archivos. Solo se pide el tamaño (``stat``) de lo que se va a borrar.
+"""
+import os
+import shutil
+import time
+
+import jobs
+import svg
+from atomic import is_temporary
+from pipeline import variant_source
+
+# Lo más reciente que esto puede pertenecer a una subida en curso
+DEFAULT_GRACE_SECONDS = 3600
+# Un temporal sin cambios desde hace esto ya no lo está escribiendo nadie
+TEMPORARY_GRACE_SECONDS = 300
+
+
+class Report:
+    """Archivos y bytes liberados por tipo de basura."""
+
+    def __init__(self, dry_run=False):
+        self.dry_run = dry_run
+        self.counts = {}
+        self.bytes = {}
+
+    def add(self, kind, size):
+        self.counts[kind] = self.counts.get(kind, 0) + 1
+        self.bytes[kind] = self.bytes.get(kind, 0) + (size or 0)
+
+    @property
+    def total_files(self):
+        return sum(self.counts.values())
+
+    @property
+    def total_bytes(self):
+        return sum(self.bytes.values())
+
+
+def tree_size(path):
+    """Bytes de un archivo o de una carpeta completa (recorrida con ``scandir``)."""
+    if not os.path.isdir(path):
+        try:
+            return os.stat(path).st_size
+        except FileNotFoundError:
+            return 0
+    total = 0
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                total += tree_size(entry.path)
+            else:
+                try:
+                    total += entry.stat(follow_symlinks=False).st_size
+                except FileNotFoundError:
+                    pass
+    return total
+
+def remove_path(path):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def collect_stored(storage, area, names, owner, published, cutoff, report, kind):
+    """Borra de ``area`` los nombres cuyo dueño (``owner(nombre)``) ya no está publicado."""
+    orphans = []
+    for name in names:
+        if owner(name) in published:
+            continue
+        stored = storage.stat(area, name)
+        if stored is None or stored.mtime > cutoff:
+            continue
+        orphans.append(name)
+        report.add(kind, stored.size)
+    if orphans and not report.dry_run:
+        storage.delete_many(area, orphans)
+
+def collect_entry(entry, cutoff, report, kind):
+    try:
+        if entry.stat(follow_symlinks=False).st_mtime > cutoff:
+            return
+    except FileNotFoundError:
+        return
+    report.add(kind, tree_size(entry.path))
+    if not report.dry_run:
+        remove_path(entry.path)
+
+def collect_local(folder, keep, cutoff, report, kind):
+    """Borra las entradas de ``folder`` (archivos o carpetas) para las que ``keep(nombre)`` es falso."""
+    if not os.path.isdir(folder):
+        return
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if not keep(entry.name):
+                collect_entry(entry, cutoff, report, kind)
+
+def finished_job(folder, name):
+    """``True`` si ``name`` es el estado de un trabajo que ya terminó (``done`` o ``failed``)."""
+    job_id, ext = os.path.splitext(name)
+    status = jobs.read_status(folder, job_id) if ext == '.json' else None
+    return status is not None and status.get('status') in (jobs.DONE, jobs.FAILED)
+
+def collect_cache(folder, keep_folder, keep_file, cutoff, report, kind):
+    """Recorre una caché en dos niveles (``<carpeta>/<subcarpeta>/<archivo>``, ver ``DerivativeCache``).
+
+    Las subcarpetas sin dueño se borran completas; en las demás solo los
+    archivos sin dueño y los temporales de una generación interrumpida.
+    """
+    if not os.path.isdir(folder):
+        return
+    with os.scandir(folder) as subfolders:
+        for subfolder in subfolders:
+            if subfolder.name.startswith('.') or not subfolder.is_dir(follow_symlinks=False):
+                continue  # .locks
+            if not keep_folder(subfolder.name):
+                collect_entry(subfolder, cutoff, report, kind)
+                continue
+            collect_local(subfolder.path, lambda name, _folder=subfolder.name: (
+                not is_temporary(name) and keep_file(_folder, name)), cutoff, report, kind)
+
+def collect_garbage(storage, asset_index, data_folder, derivative_cache=None, grace_seconds=DEFAULT_GRACE_SECONDS,
+                    dry_run=False):
+    """Reconcilia almacenamiento, índice y cachés; devuelve un ``Report``.
+
+    Se borran: miniaturas, variantes y copias precomprimidas cuyo archivo
+    principal no existe; filas del índice sin archivo; variantes en caché
+    de archivos borrados; subidas y carpetas de trabajo abandonadas en
+    ``incoming/``; estados de trabajos terminados; y archivos temporales a
+    medio escribir. Nada más reciente
+    que ``grace_seconds`` se toca, porque puede ser de una subida en curso.
+    Los archivos publicados que no están en el índice no se borran (``flask
+    reindex`` los agrega).
+    """
+    report = Report(dry_run)
+    cutoff = time.time() - grace_seconds
+
+    listed = {area: set(storage.list(area)) for area in ('content', 'thumbnails', 'variants')}
+    encoded = {name for name in listed['content'] if svg.is_encoded_copy(name)}
+    published = listed['content'] - encoded
+
+    collect_stored(storage, 'content', encoded, lambda name: os.path.splitext(name)[0], published, cutoff,
+                   report, 'precomprimidos')
+    collect_stored(storage, 'thumbnails', listed['thumbnails'], svg.thumbnail_source, published, cutoff,
+                   report, 'miniaturas')
+    collect_stored(storage, 'variants', listed['variants'], variant_source, published, cutoff,
+                   report, 'variantes')
+
+    # Filas del índice cuyo archivo ya no está (las nuevas pueden ser de archivos publicados después del listado)
+    missing = [filename for filename in asset_index.filenames(created_before=cutoff) if filename not in published]
+    for _ in missing:
+        report.add('índice', 0)
+    if missing and not dry_run:
+        asset_index.remove_many(missing)
+
+    if derivative_cache is not None:
+        collect_cache(derivative_cache.folder, lambda name: name in published, lambda folder, name: True,
+                      cutoff, report, 'caché de variantes')
+    storage_cache = getattr(storage, 'cache', None)
+    if storage_cache is not None:
+        # Copias locales de un bucket: <caché>/<área>/<nombre>
+        collect_cache(storage_cache.folder, lambda area: area in listed, lambda area, name: name in listed[area],
+                      cutoff, report, 'caché del bucket')
+    for folder in set(getattr(storage, 'folders', {}).values()):
+        collect_local(folder, lambda name: not is_temporary(name), cutoff, report, 'temporales')
+
+    # Subidas recibidas pero nunca procesadas (el proceso murió a mitad del trabajo)
+    collect_local(os.path.join(data_folder, 'incoming'), lambda name: False, cutoff, report, 'subidas abandonadas')
+    jobs_folder = os.path.join(data_folder, 'jobs')
+    collect_local(jobs_folder, lambda name: not is_temporary(name), cutoff, report, 'temporales')
+    # Un estado por subida: una vez terminado solo sirve a la página que lo consulta
+    collect_local(jobs_folder, lambda name: is_temporary(name) or not finished_job(jobs_folder, name), cutoff,
+                  report, 'estados de trabajos')
+    return report
+
+def recover(folders=(), cache_folders=(), grace_seconds=TEMPORARY_GRACE_SECONDS):
+    """Borra los temporales que dejó un proceso muerto entre escribir y renombrar; devuelve un ``Report``.
+
+    Se ejecuta al arrancar. Solo revisa ``folders`` y el segundo nivel de
+    ``cache_folders`` (no el índice ni los archivos publicados), así es rápido.
+    """
+    report = Report()
+    cutoff = time.time() - grace_seconds
+    for folder in folders:
+        collect_local(folder, lambda name: not is_temporary(name), cutoff, report, 'temporales')
+    for folder in cache_folders:
+        collect_cache(folder, lambda name: True, lambda folder, name: True, cutoff, report, 'temporales')
+    return report
@@ -0,0 +1,184 @@
+import hashlib
+import os
+import shutil
+import threading
+import time
+from PIL import Image, ImageOps
+
+import atomic
+
+try:
+    import fcntl
+except ImportError:  # Windows: solo se evita el trabajo duplicado dentro del proceso
+    fcntl = None
+
+FORMATS = {'webp': 'WEBP', 'jpeg': 'JPEG', 'png': 'PNG'}
+FIT_MODES = ('contain', 'cover')
+LOCK_STRIPES = 64
+# Los accesos solo actualizan la fecha de uso si es más vieja que esto (LRU aproximado)
+TOUCH_INTERVAL = 3600
+# JPEG no tiene transparencia: se aplana sobre este fondo. Va en el nombre (y
+# en el ETag) para no reutilizar copias generadas antes con el fondo perdido
+JPEG_BACKGROUND = 'white'
+
+
+class DerivativeError(Exception):
+    """La imagen de origen no se puede transformar."""
+
+
+def parse_sizes(value):
+    """Convierte ``"64x64,320x240"`` en ``{(64, 64), (320, 240)}``."""
+    sizes = set()
+    for item in value.split(','):
+        item = item.strip().lower()
+        if item:
+            width, height = item.split('x')
+            sizes.add((int(width), int(height)))
+    return sizes
+
+def background_suffix(fmt):
+    return f'-{JPEG_BACKGROUND}' if fmt == 'jpeg' else ''
+
+def derivative_name(width, height, fit, quality, fmt):
+    return f"{width}x{height}-{fit}-q{quality}{background_suffix(fmt)}.{fmt}"
+
+def conversion_name(quality, fmt):
+    """Nombre en la caché de una copia a tamaño original en otro formato."""
+    return f"original-q{quality}{background_suffix(fmt)}.{fmt}"
+
+def flatten(img, background=JPEG_BACKGROUND):
+    """Compone la transparencia sobre ``background``; ``convert('RGB')`` solo la descartaría."""
+    if img.mode in ('RGBA', 'LA', 'PA') or (img.mode == 'P' and 'transparency' in img.info):
+        rgba = img.convert('RGBA')
+        flat = Image.new('RGB', rgba.size, background)
+        flat.paste(rgba, mask=rgba.getchannel('A'))
+        return flat
+    return img.convert('RGB')
+
+def render_derivative(source_path, dest_file, width=None, height=None, fit='contain', quality=80, fmt='webp'):
+    """Sin ``width``/``height`` solo cambia el formato, a tamaño original."""
+    try:
+        with Image.open(source_path) as img:
+            img = ImageOps.exif_transpose(img)
+            if width is not None and fit == 'cover':
+                img = ImageOps.fit(img, (width, height), Image.LANCZOS)
+            elif width is not None:
+                img.thumbnail((width, height), Image.LANCZOS, reducing_gap=3.0)
+            if fmt == 'jpeg' and img.mode not in ('RGB', 'L'):
+                img = flatten(img)
+            img.save(dest_file, format=FORMATS[fmt], quality=quality)
+    except (OSError, ValueError) as e:
+        raise DerivativeError(str(e))
+
+
+class DerivativeCache:
+    """Caché en disco de imágenes redimensionadas con límite de tamaño y desalojo LRU.
+
+    Los archivos viven en ``<folder>/<archivo original>/<variante>`` para poder
+    borrar todas las variantes de un archivo sin recorrer la caché completa.
+    """
+
+    def __init__(self, folder, max_bytes, fsync='file'):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.fsync = atomic.check_mode(fsync)
+        self._size = None
+        self._lock = threading.Lock()
+
+    def path(self, filename, name):
+        return os.path.join(self.folder, filename, name)
+
+    def _stripe_lock_path(self, filename, name):
+        stripe = int(hashlib.md5(f'{filename}/{name}'.encode()).hexdigest(), 16) % LOCK_STRIPES
+        locks_folder = os.path.join(self.folder, '.locks')
+        os.makedirs(locks_folder, exist_ok=True)
+        return os.path.join(locks_folder, f'{stripe}.lock')
+
+    def get_or_create(self, filename, name, render):
+        """Devuelve la ruta de la variante, generándola con ``render(archivo)`` si falta.
+
+        Un candado por franja (compartido entre procesos con ``flock``) evita
+        que dos peticiones generen la misma variante a la vez.
+        """
+        path = self.path(filename, name)
+        if self._touch(path):
+            return path
+
+        with open(self._stripe_lock_path(filename, name), 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            else:
+                self._lock.acquire()
+            try:
+                if self._touch(path):
+                    return path
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with atomic.atomic_write(path, self.fsync) as f:
+                    render(f)
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+                else:
+                    self._lock.release()
+
+        self._account(os.path.getsize(path))
+        return path
+
+    def _touch(self, path):
+        try:
+            mtime = os.stat(path).st_mtime
+        except FileNotFoundError:
+            return False
+        now = time.time()
+        if now - mtime > TOUCH_INTERVAL:
+            os.utime(path, (now, now))
+        return True
+
+    def _account(self, size):
+        with self._lock:
+            if self._size is None:
+                self._size = self.usage()
+            else:
+                self._size += size
+            if self._size <= self.max_bytes:
+                return
+        self.evict()
+
+    def usage(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def _entries(self):
+        if not os.path.isdir(self.folder):
+            return
+        with os.scandir(self.folder) as folders:
+            for folder in folders:
+                if not folder.is_dir() or folder.name.startswith('.'):
+                    continue
+                with os.scandir(folder.path) as entries:
+                    for entry in entries:
+                        if entry.is_file() and not entry.name.startswith('.'):
+                            stat = entry.stat()
+                            yield entry.path, stat.st_size, stat.st_mtime
+
+    def evict(self):
+        """Borra las variantes usadas hace más tiempo hasta quedar al 90% del límite."""
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * 0.9
+        removed = 0
+        for path, size, _ in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            total -= size
+            removed += 1
+        with self._lock:
+            self._size = total
+        return removed
+
+    def discard(self, filename):
+        """Elimina todas las variantes de un archivo original."""
+        shutil.rmtree(os.path.join(self.folder, filename), ignore_errors=True)
@@ -0,0 +1,37 @@
+"""Configuración de gunicorn (se carga sola desde la carpeta de trabajo).
+
+Uso::
+
+    gunicorn -c gunicorn.conf.py app:app
+
+La app se importa una vez en el master (``preload_app``) y ahí se valida la
+configuración, se revisan las carpetas y se precalientan Pillow y mimetypes
+(``app.prepare_startup``). Cada worker nace del fork ya caliente, así los
+despliegues y el autoescalado no producen picos de latencia en las primeras
+peticiones. Si algo falla, el master termina antes de abrir el puerto.
+"""
+preload_app = True
+
+
+def on_starting(server):
+    import metrics
+    from app import prepare_startup
+
+    removed = metrics.clear_multiprocess_dir()
+    if removed:
+        server.log.info('Métricas de la ejecución anterior descartadas (%d archivos)', removed)
+    try:
+        prepare_startup()
+    except RuntimeError as e:
+        server.log.error('❌ Configuración no válida:\n%s', e)
+        raise SystemExit(1)
+
+def post_fork(server, worker):
+    import metrics
+
+    metrics.mark_process_started()
+
+def child_exit(server, worker):
+    import metrics
+
+    metrics.mark_process_dead(worker.pid)
@@ -0,0 +1,117 @@
+import json
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import atomic
+
+QUEUED = 'queued'
+PROCESSING = 'processing'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class QueueFull(Exception):
+    """La cola de procesamiento alcanzó su límite de trabajos pendientes."""
+
+
+def status_path(jobs_folder, job_id):
+    return os.path.join(jobs_folder, f'{job_id}.json')
+
+def write_status(jobs_folder, job_id, **fields):
+    """Guarda el estado de un trabajo en disco para que cualquier worker lo pueda leer.
+
+    El estado es efímero: se reemplaza de forma atómica pero sin ``fsync``.
+    """
+    os.makedirs(jobs_folder, exist_ok=True)
+    data = dict(fields, job_id=job_id, updated_at=time.time())
+    with atomic.atomic_write(status_path(jobs_folder, job_id), 'none', 'w') as f:
+        json.dump(data, f)
+    return data
+
+def read_status(jobs_folder, job_id):
+    try:
+        with open(status_path(jobs_folder, job_id)) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+class JobQueue:
+    """Pool de procesos acotado para el trabajo de imágenes (CPU intensivo).
+
+    ``workers=0`` ejecuta los trabajos en línea, en el mismo hilo de la petición.
+    El pool se crea de forma perezosa y por proceso, así es seguro usarlo con
+    ``preload_app`` de gunicorn.
+    """
+
+    def __init__(self, workers, max_pending):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+
+    @property
+    def depth(self):
+        return self._pending
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                )
+                self._pid = os.getpid()
+            return self._executor
+
+    def _reset_executor(self, broken=None):
+        """Descarta el pool actual (o ``broken``, si sigue siendo el actual) para crear uno nuevo."""
+        with self._lock:
+            if broken is None or self._executor is broken:
+                self._executor = None
+
+    def _release(self, _future=None):
+        with self._lock:
+            self._pending -= 1
+        self._slots.release()
+
+    def _finished(self, executor, future):
+        if not future.cancelled() and isinstance(future.exception(), BrokenProcessPool):
+            # Un worker murió con trabajos en curso: el siguiente submit ya usa un pool nuevo
+            self._reset_executor(executor)
+            executor.shutdown(wait=False)
+        self._release()
+
+    def submit(self, fn, *args, block=False, timeout=None):
+        """Encola ``fn(*args)``; con ``block=True`` espera a que se libere un lugar."""
+        if not self._slots.acquire(blocking=block, timeout=timeout if block else None):
+            raise QueueFull()
+        with self._lock:
+            self._pending += 1
+        try:
+            executor = self._get_executor()
+            try:
+                future = executor.submit(fn, *args)
+            except BrokenProcessPool:
+                # Un worker murió (OOM, señal...): se recrea el pool una vez
+                self._reset_executor(executor)
+                executor = self._get_executor()
+                future = executor.submit(fn, *args)
+        except Exception:
+            self._release()
+            raise
+        future.add_done_callback(lambda future: self._finished(executor, future))
+        return future
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
@@ -0,0 +1,105 @@
+import os
+import time
+from contextlib import contextmanager
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+from prometheus_client import multiprocess
+
+# Con PROMETHEUS_MULTIPROC_DIR definido (antes de importar este módulo) cada
+# proceso de gunicorn escribe sus valores en archivos de esa carpeta y
+# /metrics los suma, sin importar qué worker atienda la petición.
+
+STAGE_SECONDS = Histogram(
+    'cdn_upload_stage_seconds', 'Duración de cada etapa del procesamiento de una subida',
+    ['stage'], buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+REQUEST_SECONDS = Histogram('cdn_request_seconds', 'Latencia de las peticiones por ruta', ['endpoint'])
+BYTES_IN = Counter('cdn_request_bytes_in', 'Bytes recibidos en el cuerpo de las peticiones', ['endpoint'])
+BYTES_OUT = Counter('cdn_response_bytes_out', 'Bytes enviados en las respuestas', ['endpoint'])
+CONVERSION_FAILURES = Counter('cdn_conversion_failures', 'Subidas que no se pudieron convertir')
+QUEUE_DEPTH = Gauge('cdn_processing_queue_depth', 'Trabajos de conversión pendientes', multiprocess_mode='livesum')
+TIME_TO_FIRST_REQUEST = Histogram(
+    'cdn_time_to_first_request_seconds', 'Desde que arranca el proceso (o el fork del worker) hasta su primera petición',
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+
+_process_started = time.perf_counter()
+_first_request_seen = False
+
+
+@contextmanager
+def timed(timings, stage):
+    """Suma la duración del bloque a ``timings[stage]`` (``timings=None`` no mide nada)."""
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = timings.get(stage, 0) + time.perf_counter() - start
+
+def observe_stages(timings):
+    for stage, seconds in (timings or {}).items():
+        STAGE_SECONDS.labels(stage).observe(seconds)
+
+def mark_process_started():
+    """Para el hook ``post_fork`` de gunicorn: el worker cuenta desde el fork, no desde el import en el master."""
+    global _process_started, _first_request_seen
+    _process_started = time.perf_counter()
+    _first_request_seen = False
+
+def observe_first_request():
+    """Registra el tiempo hasta la primera petición del proceso; ``None`` a partir de la segunda."""
+    global _first_request_seen
+    if _first_request_seen:
+        return None
+    _first_request_seen = True
+    seconds = time.perf_counter() - _process_started
+    TIME_TO_FIRST_REQUEST.observe(seconds)
+    print(f"✅ Primera petición del proceso {os.getpid()} a los {seconds:.3f} s de arrancar")
+    return seconds
+
+def observe_request(endpoint, seconds, bytes_in, bytes_out):
+    endpoint = endpoint or 'unknown'
+    if not _first_request_seen:
+        observe_first_request()
+    REQUEST_SECONDS.labels(endpoint).observe(seconds)
+    if bytes_in:
+        BYTES_IN.labels(endpoint).inc(bytes_in)
+    if bytes_out:
+        BYTES_OUT.labels(endpoint).inc(bytes_out)
+
+def render():
+    """Devuelve ``(cuerpo, content_type)`` en el formato de texto de Prometheus."""
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+def mark_process_dead(pid):
+    """Para el hook ``child_exit`` de gunicorn: descarta los gauges del worker que terminó."""
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        multiprocess.mark_process_dead(pid)
+
+def clear_multiprocess_dir():
+    """Para el hook ``on_starting`` de gunicorn: borra los valores que dejaron los procesos de una ejecución anterior.
+
+    Cada proceso escribe ``<tipo>_<pid>.db``; si la carpeta sobrevive al
+    reinicio (volumen montado, disco en vez de tmpfs) esos archivos se
+    sumarían a los nuevos. Se conservan los del proceso actual (el master
+    ya los abrió al importar la app). Devuelve cuántos se borraron.
+    """
+    folder = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+    if not folder or not os.path.isdir(folder):
+        return 0
+    own = f'_{os.getpid()}.db'
+    removed = 0
+    for name in os.listdir(folder):
+        if name.endswith('.db') and not name.endswith(own):
+            try:
+                os.remove(os.path.join(folder, name))
+                removed += 1
+            except FileNotFoundError:
+                pass
+    return removed
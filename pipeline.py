@@ -0,0 +1,382 @@
+import os
+import shutil
+import time
+from PIL import Image, ImageOps
+
+import jobs
+import similarity
+import svg
+from metrics import timed
+from asset_index import describe_file, open_index
+from storage import open_storage
+
+try:
+    import pillow_avif  # noqa: F401 - registra el codificador AVIF en Pillow
+except ImportError:
+    pass
+
+THUMBNAIL_SIZE = (250, 250)
+RASTER_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
+VARIANT_FORMATS = {'webp': 'WEBP', 'avif': 'AVIF'}
+VARIANT_QUALITY = 80
+# Se decodifica a una resolución de al menos este múltiplo del tamaño final
+# (DCT reducida de JPEG, luego reducción entera); arriba de 2-3 no se nota en calidad
+REDUCING_GAP = 3.0
+
+def supported_variant_formats(formats):
+    """Filtra los formatos que el Pillow instalado puede codificar."""
+    Image.init()
+    return [fmt for fmt in formats if VARIANT_FORMATS.get(fmt) in Image.SAVE]
+
+def variant_name(filename, width, fmt):
+    return f"{os.path.splitext(filename)[0]}-{width}w.{fmt}"
+
+def variant_source(name):
+    """Archivo publicado al que pertenece una variante (``<uuid>-640w.avif`` -> ``<uuid>.webp``)."""
+    return f"{name.rpartition('-')[0]}.webp"
+
+def parse_variants(value):
+    """Convierte ``"320:webp,640:webp"`` (columna del índice) en ``[(320, 'webp'), (640, 'webp')]``."""
+    variants = []
+    for item in (value or '').split(','):
+        if item:
+            width, fmt = item.split(':')
+            variants.append((int(width), fmt))
+    return variants
+
+def resizable(img):
+    """``img`` en un modo que ``resize`` con LANCZOS y los codificadores aceptan.
+
+    Los PNG de 16 bits (``I;16``, ``I``) o en coma flotante se convierten
+    como lo hace el codificador WebP al guardar la imagen principal.
+    """
+    if img.mode in ('L', 'LA', 'RGB', 'RGBA'):
+        return img
+    return img.convert('RGBA' if img.has_transparency_data else 'RGB')
+
+def save_variants(img, filename, variant_folder, widths, formats):
+    """Genera las variantes responsive de una imagen ya decodificada.
+
+    Cada ancho se reduce a partir de la variante anterior (la más grande
+    primero), así el costo extra es una fracción del de la conversión
+    principal. Los anchos mayores o iguales al original se omiten, salvo en
+    formatos distintos de WebP (ej. AVIF), que también se guardan al ancho
+    original para negociarlos con ``Accept``.
+    """
+    variants = []
+    for fmt in formats:
+        if fmt != 'webp':
+            os.makedirs(variant_folder, exist_ok=True)
+            img.save(os.path.join(variant_folder, variant_name(filename, img.width, fmt)),
+                     format=VARIANT_FORMATS[fmt], quality=VARIANT_QUALITY)
+            variants.append((img.width, fmt))
+    current = img
+    for width in sorted(set(widths), reverse=True):
+        if width >= img.width:
+            continue
+        height = max(1, round(img.height * width / img.width))
+        current = current.resize((width, height), Image.LANCZOS, reducing_gap=REDUCING_GAP)
+        os.makedirs(variant_folder, exist_ok=True)
+        for fmt in formats:
+            current.save(os.path.join(variant_folder, variant_name(filename, width, fmt)),
+                         format=VARIANT_FORMATS[fmt], quality=VARIANT_QUALITY)
+            variants.append((width, fmt))
+    return sorted(variants)
+
+def convert_image(filepath, webp_path, variant_folder=None, widths=(), formats=('webp',), thumb_path=None, timings=None,
+                  animated_thumbnails=True):
+    """Convierte a WebP y genera variantes y miniatura con una sola decodificación.
+
+    Devuelve la lista de variantes ``[(ancho, formato), ...]``. Si se pasa
+    ``timings`` se acumula ahí la duración de cada etapa en segundos. Las
+    animaciones (GIF/WebP) se convierten a WebP animado, sin variantes.
+    """
+    with Image.open(filepath) as img:
+        if getattr(img, 'is_animated', False):
+            convert_animation(img, webp_path, thumb_path, timings, animated_thumbnails)
+            return []
+        with timed(timings, 'decode'):
+            # Método moderno: corrige automáticamente la orientación EXIF (sin copiar la imagen)
+            ImageOps.exif_transpose(img, in_place=True)
+        with timed(timings, 'encode'):
+            # Guardar sin metadatos EXIF para evitar problemas futuros
+            img.save(webp_path, format='WEBP', quality=80, exif=b'')
+        img = resizable(img)
+        variants = []
+        if variant_folder and widths:
+            with timed(timings, 'variants'):
+                try:
+                    variants = save_variants(img, os.path.basename(webp_path), variant_folder, widths, formats)
+                except Exception as e:
+                    # Igual que la miniatura: sin variantes, la imagen principal se publica igual
+                    print(f"❌ Error creando variantes: {e}")
+        if thumb_path:
+            with timed(timings, 'thumbnail'):
+                save_thumbnail(img, thumb_path)
+    return variants
+
+def read_frame(img, index, durations, size=None):
+    """Decodifica el cuadro ``index`` (ya compuesto según su disposal) y anota su duración."""
+    img.seek(index)
+    durations[index] = img.info.get('duration', 0)
+    frame = img if img.mode in ('RGB', 'RGBA') else img.convert('RGBA')
+    if size and size != frame.size:
+        frame = frame.resize(size, Image.LANCZOS, reducing_gap=REDUCING_GAP)
+    return frame
+
+
+class AnimationFrames(Image.Image):
+    """Cuadros 1..n de una animación como una imagen multicuadro que se decodifica al pedir cada uno.
+
+    Es una ``Image`` real (como las que abre ``Image.open``): el codificador
+    WebP la recorre con ``seek()`` y codifica cada cuadro antes de pedir el
+    siguiente, así solo hay un cuadro decodificado en memoria a la vez. La
+    duración de cada cuadro se anota en ``durations`` al leerlo, antes de
+    que el codificador la use.
+    """
+
+    def __init__(self, img, durations, size=None):
+        super().__init__()
+        self.source = img
+        self.durations = durations
+        self.target_size = size
+        self.n_frames = img.n_frames - 1
+        self.is_animated = self.n_frames > 1
+        self._frame = 0
+        self.seek(0)
+
+    def seek(self, index):
+        frame = read_frame(self.source, index + 1, self.durations, self.target_size)
+        frame.load()
+        # Igual que un plugin de Pillow al cambiar de cuadro: modo, tamaño y pixeles del cuadro actual
+        self._mode = frame.mode
+        self._size = frame.size
+        self.im = frame.im
+        self._frame = index
+
+    def tell(self):
+        return self._frame
+
+
+def save_animation(img, path, size=None):
+    """Guarda una animación como WebP animado conservando duración de cada cuadro y repeticiones.
+
+    Los cuadros llegan ya compuestos (disposal aplicado); el codificador WebP
+    calcula por su cuenta las regiones que cambian entre cuadros.
+    """
+    durations = [0] * img.n_frames
+    first = read_frame(img, 0, durations, size)
+    if first is img:
+        first = img.copy()
+    # GIF sin extensión NETSCAPE: se reproduce una sola vez
+    loop = img.info.get('loop', 1)
+    first.save(path, format='WEBP', save_all=True, append_images=[AnimationFrames(img, durations, size)],
+               duration=durations, loop=loop, quality=80)
+
+def convert_animation(img, webp_path, thumb_path=None, timings=None, animated_thumbnails=True):
+    with timed(timings, 'encode'):
+        save_animation(img, webp_path)
+    if not thumb_path:
+        return
+    with timed(timings, 'thumbnail'):
+        if not animated_thumbnails:
+            # Miniatura estática con el primer cuadro: mucho más barata
+            img.seek(0)
+            save_thumbnail(img.convert('RGBA'), thumb_path)
+            return
+        try:
+            save_animation(img, thumb_path, thumbnail_size(img.size))
+            print(f"✅ Miniatura animada creada: {thumb_path}")
+        except Exception as e:
+            print(f"❌ Error creando miniatura: {e}")
+
+def thumbnail_size(size, box=THUMBNAIL_SIZE):
+    """Tamaño que cabe en ``box`` conservando la proporción (como ``Image.thumbnail``)."""
+    width, height = size
+    scale = min(box[0] / width, box[1] / height, 1)
+    return (max(1, round(width * scale)), max(1, round(height * scale)))
+
+def save_thumbnail(img, thumb_path):
+    """Guarda la miniatura de una imagen ya decodificada y orientada.
+
+    ``resize`` con ``reducing_gap`` devuelve una imagen nueva, así que ``img``
+    se puede seguir usando y no hace falta copiarla a resolución completa.
+    """
+    try:
+        size = thumbnail_size(img.size)
+        thumb = img.resize(size, Image.LANCZOS, reducing_gap=REDUCING_GAP) if size != img.size else img
+        thumb.save(thumb_path)
+        print(f"✅ Miniatura creada: {thumb_path}")
+    except Exception as e:
+        print(f"❌ Error creando miniatura: {e}")
+
+def create_thumbnail(image_path, thumb_path):
+    try:
+        img = Image.open(image_path)
+
+        # En JPEG decodifica directamente a 1/2, 1/4 u 1/8 de la resolución; el lado
+        # mayor se usa en ambos ejes porque la orientación EXIF puede girar la imagen
+        side = int(max(THUMBNAIL_SIZE) * REDUCING_GAP)
+        img.draft(None, (side, side))
+
+        # Método moderno: corrige automáticamente la orientación EXIF
+        ImageOps.exif_transpose(img, in_place=True)
+    except Exception as e:
+        print(f"❌ Error creando miniatura: {e}")
+        return
+    save_thumbnail(img, thumb_path)
+
+def compress_and_convert_image(filepath, webp_path=None):
+    try:
+        if webp_path is None:
+            webp_path = os.path.splitext(filepath)[0] + '.webp'
+        convert_image(filepath, webp_path)
+        if os.path.abspath(webp_path) != os.path.abspath(filepath):
+            os.remove(filepath)  # Elimina el original si se convierte
+        print(f"✅ Imagen convertida a WebP: {webp_path}")
+        return os.path.basename(webp_path)
+    except Exception as e:
+        print(f"❌ [ERROR] No se pudo comprimir/convertir la imagen: {e}")
+        return None
+
+def convert_svg(filepath, dest_path, thumb_path=None, timings=None):
+    """Limpia y minifica un SVG, guarda sus copias precomprimidas y rasteriza la miniatura.
+
+    Devuelve las codificaciones precomprimidas guardadas junto a ``dest_path``.
+    """
+    with open(filepath, 'rb') as f:
+        data = f.read()
+    with timed(timings, 'encode'):
+        data = svg.sanitize(data)
+        with open(dest_path, 'wb') as f:
+            f.write(data)
+        encodings = svg.precompress(data, os.path.dirname(dest_path), os.path.basename(dest_path))
+    if thumb_path:
+        with timed(timings, 'thumbnail'):
+            try:
+                img = svg.rasterize(data, THUMBNAIL_SIZE[0])
+                if img is not None:
+                    save_thumbnail(img, thumb_path)
+            except Exception as e:
+                print(f"❌ Error creando miniatura: {e}")
+    return encodings
+
+def alias_asset(existing, filename, storage):
+    """Publica ``filename`` con el mismo contenido que ``existing`` sin volver a convertirlo.
+
+    Devuelve los metadatos para el índice, o ``None`` si el original ya no está guardado.
+    """
+    try:
+        storage.copy('content', existing['filename'], filename)
+    except FileNotFoundError:
+        return None
+    metadata = {column: existing[column] for column in ('size', 'width', 'height', 'content_hash', 'source_hash', 'mime_type')}
+    metadata['variants'] = None
+    if existing['variants']:
+        try:
+            for width, fmt in parse_variants(existing['variants']):
+                storage.copy('variants', variant_name(existing['filename'], width, fmt), variant_name(filename, width, fmt))
+            metadata['variants'] = existing['variants']
+        except FileNotFoundError:
+            pass
+    metadata['encodings'] = None
+    if existing['encodings']:
+        try:
+            for encoding in existing['encodings'].split(','):
+                storage.copy('content', svg.encoded_name(existing['filename'], encoding), svg.encoded_name(filename, encoding))
+            metadata['encodings'] = existing['encodings']
+        except FileNotFoundError:
+            pass
+    metadata['thumbnail'] = metadata['thumbnail_hash'] = None
+    metadata.update(similarity.hash_columns(None))
+    if existing['thumbnail']:
+        try:
+            thumbnail = svg.thumbnail_name(filename)
+            storage.copy('thumbnails', existing['thumbnail'], thumbnail)
+            metadata['thumbnail'] = thumbnail
+            metadata['thumbnail_hash'] = existing['thumbnail_hash']
+            # Misma miniatura, mismo hash perceptual
+            metadata.update((column, existing[column]) for column in (similarity.HASH_COLUMN,) + similarity.CHUNK_COLUMNS)
+        except FileNotFoundError:
+            pass
+    metadata['created_at'] = time.time()
+    return metadata
+
+def publish(storage, work_folder, filename, variants, encodings=()):
+    """Pasa los archivos generados en ``work_folder`` al almacenamiento.
+
+    El archivo principal va al final: cuando aparece, su miniatura, sus
+    variantes y sus copias precomprimidas ya están disponibles.
+    """
+    for width, fmt in variants:
+        name = variant_name(filename, width, fmt)
+        storage.put('variants', name, os.path.join(work_folder, 'variants', name))
+    for encoding in encodings:
+        name = svg.encoded_name(filename, encoding)
+        storage.put('content', name, os.path.join(work_folder, name))
+    thumbnail = svg.thumbnail_name(filename)
+    thumb_path = os.path.join(work_folder, 'thumbnails', thumbnail)
+    if os.path.exists(thumb_path):
+        storage.put('thumbnails', thumbnail, thumb_path)
+    storage.put('content', filename, os.path.join(work_folder, filename))
+
+def process_upload(job):
+    """Convierte un archivo recibido y genera su miniatura.
+
+    Se ejecuta dentro del pool de procesos (o en línea si no hay workers), por
+    lo que solo recibe rutas y valores serializables en ``job``. Todo se genera
+    en una carpeta de trabajo propia y luego se publica en el almacenamiento.
+    """
+    jobs_folder = job['jobs_folder']
+    job_id = job['job_id']
+    filename = job['filename']
+    work_folder = job['work_folder']
+    dest_path = os.path.join(work_folder, filename)
+    thumb_path = os.path.join(work_folder, 'thumbnails', svg.thumbnail_name(filename))
+    os.makedirs(os.path.dirname(thumb_path), exist_ok=True)
+    jobs.write_status(jobs_folder, job_id, status=jobs.PROCESSING, filename=filename)
+
+    # Duración de cada etapa; viaja en el estado del trabajo para que el
+    # proceso web la registre en las métricas
+    timings = {}
+    variants = []
+    encodings = []
+    try:
+        if job['ext'] in RASTER_EXTENSIONS:
+            try:
+                variants = convert_image(job['source'], dest_path, os.path.join(work_folder, 'variants'),
+                                         job.get('variant_widths', ()), job.get('variant_formats', ('webp',)),
+                                         thumb_path=thumb_path, timings=timings,
+                                         animated_thumbnails=job.get('animated_thumbnails', True))
+                print(f"✅ Imagen convertida a WebP: {dest_path}")
+            except Exception as e:
+                print(f"❌ [ERROR] No se pudo comprimir/convertir la imagen: {e}")
+                return jobs.write_status(jobs_folder, job_id, status=jobs.FAILED, filename=filename,
+                                         error='No se pudo comprimir/convertir la imagen.', timings=timings)
+        else:
+            try:
+                encodings = convert_svg(job['source'], dest_path, thumb_path, timings)
+                print(f"✅ SVG optimizado: {dest_path}")
+            except svg.InvalidSvg as e:
+                print(f"❌ [ERROR] SVG no válido: {e}")
+                return jobs.write_status(jobs_folder, job_id, status=jobs.FAILED, filename=filename,
+                                         error='El SVG no es válido.', timings=timings)
+
+        with timed(timings, 'index'):
+            metadata = describe_file(dest_path, thumb_path, created_at=time.time())
+            metadata['source_hash'] = job.get('source_hash')
+            metadata['variants'] = ','.join(f'{width}:{fmt}' for width, fmt in variants) or None
+            metadata['encodings'] = ','.join(encodings) or None
+        with timed(timings, 'store'):
+            publish(open_storage(job['storage']), work_folder, filename, variants, encodings)
+        with timed(timings, 'index'):
+            open_index(job['index_path']).add(filename, **metadata)
+    finally:
+        if os.path.exists(job['source']):
+            os.remove(job['source'])
+        shutil.rmtree(work_folder, ignore_errors=True)
+    return jobs.write_status(jobs_folder, job_id, status=jobs.DONE, filename=filename, timings=timings)
+
+def rebuild_index(index_path, storage_config):
+    """Reconstruye el índice desde el almacenamiento; corre en un proceso del pool (ver ``app.build_asset_index``)."""
+    return open_index(index_path).rebuild(open_storage(storage_config))
@@ -0,0 +1,88 @@
+"""Hash perceptual (dHash) para encontrar copias casi idénticas: reescaladas, recomprimidas o con otro formato.
+
+El hash se calcula sobre la miniatura (ya reducida y orientada), así cuesta
+menos de un milisegundo. Para buscar sin recorrer todo el índice se usa
+*multi-index hashing*: los 64 bits se parten en 4 bloques de 16 y cada bloque
+tiene su propia columna indexada en SQLite. Si dos hashes difieren en ``d``
+bits o menos, por el principio del palomar al menos un bloque difiere en
+``d // 4`` bits o menos; basta con pedir al índice los valores de cada bloque
+a esa distancia y verificar la distancia completa solo de esos candidatos.
+"""
+from itertools import combinations
+from PIL import Image
+
+HASH_BITS = 64
+CHUNKS = 4
+CHUNK_BITS = HASH_BITS // CHUNKS
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+HASH_MASK = (1 << HASH_BITS) - 1
+# Columnas del índice: el hash completo y sus bloques
+HASH_COLUMN = 'dhash'
+CHUNK_COLUMNS = tuple(f'dhash_{i}' for i in range(CHUNKS))
+
+DEFAULT_DISTANCE = 6
+# Hasta 10 bits cada bloque se busca a distancia 2 o menos (137 valores por bloque)
+MAX_DISTANCE = 10
+
+
+def dhash(img):
+    """Hash por diferencias: compara cada pixel con su vecino derecho en una versión gris de 9x8."""
+    if img.mode in ('RGBA', 'LA', 'PA') or 'transparency' in img.info:
+        # Lo transparente se ve como fondo blanco, no como el color que quedó guardado debajo
+        rgba = img.convert('RGBA')
+        img = Image.new('RGBA', rgba.size, 'white')
+        img.alpha_composite(rgba)
+    pixels = list(img.convert('L').resize((9, 8), Image.LANCZOS).getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return value
+
+def image_hash(path):
+    """dHash de la imagen en ``path``, o ``None`` si no se puede leer."""
+    try:
+        with Image.open(path) as img:
+            return dhash(img)
+    except Exception:
+        return None
+
+def to_signed(value):
+    """SQLite guarda enteros de 64 bits con signo."""
+    return value - (1 << HASH_BITS) if value >= 1 << (HASH_BITS - 1) else value
+
+def from_signed(value):
+    return value & HASH_MASK
+
+def chunks(value):
+    value = from_signed(value)
+    return [(value >> (CHUNK_BITS * (CHUNKS - 1 - i))) & CHUNK_MASK for i in range(CHUNKS)]
+
+def hash_columns(value):
+    """Valores de las columnas del índice para un hash (todas ``None`` si no hay hash)."""
+    if value is None:
+        return dict.fromkeys((HASH_COLUMN,) + CHUNK_COLUMNS)
+    return {HASH_COLUMN: to_signed(value), **dict(zip(CHUNK_COLUMNS, chunks(value)))}
+
+def format_hash(value):
+    return None if value is None else f'{from_signed(value):016x}'
+
+def distance(a, b):
+    """Bits distintos entre dos hashes (con o sin signo)."""
+    return bin((a ^ b) & HASH_MASK).count('1')
+
+def neighbours(chunk, radius):
+    """Todos los valores de un bloque a ``radius`` bits o menos de ``chunk``."""
+    values = [chunk]
+    for flipped in range(1, radius + 1):
+        for bits in combinations(range(CHUNK_BITS), flipped):
+            mask = 0
+            for bit in bits:
+                mask |= 1 << bit
+            values.append(chunk ^ mask)
+    return values
+
+def probes(value, max_distance):
+    """``[(columna, valores)]`` que hay que consultar para no perder ningún hash a ``max_distance`` o menos."""
+    radius = max_distance // CHUNKS
+    return [(column, neighbours(chunk, radius)) for column, chunk in zip(CHUNK_COLUMNS, chunks(value))]
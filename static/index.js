@@ -1,11 +1,12 @@
 
 document.addEventListener("DOMContentLoaded", function () {
 
-  var tooltipTriggerList = [].slice.call(
-    document.querySelectorAll('[data-bs-toggle="tooltip"]')
-  );
-  var tooltipList = tooltipTriggerList.map(function (tooltipTriggerEl) {
-    return new bootstrap.Tooltip(tooltipTriggerEl);
+  // Tooltips delegados: también sirven para las filas que la galería crea después
+  new bootstrap.Tooltip(document.body, { selector: '[data-bs-toggle="tooltip"]' });
+
+  document.addEventListener("click", (e) => {
+    const button = e.target.closest("[data-copy]");
+    if (button) copyToClipboard(button.dataset.copy);
   });
 
   const themeToggle = document.getElementById("themeToggle");
@@ -97,8 +98,15 @@ document.addEventListener("DOMContentLoaded", function () {
     
     emptyState.classList.add('d-none');
     selectedState.classList.remove('d-none');
-    fileNameElement.textContent = file.name;
-    fileSizeElement.textContent = formatFileSize(file.size);
+    if (fileInput.files && fileInput.files.length > 1) {
+      const totalSize = Array.from(fileInput.files).reduce((sum, f) => sum + f.size, 0);
+      fileNameElement.textContent = `${fileInput.files.length} archivos seleccionados`;
+      fileSizeElement.textContent = formatFileSize(totalSize);
+      iconClass = 'bi-files';
+    } else {
+      fileNameElement.textContent = file.name;
+      fileSizeElement.textContent = formatFileSize(file.size);
+    }
     fileIcon.className = `bi ${iconClass} file-type-icon`;
     uploadBtn.disabled = false;
     dropArea.classList.remove('empty');
@@ -169,12 +177,45 @@ document.addEventListener("DOMContentLoaded", function () {
       if (uploadBtn) uploadBtn.disabled = true;
       if (uploadSpinner) uploadSpinner.classList.remove("d-none");
       if (uploadText) uploadText.textContent = "Subiendo...";
+
+      // Varios archivos o un zip/tar: una sola petición al endpoint de lotes
+      const isArchive = /\.(zip|tar|tar\.gz|tgz)$/i.test(fileInput.files[0].name);
+      if (fileInput.files.length > 1 || isArchive) {
+        e.preventDefault();
+        uploadBatch(fileInput.files);
+      }
     });
   }
 
-  function updateFileDates() {
-    document.querySelectorAll(".file-date").forEach((element) => {
-      const date = new Date();
+  function uploadBatch(files) {
+    const formData = new FormData();
+    Array.from(files).forEach((file) => formData.append("files", file));
+
+    fetch(fileInput.dataset.batchUrl, {
+      method: "POST",
+      body: formData,
+      headers: { Accept: "application/json" },
+    })
+      .then((response) => response.json())
+      .then((data) => {
+        const summary = Object.entries(data.summary || {})
+          .map(([status, count]) => `${status}: ${count}`)
+          .join(", ");
+        alert(`Archivos procesados (${data.files.length}). ${summary}`);
+        window.location.reload();
+      })
+      .catch((error) => {
+        console.error("Error:", error);
+        alert("Ocurrió un error al subir los archivos. Por favor, inténtalo de nuevo.");
+        if (uploadBtn) uploadBtn.disabled = false;
+        if (uploadSpinner) uploadSpinner.classList.add("d-none");
+        if (uploadText) uploadText.textContent = "Subir archivos";
+      });
+  }
+
+  function updateFileDates(root) {
+    root.querySelectorAll(".file-date").forEach((element) => {
+      const date = new Date(parseFloat(element.dataset.timestamp) * 1000);
       const options = {
         year: "numeric",
         month: "long",
@@ -182,24 +223,217 @@ document.addEventListener("DOMContentLoaded", function () {
         hour: "2-digit",
         minute: "2-digit",
       };
-      element.textContent = date.toLocaleDateString("es-ES", options);
+      const dateText = element.querySelector(".date-text");
+      if (dateText) dateText.textContent = date.toLocaleDateString("es-ES", options);
+    });
+    root.querySelectorAll(".file-size").forEach((element) => {
+      const icon = element.querySelector("i");
+      element.textContent = " " + formatFileSize(parseInt(element.dataset.bytes, 10));
+      if (icon) element.prepend(icon);
     });
   }
   
-  updateFileDates();
-});
+  updateFileDates(document);
 
-function updateFileDates() {
-  const dateElements = document.querySelectorAll(".file-date .date-text");
-  const options = { year: "numeric", month: "2-digit", day: "2-digit" };
-  const today = new Date().toLocaleDateString("es-ES", options);
-  dateElements.forEach((el) => {
-    el.textContent = today;
-  });
-}
+  function escapeHtml(value) {
+    const entities = { "&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;", "'": "&#39;" };
+    return String(value).replace(/[&<>"']/g, (c) => entities[c]);
+  }
+
+  // Misma fila que arma templates/index.html para la primera página
+  function fileRow(asset, root) {
+    const file = escapeHtml(asset.filename);
+    const thumbnail = asset.thumbnail
+      ? `<a href="${root}/cdn/${file}" class="me-3" target="_blank" data-bs-toggle="tooltip" title="Ver imagen">
+           <img src="${root}/cdn/thumbnails/${escapeHtml(asset.thumbnail)}" class="thumbnail" alt="${file}" loading="lazy" decoding="async"${
+             asset.thumbnail_width ? ` width="${asset.thumbnail_width}" height="${asset.thumbnail_height}"` : ""
+           }>
+         </a>`
+      : `<div class="bg-light rounded d-flex align-items-center justify-content-center" style="width: 80px; height: 80px;">
+           <i class="bi bi-file-earmark-text display-4 text-muted"></i>
+         </div>`;
+    const dimensions = asset.width
+      ? `<span class="me-3"><i class="bi bi-aspect-ratio me-1"></i> ${asset.width}×${asset.height}</span>`
+      : "";
+    const copySrcset = asset.srcset && asset.srcset.webp
+      ? `<a href="javascript:void(0);" class="btn btn-sm btn-outline-info me-2" data-bs-toggle="tooltip" title="Copiar srcset" data-copy="${escapeHtml(asset.srcset.webp)}">
+           <i class="bi bi-phone"></i>
+         </a>`
+      : "";
+    const copyThumbnail = asset.thumbnail
+      ? `<a href="javascript:void(0);" class="btn btn-sm btn-outline-info me-2" data-bs-toggle="tooltip" title="Copiar enlace CDN thumbnail" data-copy="${escapeHtml(asset.thumbnail_cdn_url)}">
+           <i class="bi bi-images"></i>
+         </a>`
+      : "";
+
+    const row = document.createElement("div");
+    row.className = "list-group-item file-item";
+    row.dataset.filename = asset.filename;
+    row.innerHTML = `
+      <div class="d-flex flex-column flex-md-row align-items-md-center">
+        <div class="d-flex align-items-center flex-grow-1 mb-2 mb-md-0">
+          ${thumbnail}
+          <div class="flex-grow-1 ms-3">
+            <a href="${root}/cdn/${file}" target="_blank" class="text-decoration-none text-dark fw-medium">${file}</a>
+            <div class="text-muted small mt-1">
+              <span class="me-3"><i class="bi bi-file-earmark-text me-1"></i> ${escapeHtml(asset.filename.split(".").pop().toUpperCase())}</span>
+              ${dimensions}
+              <span class="me-3 file-size" data-bytes="${asset.size}"><i class="bi bi-hdd me-1"></i></span>
+              <span class="file-date" data-timestamp="${asset.created_at}"><i class="bi bi-calendar3 me-1"></i> <span class="date-text"></span></span>
+            </div>
+          </div>
+        </div>
+        <div class="file-actions">
+          <a href="javascript:void(0);" class="btn btn-sm btn-outline-info me-2" data-bs-toggle="tooltip" title="Copiar enlace CDN" data-copy="${escapeHtml(asset.cdn_url)}">
+            <i class="bi bi-share"></i>
+          </a>
+          ${copySrcset}
+          ${copyThumbnail}
+          <a href="/cdn/${file}" target="_blank" class="btn btn-sm btn-outline-primary me-2" data-bs-toggle="tooltip" title="Ver archivo">
+            <i class="bi bi-eye"></i>
+          </a>
+          <a href="/cdn/${file}" download class="btn btn-sm btn-outline-secondary me-2" data-bs-toggle="tooltip" title="Descargar">
+            <i class="bi bi-download"></i>
+          </a>
+          <form action="${root}/delete/${file}" method="POST" class="d-inline">
+            <button type="submit" class="btn btn-sm btn-outline-danger" data-bs-toggle="tooltip" title="Eliminar" onclick="return confirm('¿Estás seguro de que deseas eliminar este archivo?')">
+              <i class="bi bi-trash"></i>
+            </button>
+          </form>
+        </div>
+      </div>`;
+    updateFileDates(row);
+    return row;
+  }
+
+  // Galería virtual: en el DOM solo están las filas visibles (más un margen),
+  // así el render y las miniaturas pedidas no dependen del tamaño de la
+  // biblioteca. Las páginas siguientes se piden a /api/files al acercarse al final.
+  function initGallery() {
+    const list = document.getElementById("fileList");
+    const sentinel = document.getElementById("gallerySentinel");
+    const dataElement = document.getElementById("galleryData");
+    if (!list || !sentinel || !dataElement || !("IntersectionObserver" in window)) return;
+
+    const OVERSCAN = 8;
+    const LOAD_MARGIN = 1000;
+    const gallery = JSON.parse(dataElement.textContent);
+    const root = escapeHtml(list.dataset.applicationRoot || "");
+    const items = gallery.files;
+    let nextCursor = gallery.next_cursor;
+    let loading = false;
+    let frame = null;
+    let rendered = { start: -1, end: -1 };
+    // Filas en el DOM por nombre de archivo: las de la primera página las generó el servidor
+    let rows = new Map();
+    list.querySelectorAll(".file-item").forEach((row) => rows.set(row.dataset.filename, row));
+
+    const nextPage = document.getElementById("nextPage");
+    if (nextPage) nextPage.classList.add("d-none");
+
+    // Todas las filas miden lo mismo (miniatura de 80px); el margen inferior también cuenta
+    function measureRowHeight(fallback) {
+      const row = list.querySelector(".file-item");
+      if (!row) return fallback;
+      return row.getBoundingClientRect().height + parseFloat(getComputedStyle(row).marginBottom || 0);
+    }
+    let rowHeight = measureRowHeight(120);
+
+    function render() {
+      frame = null;
+      const top = list.getBoundingClientRect().top;
+      const start = Math.max(0, Math.floor(-top / rowHeight) - OVERSCAN);
+      const end = Math.min(items.length, Math.ceil((window.innerHeight - top) / rowHeight) + OVERSCAN);
+      if (start === rendered.start && end === rendered.end) return;
+
+      const visible = new Map();
+      const fragment = document.createDocumentFragment();
+      for (let i = start; i < end; i++) {
+        const asset = items[i];
+        const row = rows.get(asset.filename) || fileRow(asset, root);
+        visible.set(asset.filename, row);
+        fragment.appendChild(row);
+      }
+      list.style.paddingTop = `${start * rowHeight}px`;
+      list.style.paddingBottom = `${(items.length - end) * rowHeight}px`;
+      list.replaceChildren(fragment);
+      rows = visible;
+      rendered = { start, end };
+    }
+
+    function schedule() {
+      if (frame === null) frame = requestAnimationFrame(render);
+    }
+
+    function loadMore() {
+      if (loading || !nextCursor) return;
+      loading = true;
+      const params = new URLSearchParams(gallery.query);
+      params.set("cursor", nextCursor);
+      fetch(`${list.dataset.apiUrl}?${params}`, { headers: { Accept: "application/json" } })
+        .then((response) => {
+          if (!response.ok) throw new Error(`HTTP ${response.status}`);
+          return response.json();
+        })
+        .then((data) => {
+          items.push(...data.files);
+          nextCursor = data.next_cursor;
+          loading = false;
+          rendered = { start: -1, end: -1 };
+          render();
+          // Si la página nueva no alcanza a llenar la pantalla se pide otra
+          if (sentinel.getBoundingClientRect().top < window.innerHeight + LOAD_MARGIN) loadMore();
+        })
+        .catch((error) => {
+          console.error("Error al cargar más archivos:", error);
+          loading = false;
+        });
+    }
+
+    new IntersectionObserver((entries) => {
+      if (entries.some((entry) => entry.isIntersecting)) loadMore();
+    }, { rootMargin: `${LOAD_MARGIN}px 0px` }).observe(sentinel);
+
+    window.addEventListener("scroll", schedule, { passive: true });
+    window.addEventListener("resize", () => {
+      rowHeight = measureRowHeight(rowHeight);
+      rendered = { start: -1, end: -1 };
+      schedule();
+    });
+    render();
+  }
+
+  initGallery();
+
+  const pendingJobs = document.getElementById("pendingJobs");
+  if (pendingJobs) {
+    let remaining = JSON.parse(pendingJobs.dataset.jobs || "[]");
+    const statusUrl = pendingJobs.dataset.statusUrl;
+
+    function pollJobs() {
+      Promise.all(
+        remaining.map((jobId) =>
+          fetch(statusUrl + jobId, { headers: { Accept: "application/json" } })
+            .then((response) => response.json())
+            .catch(() => ({ job_id: jobId, status: "queued" }))
+        )
+      ).then((statuses) => {
+        remaining = statuses
+          .filter((s) => s.status === "queued" || s.status === "processing")
+          .map((s) => s.job_id);
+        if (remaining.length === 0) {
+          window.location.reload();
+        } else {
+          setTimeout(pollJobs, 1500);
+        }
+      });
+    }
+
+    setTimeout(pollJobs, 1000);
+  }
+});
 
 document.addEventListener("DOMContentLoaded", function () {
-  updateFileDates();
   var tooltipTriggerList = [].slice.call(
     document.querySelectorAll('[data-bs-toggle="tooltip"]')
   );
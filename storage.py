@@ -0,0 +1,258 @@
+import json
+import mimetypes
+import os
+import shutil
+from collections import namedtuple
+from werkzeug.utils import safe_join
+
+import atomic
+from derivatives import DerivativeCache
+
+try:
+    import boto3
+    from boto3.s3.transfer import TransferConfig
+    from botocore.config import Config
+    from botocore.exceptions import ClientError
+except ImportError:  # Solo hace falta con STORAGE_BACKEND=s3
+    boto3 = None
+
+# Áreas de almacenamiento: archivo publicado, miniatura y variantes responsive
+AREAS = ('content', 'thumbnails', 'variants')
+CHUNK_SIZE = 256 * 1024
+# Máximo de objetos por petición DeleteObjects de S3
+DELETE_BATCH = 1000
+
+StoredFile = namedtuple('StoredFile', 'size mtime')
+
+
+def valid_name(name):
+    """Los nombres son planos (``<uuid>.<ext>``): sin rutas ni archivos ocultos."""
+    return bool(name) and '/' not in name and '\\' not in name and not name.startswith('.')
+
+def link_or_copy(src, dst, fsync='file'):
+    """Crea ``dst`` como enlace duro de ``src``; si el sistema de archivos no lo permite, copia.
+
+    Con enlaces duros el sistema de archivos lleva la cuenta de referencias:
+    borrar un nombre no libera los bytes mientras otro nombre los use. La
+    copia se escribe en un temporal y se renombra, como todo lo publicado.
+    """
+    try:
+        os.link(src, dst)
+    except OSError:
+        atomic.copy_file(src, dst, fsync)
+        return
+    atomic.sync_folder(os.path.dirname(dst), fsync)
+
+def read_chunks(path, start=0, length=None, chunk_size=CHUNK_SIZE):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = length
+        while remaining is None or remaining > 0:
+            chunk = f.read(chunk_size if remaining is None else min(chunk_size, remaining))
+            if not chunk:
+                return
+            if remaining is not None:
+                remaining -= len(chunk)
+            yield chunk
+
+
+_open_storages = {}
+
+def open_storage(config):
+    """Devuelve el backend compartido para ``config`` (dict serializable, viaja en los trabajos)."""
+    key = json.dumps(config, sort_keys=True)
+    if key not in _open_storages:
+        options = dict(config)
+        backend = options.pop('backend')
+        if backend == 'local':
+            _open_storages[key] = LocalStorage(**options)
+        elif backend == 's3':
+            _open_storages[key] = S3Storage(**options)
+        else:
+            raise ValueError(f'Backend de almacenamiento desconocido: {backend}')
+    return _open_storages[key]
+
+
+class LocalStorage:
+    """Almacenamiento en carpetas locales (una por área); es el backend por defecto."""
+
+    is_local = True
+
+    def __init__(self, folders, fsync='file'):
+        self.folders = folders
+        self.fsync = atomic.check_mode(fsync)
+
+    def path(self, area, name):
+        if not valid_name(name):
+            return None
+        return safe_join(self.folders[area], name)
+
+    def put(self, area, name, source_path):
+        """Publica ``source_path`` como ``name``; el archivo de origen se mueve (de forma atómica)."""
+        path = self.path(area, name)
+        os.makedirs(self.folders[area], exist_ok=True)
+        atomic.move_file(source_path, path, self.fsync)
+
+    def copy(self, area, name, new_name):
+        link_or_copy(self.path(area, name), self.path(area, new_name), self.fsync)
+
+    def delete(self, area, name):
+        path = self.path(area, name)
+        if path:
+            try:
+                os.remove(path)
+            except (FileNotFoundError, IsADirectoryError):
+                pass
+
+    def delete_many(self, area, names):
+        for name in names:
+            self.delete(area, name)
+
+    def stat(self, area, name):
+        path = self.path(area, name)
+        try:
+            st = os.stat(path) if path else None
+        except FileNotFoundError:
+            return None
+        return StoredFile(st.st_size, st.st_mtime) if st else None
+
+    def list(self, area):
+        if not os.path.isdir(self.folders[area]):
+            return
+        with os.scandir(self.folders[area]) as entries:
+            for entry in entries:
+                if entry.is_file() and valid_name(entry.name):
+                    yield entry.name
+
+    def local_path(self, area, name):
+        """Ruta en disco para leer el archivo, o ``None`` si no existe."""
+        path = self.path(area, name)
+        return path if path and os.path.isfile(path) else None
+
+    def get(self, area, name):
+        path = self.local_path(area, name)
+        if path is None:
+            return None
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def stream(self, area, name, start=0, length=None):
+        path = self.local_path(area, name)
+        return None if path is None else read_chunks(path, start, length)
+
+
+class S3Storage:
+    """Almacenamiento en un bucket S3 (o compatible: MinIO, R2...) con caché local de lectura.
+
+    Las lecturas se sirven desde una copia en disco (la misma caché LRU acotada
+    que usan las variantes redimensionadas), así los archivos más pedidos no
+    vuelven al bucket. Las subidas y copias grandes se hacen multipart con
+    partes en paralelo; el cliente reutiliza un pool de conexiones.
+    """
+
+    is_local = False
+
+    def __init__(self, bucket, cache_folder, cache_max_bytes, prefix='', endpoint_url=None, region=None,
+                 max_pool_connections=32, multipart_threshold=8 * 1024 * 1024,
+                 multipart_chunksize=8 * 1024 * 1024, max_concurrency=8, fsync='file'):
+        if boto3 is None:
+            raise RuntimeError('STORAGE_BACKEND=s3 requiere boto3 (pip install boto3).')
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = boto3.session.Session().client(
+            's3', endpoint_url=endpoint_url or None, region_name=region or None,
+            config=Config(max_pool_connections=max_pool_connections, retries={'max_attempts': 5, 'mode': 'standard'}),
+        )
+        self.transfer = TransferConfig(multipart_threshold=multipart_threshold, multipart_chunksize=multipart_chunksize,
+                                       max_concurrency=max_concurrency, use_threads=True)
+        self.cache = DerivativeCache(cache_folder, cache_max_bytes, fsync)
+
+    def key(self, area, name):
+        if not valid_name(name):
+            raise ValueError(f'Nombre de archivo no permitido: {name}')
+        return f'{self.prefix}{area}/{name}'
+
+    @staticmethod
+    def _missing(error):
+        return error.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound')
+
+    def put(self, area, name, source_path):
+        """Sube ``source_path`` y lo deja en la caché local, ya que se acaba de generar."""
+        content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        self.client.upload_file(source_path, self.bucket, self.key(area, name),
+                                ExtraArgs={'ContentType': content_type}, Config=self.transfer)
+        def fill(f):
+            with open(source_path, 'rb') as source:
+                shutil.copyfileobj(source, f, CHUNK_SIZE)
+        try:
+            self.cache.get_or_create(area, name, fill)
+        finally:
+            os.remove(source_path)
+
+    def copy(self, area, name, new_name):
+        try:
+            self.client.copy({'Bucket': self.bucket, 'Key': self.key(area, name)}, self.bucket,
+                             self.key(area, new_name), Config=self.transfer)
+        except ClientError as e:
+            if self._missing(e):
+                raise FileNotFoundError(name)
+            raise
+
+    def delete(self, area, name):
+        self.delete_many(area, [name])
+
+    def delete_many(self, area, names):
+        """Borra en lotes de hasta 1000 objetos por petición (``DeleteObjects``)."""
+        names = [name for name in names if valid_name(name)]
+        for start in range(0, len(names), DELETE_BATCH):
+            batch = names[start:start + DELETE_BATCH]
+            self.client.delete_objects(Bucket=self.bucket, Delete={
+                'Objects': [{'Key': self.key(area, name)} for name in batch], 'Quiet': True,
+            })
+        for name in names:
+            try:
+                os.remove(self.cache.path(area, name))
+            except FileNotFoundError:
+                pass
+
+    def stat(self, area, name):
+        if not valid_name(name):
+            return None
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=self.key(area, name))
+        except ClientError as e:
+            if self._missing(e):
+                return None
+            raise
+        return StoredFile(head['ContentLength'], head['LastModified'].timestamp())
+
+    def list(self, area):
+        prefix = f'{self.prefix}{area}/'
+        for page in self.client.get_paginator('list_objects_v2').paginate(Bucket=self.bucket, Prefix=prefix):
+            for item in page.get('Contents', []):
+                name = item['Key'][len(prefix):]
+                if valid_name(name):
+                    yield name
+
+    def local_path(self, area, name):
+        """Copia en la caché local (se descarga la primera vez), o ``None`` si no existe."""
+        if not valid_name(name):
+            return None
+        try:
+            return self.cache.get_or_create(area, name, lambda f: self.client.download_fileobj(
+                self.bucket, self.key(area, name), f, Config=self.transfer))
+        except ClientError as e:
+            if self._missing(e):
+                return None
+            raise
+
+    def get(self, area, name):
+        path = self.local_path(area, name)
+        if path is None:
+            return None
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def stream(self, area, name, start=0, length=None):
+        path = self.local_path(area, name)
+        return None if path is None else read_chunks(path, start, length)
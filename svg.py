@@ -0,0 +1,210 @@
+import gzip
+import os
+import re
+import xml.etree.ElementTree as ET
+from io import BytesIO
+from PIL import Image
+
+try:
+    import brotli
+except ImportError:  # Sin brotli solo se guarda la copia gzip
+    brotli = None
+
+try:
+    import cairosvg
+except (ImportError, OSError):  # OSError: cairosvg instalado pero falta la biblioteca cairo
+    cairosvg = None
+
+SVG_NS = 'http://www.w3.org/2000/svg'
+XLINK_NS = 'http://www.w3.org/1999/xlink'
+
+XML_NS = 'http://www.w3.org/XML/1998/namespace'
+
+# Lista de permitidos: todo elemento o atributo que no esté aquí se elimina.
+# Así quedan fuera los metadatos y espacios de nombres de los editores
+# (Inkscape, Illustrator, Sketch, Figma, RDF), y también <script>,
+# <foreignObject>, los manejadores on* y los elementos de HTML incrustados
+ALLOWED_ELEMENTS = set("""
+a animate animateMotion animateTransform circle clipPath defs desc ellipse feBlend feColorMatrix
+feComponentTransfer feComposite feConvolveMatrix feDiffuseLighting feDisplacementMap feDistantLight feDropShadow
+feFlood feFuncA feFuncB feFuncG feFuncR feGaussianBlur feImage feMerge feMergeNode feMorphology feOffset
+fePointLight feSpecularLighting feSpotLight feTile feTurbulence filter g image line linearGradient marker mask
+mpath path pattern polygon polyline radialGradient rect set stop style svg switch symbol text textPath title
+tspan use view
+""".split())
+ALLOWED_ATTRIBUTES = set("""
+accumulate additive alignment-baseline amplitude attributeName attributeType azimuth baseFrequency
+baseline-shift baseProfile begin bias by calcMode class clip clip-path clip-rule clipPathUnits color
+color-interpolation color-interpolation-filters color-rendering cx cy d diffuseConstant direction display divisor
+dominant-baseline dur dx dy edgeMode elevation end exponent fill fill-opacity fill-rule filter filterUnits
+flood-color flood-opacity font-family font-size font-size-adjust font-stretch font-style font-variant font-weight
+fr from fx fy gradientTransform gradientUnits height href id image-rendering in in2 intercept k k1 k2 k3 k4
+kernelMatrix kernelUnitLength keyPoints keySplines keyTimes lang lengthAdjust letter-spacing lighting-color
+limitingConeAngle marker-end marker-mid marker-start markerHeight markerUnits markerWidth mask maskContentUnits
+maskUnits max media method min mode numOctaves offset opacity operator order orient overflow paint-order path
+pathLength patternContentUnits patternTransform patternUnits pointer-events points pointsAtX pointsAtY pointsAtZ
+preserveAlpha preserveAspectRatio primitiveUnits r radius refX refY repeatCount repeatDur restart result role
+rotate rx ry scale seed shape-rendering side slope spacing specularConstant specularExponent spreadMethod
+startOffset stdDeviation stitchTiles stop-color stop-opacity stroke stroke-dasharray stroke-dashoffset
+stroke-linecap stroke-linejoin stroke-miterlimit stroke-opacity stroke-width style surfaceScale systemLanguage
+tabindex tableValues targetX targetY text-anchor text-decoration text-rendering textLength to transform
+transform-origin type values vector-effect version viewBox visibility width word-spacing writing-mode x x1 x2
+xChannelSelector y y1 y2 yChannelSelector z
+""".split())
+ALLOWED_XLINK_ATTRIBUTES = {'href', 'title'}
+ALLOWED_XML_ATTRIBUTES = {'space', 'lang'}
+# Pueden cambiar un atributo de su elemento padre mientras se reproduce
+ANIMATION_ELEMENTS = {'set', 'animate', 'animateMotion', 'animateTransform'}
+# Dentro de estos elementos los espacios forman parte del texto
+TEXT_ELEMENTS = {'text', 'tspan', 'textPath', 'style', 'title', 'desc'}
+# El navegador ignora espacios y caracteres de control dentro del esquema (``jav&#x09;ascript:``)
+IGNORED_URL_CHARACTERS = re.compile(r'[\x00-\x20\x7f]+')
+URL_SCHEME = re.compile(r'^([a-z][a-z0-9+.-]*):', re.IGNORECASE)
+SAFE_URL_SCHEMES = {'http', 'https'}
+SAFE_DATA_URL = re.compile(r'^data:image/(png|jpeg|gif|webp|avif)[;,]', re.IGNORECASE)
+
+# Copias precomprimidas: codificación HTTP -> sufijo del archivo (``<uuid>.svg.br``)
+ENCODINGS = {'br': '.br', 'gzip': '.gz'}
+THUMBNAIL_EXTENSION = '.webp'
+
+# Prefijos al serializar (si no, ElementTree inventa ns0:, ns1:...)
+ET.register_namespace('', SVG_NS)
+ET.register_namespace('xlink', XLINK_NS)
+
+
+class InvalidSvg(ValueError):
+    """El archivo no es un documento SVG que se pueda publicar."""
+
+
+def split_tag(tag):
+    """``'{ns}nombre'`` -> ``('ns', 'nombre')``."""
+    if isinstance(tag, str) and tag.startswith('{'):
+        namespace, _, name = tag[1:].partition('}')
+        return namespace, name
+    return None, tag
+
+def is_safe_url(value):
+    """Solo enlaces internos (``#id``), relativos, http(s) e imágenes ``data:`` que no son SVG."""
+    url = IGNORED_URL_CHARACTERS.sub('', value)
+    scheme = URL_SCHEME.match(url)
+    if scheme is None:
+        return True
+    return scheme.group(1).lower() in SAFE_URL_SCHEMES or bool(SAFE_DATA_URL.match(url))
+
+def is_allowed_attribute(attribute, value):
+    namespace, name = split_tag(attribute)
+    if namespace is None:
+        allowed = name in ALLOWED_ATTRIBUTES or name.startswith(('data-', 'aria-'))
+    elif namespace == XLINK_NS:
+        allowed = name in ALLOWED_XLINK_ATTRIBUTES
+    else:
+        allowed = namespace == XML_NS and name in ALLOWED_XML_ATTRIBUTES
+    return allowed and (name != 'href' or is_safe_url(value))
+
+def is_allowed_element(element, svg_namespace):
+    namespace, name = split_tag(element.tag)
+    if namespace != svg_namespace or name not in ALLOWED_ELEMENTS:
+        return False
+    if name in ANIMATION_ELEMENTS:
+        # <set attributeName="href" to="javascript:..."> cambia el enlace después de limpiar
+        target = IGNORED_URL_CHARACTERS.sub('', element.get('attributeName', '')).rpartition(':')[2].lower()
+        return target != 'href' and not target.startswith('on')
+    return True
+
+def clean_element(element, svg_namespace=SVG_NS):
+    previous = None
+    for child in list(element):
+        if not is_allowed_element(child, svg_namespace):
+            if child.tail and child.tail.strip():
+                # Se conserva el texto que seguía al elemento eliminado
+                if previous is None:
+                    element.text = (element.text or '') + child.tail
+                else:
+                    previous.tail = (previous.tail or '') + child.tail
+            element.remove(child)
+        else:
+            clean_element(child, svg_namespace)
+            previous = child
+
+    for attribute, value in list(element.attrib.items()):
+        if not is_allowed_attribute(attribute, value):
+            del element.attrib[attribute]
+
+    if split_tag(element.tag)[1] not in TEXT_ELEMENTS:
+        # Espacios de indentación entre elementos
+        if element.text and not element.text.strip():
+            element.text = None
+        for child in element:
+            if child.tail and not child.tail.strip():
+                child.tail = None
+
+def sanitize(data):
+    """Limpia y minifica un SVG; devuelve los bytes listos para publicar.
+
+    Quita comentarios, declaraciones (``<?xml``, ``<!DOCTYPE``) e
+    indentación, y deja solo los elementos y atributos SVG de la lista de
+    permitidos: el archivo se sirve desde el dominio del CDN, así que nada
+    que pueda ejecutar código (scripts, ``on*``, enlaces ``javascript:``,
+    animaciones que cambian ``href``, HTML incrustado) debe sobrevivir. No
+    toca coordenadas ni estilos, así el dibujo queda idéntico.
+    """
+    if b'<!ENTITY' in data:
+        # Sin entidades no hay expansión exponencial ni archivos externos
+        raise InvalidSvg('El SVG declara entidades.')
+    try:
+        root = ET.fromstring(data)
+    except ET.ParseError as e:
+        raise InvalidSvg(f'XML no válido: {e}')
+    namespace, name = split_tag(root.tag)
+    if name != 'svg':
+        raise InvalidSvg('El documento no es un SVG.')
+    clean_element(root, namespace)
+    if namespace is None:
+        # Sin xmlns (solo válido incrustado en HTML): se agrega para que funcione como archivo
+        root.set('xmlns', SVG_NS)
+    # ElementTree escapa ``>`` en textos y atributos: `` />`` solo puede ser un cierre de etiqueta
+    return ET.tostring(root, encoding='utf-8').replace(b' />', b'/>')
+
+def encoded_name(filename, encoding):
+    return filename + ENCODINGS[encoding]
+
+def is_encoded_copy(filename):
+    return filename.endswith(tuple(ENCODINGS.values()))
+
+def precompress(data, folder, filename):
+    """Guarda en ``folder`` las copias comprimidas de ``data`` que resulten más chicas.
+
+    Devuelve las codificaciones guardadas, de la preferida a la menos preferida.
+    """
+    copies = {'gzip': gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        copies['br'] = brotli.compress(data, mode=brotli.MODE_TEXT, quality=11)
+    encodings = []
+    for encoding in ENCODINGS:
+        body = copies.get(encoding)
+        if body is None or len(body) >= len(data):
+            continue
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, encoded_name(filename, encoding)), 'wb') as f:
+            f.write(body)
+        encodings.append(encoding)
+    return encodings
+
+def thumbnail_name(filename):
+    """Las miniaturas de SVG se rasterizan a WebP: ``<uuid>.svg`` -> ``<uuid>.svg.webp``."""
+    return filename + THUMBNAIL_EXTENSION if filename.endswith('.svg') else filename
+
+def thumbnail_source(name):
+    """Inverso de ``thumbnail_name``: el archivo al que pertenece una miniatura."""
+    suffix = '.svg' + THUMBNAIL_EXTENSION
+    return name[:-len(THUMBNAIL_EXTENSION)] if name.endswith(suffix) else name
+
+def refuse_url(url, resource_type=None):
+    raise ValueError(f'Recurso externo bloqueado: {url}')
+
+def rasterize(data, width):
+    """Rasteriza el SVG a ``width`` pixeles de ancho; ``None`` si cairosvg no está disponible."""
+    if cairosvg is None:
+        return None
+    png = cairosvg.svg2png(bytestring=data, output_width=width, url_fetcher=refuse_url)
+    return Image.open(BytesIO(png))
@@ -1,11 +1,52 @@
 import unittest
 import tempfile
+import gzip
+import asyncio
 import os
 import shutil
 from io import BytesIO
 from PIL import Image
 import uuid
+import time
+import tarfile
+import zipfile
+from unittest import mock
 from app import app
+import svg as svg_tools
+
+
+class MandaditosCDNAppTestCase(unittest.TestCase):
+    """Shared fixture: temporary content and data folders, a test client and the config restored afterwards."""
+
+    processing_workers = 0
+
+    def setUp(self):
+        self.app = app
+        self.saved_config = dict(self.app.config)
+
+        self.test_dir = tempfile.mkdtemp()
+        self.upload_dir = os.path.join(self.test_dir, 'uploads')
+        self.thumbnail_dir = os.path.join(self.test_dir, 'uploads', 'thumbnails')
+        self.variant_dir = os.path.join(self.test_dir, 'variants')
+        self.data_dir = os.path.join(self.test_dir, 'data')
+        os.makedirs(self.thumbnail_dir, exist_ok=True)
+
+        self.app.config.update(
+            TESTING=True,
+            UPLOAD_FOLDER=self.upload_dir,
+            THUMBNAIL_FOLDER=self.thumbnail_dir,
+            VARIANT_FOLDER=self.variant_dir,
+            DATA_FOLDER=self.data_dir,
+            PROCESSING_WORKERS=self.processing_workers,
+            X_ACCEL_REDIRECT_PREFIX='',
+        )
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        self.app.config.clear()
+        self.app.config.update(self.saved_config)
+        shutil.rmtree(self.test_dir)
+
 
 class MandaditosCDNTestCase(unittest.TestCase):
     
@@ -25,6 +66,9 @@ class MandaditosCDNTestCase(unittest.TestCase):
         
         self.app.config['UPLOAD_FOLDER'] = self.upload_dir
         self.app.config['THUMBNAIL_FOLDER'] = self.thumbnail_dir
+        self.app.config['VARIANT_FOLDER'] = os.path.join(self.test_dir, 'variants')
+        self.app.config['DATA_FOLDER'] = os.path.join(self.test_dir, 'data')
+        self.app.config['PROCESSING_WORKERS'] = 0
         
         self.client = self.app.test_client()
         
@@ -320,6 +364,9 @@ class MandaditosCDNIntegrationTest(unittest.TestCase):
         
         self.app.config['UPLOAD_FOLDER'] = self.upload_dir
         self.app.config['THUMBNAIL_FOLDER'] = self.thumbnail_dir
+        self.app.config['VARIANT_FOLDER'] = os.path.join(self.test_dir, 'variants')
+        self.app.config['DATA_FOLDER'] = os.path.join(self.test_dir, 'data')
+        self.app.config['PROCESSING_WORKERS'] = 0
         
         self.client = self.app.test_client()
     
@@ -381,6 +428,1903 @@ class MandaditosCDNIntegrationTest(unittest.TestCase):
         self.assertEqual(thumb_after_delete.status_code, 404)
 
 
+
+class MandaditosCDNBackgroundProcessingTest(MandaditosCDNAppTestCase):
+    """Tests for the background processing queue."""
+
+    processing_workers = 1
+
+    def tearDown(self):
+        # Los trabajos que la prueba no esperó siguen escribiendo en test_dir
+        jobs_dir = os.path.join(self.test_dir, 'data', 'jobs')
+        for name in os.listdir(jobs_dir) if os.path.isdir(jobs_dir) else []:
+            if not name.startswith('.'):
+                self.wait_for_job(os.path.splitext(name)[0])
+        super().tearDown()
+
+    def create_test_image(self, format='JPEG', size=(120, 80)):
+        img = Image.new('RGB', size, color='purple')
+        img_io = BytesIO()
+        img.save(img_io, format=format)
+        img_io.seek(0)
+        return img_io
+
+    def wait_for_job(self, job_id, timeout=30):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            data = self.client.get(f'/jobs/{job_id}').get_json()
+            if data['status'] in ('done', 'failed'):
+                return data
+            time.sleep(0.1)
+        self.fail('Job did not finish in time')
+
+    def test_upload_returns_job_immediately(self):
+        """Test that a JSON upload answers with the final filename and a pollable job."""
+        response = self.client.post('/upload', data={
+            'file': (self.create_test_image(), 'photo.jpg')
+        }, headers={'Accept': 'application/json'})
+
+        self.assertEqual(response.status_code, 202)
+        data = response.get_json()
+        self.assertEqual(data['status'], 'queued')
+        self.assertTrue(data['filename'].endswith('.webp'))
+        self.assertTrue(data['status_url'].endswith(f"/jobs/{data['job_id']}"))
+
+        result = self.wait_for_job(data['job_id'])
+        self.assertEqual(result['status'], 'done')
+        self.assertEqual(result['filename'], data['filename'])
+        self.assertTrue(os.path.exists(os.path.join(self.upload_dir, data['filename'])))
+        self.assertTrue(os.path.exists(os.path.join(self.thumbnail_dir, data['filename'])))
+
+    def test_upload_form_flashes_pending_job(self):
+        """Test that the HTML form flow redirects and lists the pending job."""
+        response = self.client.post('/upload', data={
+            'file': (self.create_test_image(), 'photo.jpg')
+        }, follow_redirects=True)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Archivo subido correctamente', response.data)
+        self.assertIn(b'pendingJobs', response.data)
+
+    def test_unknown_job_status(self):
+        """Test that unknown job ids return 404."""
+        response = self.client.get(f'/jobs/{uuid.uuid4()}')
+        self.assertEqual(response.status_code, 404)
+
+        response = self.client.get('/jobs/not-a-uuid')
+        self.assertEqual(response.status_code, 404)
+
+    def test_queue_full_rejects_upload(self):
+        """Test that a saturated queue answers 503 and keeps no leftovers."""
+        self.app.config['PROCESSING_QUEUE_SIZE'] = 0
+        try:
+            response = self.client.post('/upload', data={
+                'file': (self.create_test_image(), 'photo.jpg')
+            }, headers={'Accept': 'application/json'})
+        finally:
+            self.app.config['PROCESSING_QUEUE_SIZE'] = 64
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(os.listdir(os.path.join(self.test_dir, 'data', 'incoming')), [])
+
+    def test_dead_worker_fails_job_and_pool_recovers(self):
+        """Test that a worker killed mid-job marks it failed and later uploads still work."""
+        from app import get_job_queue
+        queue = get_job_queue()
+        submit = queue.submit
+        with mock.patch.object(queue, 'submit', lambda fn, job, **kwargs: submit(os._exit, 1, **kwargs)):
+            response = self.client.post('/upload', data={
+                'file': (self.create_test_image(), 'photo.jpg')
+            }, headers={'Accept': 'application/json'})
+            self.assertEqual(response.status_code, 202)
+            result = self.wait_for_job(response.get_json()['job_id'])
+
+        self.assertEqual(result['status'], 'failed')
+        self.assertIn('error', result)
+        self.assertEqual(os.listdir(os.path.join(self.test_dir, 'data', 'incoming')), [])
+
+        response = self.client.post('/upload', data={
+            'file': (self.create_test_image(), 'photo.jpg')
+        }, headers={'Accept': 'application/json'})
+        self.assertEqual(self.wait_for_job(response.get_json()['job_id'])['status'], 'done')
+
+    def test_submit_error_fails_job(self):
+        """Test that an unexpected submit error leaves a failed job instead of a queued one."""
+        from app import get_job_queue
+        with mock.patch.object(get_job_queue(), 'submit', side_effect=RuntimeError('cannot schedule new futures')):
+            response = self.client.post('/upload', data={
+                'file': (self.create_test_image(), 'photo.jpg')
+            }, headers={'Accept': 'application/json'})
+
+        data = response.get_json()
+        self.assertEqual(data['status'], 'failed')
+        self.assertEqual(self.client.get(f"/jobs/{data['job_id']}").get_json()['status'], 'failed')
+        self.assertEqual(os.listdir(os.path.join(self.test_dir, 'data', 'incoming')), [])
+
+
+
+class MandaditosCDNBatchUploadTest(MandaditosCDNAppTestCase):
+    """Tests for the multi-file and archive upload endpoint."""
+
+    def image_bytes(self, format='JPEG', color='orange'):
+        img_io = BytesIO()
+        Image.new('RGB', (60, 40), color=color).save(img_io, format=format)
+        return img_io.getvalue()
+
+    def uploaded_files(self):
+        return [f for f in os.listdir(self.upload_dir) if f != 'thumbnails']
+
+    def test_batch_upload_multiple_files(self):
+        """Test that several files are processed in one request with one summary each."""
+        response = self.client.post('/upload/batch', data={
+            'files': [
+                (BytesIO(self.image_bytes()), 'one.jpg'),
+                (BytesIO(self.image_bytes('PNG')), 'two.png'),
+                (BytesIO(b'not an image'), 'notes.txt'),
+            ]
+        })
+
+        self.assertEqual(response.status_code, 200)
+        data = response.get_json()
+        self.assertEqual([f['name'] for f in data['files']], ['one.jpg', 'two.png', 'notes.txt'])
+        self.assertEqual(data['summary'], {'done': 2, 'rejected': 1})
+        self.assertEqual(len(self.uploaded_files()), 2)
+        self.assertEqual(len(os.listdir(self.thumbnail_dir)), 2)
+
+    def test_batch_upload_zip_archive(self):
+        """Test importing the images contained in a zip archive."""
+        archive = BytesIO()
+        with zipfile.ZipFile(archive, 'w') as zf:
+            zf.writestr('catalog/a.jpg', self.image_bytes())
+            zf.writestr('catalog/b.png', self.image_bytes('PNG'))
+            zf.writestr('catalog/readme.txt', 'hola')
+            zf.writestr('__MACOSX/catalog/._a.jpg', 'junk')
+        archive.seek(0)
+
+        response = self.client.post('/upload/batch', data={'files': (archive, 'catalog.zip')})
+
+        data = response.get_json()
+        self.assertEqual(data['summary'], {'done': 2, 'skipped': 2})
+        self.assertEqual(len(self.uploaded_files()), 2)
+        self.assertEqual(os.listdir(os.path.join(self.test_dir, 'data', 'incoming')), [])
+
+    def test_batch_upload_tar_archive(self):
+        """Test importing the images contained in a gzipped tar archive."""
+        archive = BytesIO()
+        with tarfile.open(fileobj=archive, mode='w:gz') as tf:
+            payload = self.image_bytes()
+            info = tarfile.TarInfo('photos/a.jpg')
+            info.size = len(payload)
+            tf.addfile(info, BytesIO(payload))
+        archive.seek(0)
+
+        response = self.client.post('/upload/batch', data={'files': (archive, 'photos.tar.gz')})
+
+        data = response.get_json()
+        self.assertEqual(data['summary'], {'done': 1})
+        self.assertTrue(data['files'][0]['filename'].endswith('.webp'))
+
+    def test_batch_upload_invalid_archive(self):
+        """Test that a corrupt archive is reported instead of failing the request."""
+        response = self.client.post('/upload/batch', data={'files': (BytesIO(b'garbage'), 'broken.zip')})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['summary'], {'failed': 1})
+
+    def test_batch_upload_without_files(self):
+        """Test that an empty batch is rejected."""
+        response = self.client.post('/upload/batch', data={})
+        self.assertEqual(response.status_code, 400)
+
+
+
+class MandaditosCDNAssetIndexTest(MandaditosCDNAppTestCase):
+    """Tests for the persistent asset index behind the main page."""
+
+    def upload(self, size=(64, 64), color='teal'):
+        img_io = BytesIO()
+        Image.new('RGB', size, color=color).save(img_io, format='PNG')
+        img_io.seek(0)
+        response = self.client.post('/upload', data={'file': (img_io, 'image.png')},
+                                    headers={'Accept': 'application/json'})
+        return response.get_json()['filename']
+
+    def test_upload_records_metadata(self):
+        """Test that uploads are stored in the index with their metadata."""
+        from app import get_asset_index
+
+        filename = self.upload(size=(80, 30))
+        with self.app.app_context():
+            asset = get_asset_index().get(filename)
+
+        self.assertEqual((asset['width'], asset['height']), (80, 30))
+        self.assertEqual(asset['mime_type'], 'image/webp')
+        self.assertEqual(asset['thumbnail'], filename)
+        self.assertEqual(asset['size'], os.path.getsize(os.path.join(self.upload_dir, filename)))
+        self.assertEqual(len(asset['content_hash']), 64)
+
+    def test_index_paginates_with_cursor(self):
+        """Test that the main page pages through the index with a cursor."""
+        self.app.config['PAGE_SIZE'] = 2
+        filenames = [self.upload() for _ in range(3)]
+
+        first = self.client.get('/')
+        self.assertEqual(first.status_code, 200)
+        self.assertIn(b'cursor=', first.data)
+        shown = [f for f in filenames if f.encode() in first.data]
+        self.assertEqual(len(shown), 2)
+
+        cursor = first.data.split(b'cursor=')[1].split(b'&')[0].decode()
+        second = self.client.get(f'/?cursor={cursor}')
+        self.assertEqual(second.status_code, 200)
+        remaining = [f for f in filenames if f.encode() in second.data]
+        self.assertEqual(remaining, [f for f in filenames if f not in shown])
+        self.assertNotIn(b'cursor=', second.data)
+
+    def test_index_sorts_by_size(self):
+        """Test sorting the listing by file size."""
+        from app import get_asset_index
+
+        small = self.upload(size=(8, 8))
+        large = self.upload(size=(300, 300), color='navy')
+        with self.app.app_context():
+            rows, _ = get_asset_index().page(sort='size', order='asc')
+        sizes = {f: os.path.getsize(os.path.join(self.upload_dir, f)) for f in (small, large)}
+        self.assertEqual([r['filename'] for r in rows], sorted(sizes, key=sizes.get))
+
+        response = self.client.get('/?sort=size&order=asc')
+        self.assertEqual(response.status_code, 200)
+
+    def test_index_filters_by_type(self):
+        """Test filtering the listing by mime type."""
+        filename = self.upload()
+
+        response = self.client.get('/?type=image/svg%2Bxml')
+        self.assertNotIn(filename.encode(), response.data)
+        response = self.client.get('/?type=image/webp')
+        self.assertIn(filename.encode(), response.data)
+
+    def test_index_rejects_invalid_parameters(self):
+        """Test that unknown sort keys and broken cursors are rejected."""
+        self.assertEqual(self.client.get('/?sort=owner').status_code, 400)
+        self.assertEqual(self.client.get('/?cursor=not-a-cursor').status_code, 400)
+
+    def test_listing_api(self):
+        """Test the JSON listing: dimensions for the layout and cursor paging."""
+        filenames = [self.upload(size=(500, 100)) for _ in range(3)]
+
+        first = self.client.get('/api/files?limit=2&sort=name&order=asc')
+        self.assertEqual(first.status_code, 200)
+        data = first.get_json()
+        self.assertEqual(data['total'], 3)
+        self.assertEqual([f['filename'] for f in data['files']], sorted(filenames)[:2])
+        asset = data['files'][0]
+        self.assertEqual((asset['width'], asset['height']), (500, 100))
+        self.assertEqual((asset['thumbnail_width'], asset['thumbnail_height']), (250, 50))
+        self.assertTrue(asset['thumbnail_url'].endswith(f"/cdn/thumbnails/{asset['thumbnail']}"))
+        self.assertTrue(asset['cdn_url'].endswith(f"/cdn/{asset['filename']}"))
+
+        second = self.client.get(f"/api/files?limit=2&sort=name&order=asc&cursor={data['next_cursor']}").get_json()
+        self.assertEqual([f['filename'] for f in second['files']], sorted(filenames)[2:])
+        self.assertIsNone(second['next_cursor'])
+
+        self.assertEqual(self.client.get('/api/files?sort=owner').status_code, 400)
+        self.assertEqual(self.client.get('/api/files?cursor=not-a-cursor').get_json()['error'],
+                         'Parámetros de listado no válidos.')
+
+    def test_index_embeds_first_page_for_gallery(self):
+        """Test that the page renders only the first page and hands it to the virtual gallery."""
+        import json
+
+        self.app.config['PAGE_SIZE'] = 2
+        filenames = [self.upload() for _ in range(3)]
+
+        html = self.client.get('/').get_data(as_text=True)
+        self.assertEqual(html.count('class="list-group-item file-item"'), 2)
+        self.assertIn('loading="lazy" decoding="async" width="64" height="64"', html)
+        gallery = json.loads(html.split('id="galleryData">', 1)[1].split('</script>', 1)[0])
+        self.assertEqual(len(gallery['files']), 2)
+        self.assertTrue(set(f['filename'] for f in gallery['files']) < set(filenames))
+        self.assertEqual(gallery['query'], {'sort': 'created', 'order': 'desc', 'type': '', 'limit': 2})
+        self.assertIsNotNone(gallery['next_cursor'])
+
+    def test_delete_removes_from_index(self):
+        """Test that deleting a file removes it from the index."""
+        from app import get_asset_index
+
+        filename = self.upload()
+        self.client.post(f'/delete/{filename}')
+        with self.app.app_context():
+            self.assertIsNone(get_asset_index().get(filename))
+            self.assertEqual(get_asset_index().count(), 0)
+
+    def test_reindex_command(self):
+        """Test rebuilding the index from disk with the CLI command."""
+        with open(os.path.join(self.upload_dir, 'manual.svg'), 'w') as f:
+            f.write('<svg xmlns="http://www.w3.org/2000/svg"/>')
+
+        result = self.app.test_cli_runner().invoke(args=['reindex'])
+        self.assertIn('1 archivos', result.output)
+        self.assertIn(b'manual.svg', self.client.get('/').data)
+
+
+
+class MandaditosCDNDerivativeTest(MandaditosCDNAppTestCase):
+    """Tests for on-demand resized variants."""
+
+    def setUp(self):
+        super().setUp()
+        self.filename = f'{uuid.uuid4()}.webp'
+        Image.new('RGB', (400, 200), color='olive').save(os.path.join(self.upload_dir, self.filename), 'WEBP')
+
+    def cached_variants(self):
+        folder = os.path.join(self.test_dir, 'data', 'derivatives', self.filename)
+        return sorted(os.listdir(folder)) if os.path.isdir(folder) else []
+
+    def test_resize_contain(self):
+        """Test that the default fit keeps the aspect ratio inside the box."""
+        response = self.client.get(f'/cdn/128x128/{self.filename}')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content_type, 'image/webp')
+        self.assertEqual(Image.open(BytesIO(response.data)).size, (128, 64))
+
+    def test_resize_cover_jpeg(self):
+        """Test cropping to the exact box and changing the output format."""
+        response = self.client.get(f'/cdn/64x64/{self.filename}?fit=cover&format=jpeg&q=60')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content_type, 'image/jpeg')
+        self.assertEqual(Image.open(BytesIO(response.data)).size, (64, 64))
+
+    def test_derivative_is_cached(self):
+        """Test that a repeated request is served from the disk cache."""
+        self.client.get(f'/cdn/128x128/{self.filename}')
+        variants = self.cached_variants()
+        self.assertEqual(variants, ['128x128-contain-q80.webp'])
+        path = os.path.join(self.test_dir, 'data', 'derivatives', self.filename, variants[0])
+        mtime = os.path.getmtime(path)
+
+        response = self.client.get(f'/cdn/128x128/{self.filename}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(os.path.getmtime(path), mtime)
+
+    def test_rejects_sizes_outside_allow_list(self):
+        """Test that only configured sizes and qualities are rendered."""
+        self.assertEqual(self.client.get(f'/cdn/127x128/{self.filename}').status_code, 400)
+        self.assertEqual(self.client.get(f'/cdn/128x128/{self.filename}?q=81').status_code, 400)
+        self.assertEqual(self.client.get(f'/cdn/128x128/{self.filename}?fit=stretch').status_code, 400)
+        self.assertEqual(self.cached_variants(), [])
+
+    def test_missing_or_invalid_source(self):
+        """Test missing originals and non-image files."""
+        self.assertEqual(self.client.get('/cdn/128x128/nonexistent.webp').status_code, 404)
+
+        with open(os.path.join(self.upload_dir, 'broken.webp'), 'wb') as f:
+            f.write(b'not an image')
+        self.assertEqual(self.client.get('/cdn/128x128/broken.webp').status_code, 415)
+
+    def test_cache_evicts_least_recently_used(self):
+        """Test that the cache stays under its size limit."""
+        from derivatives import DerivativeCache
+
+        cache = DerivativeCache(os.path.join(self.test_dir, 'cache'), max_bytes=250)
+        for index in range(5):
+            path = cache.get_or_create('asset.webp', f'{index}.bin', lambda f: f.write(b'x' * 100))
+            os.utime(path, (index, index))
+
+        self.assertLessEqual(cache.usage(), 250)
+        self.assertEqual(sorted(os.listdir(os.path.join(self.test_dir, 'cache', 'asset.webp'))), ['3.bin', '4.bin'])
+
+    def test_delete_discards_derivatives(self):
+        """Test that deleting an original also drops its cached variants."""
+        self.client.get(f'/cdn/128x128/{self.filename}')
+        self.client.post(f'/delete/{self.filename}')
+        self.assertEqual(self.cached_variants(), [])
+
+
+
+class MandaditosCDNDeduplicationTest(MandaditosCDNAppTestCase):
+    """Tests for content-addressed upload deduplication."""
+
+    def setUp(self):
+        super().setUp()
+        img_io = BytesIO()
+        Image.new('RGB', (90, 90), color='gold').save(img_io, format='PNG')
+        self.logo = img_io.getvalue()
+
+    def upload(self, payload):
+        response = self.client.post('/upload', data={'file': (BytesIO(payload), 'logo.png')},
+                                    headers={'Accept': 'application/json'})
+        return response.get_json()
+
+    def test_duplicate_upload_creates_alias(self):
+        """Test that identical bytes are linked instead of converted again."""
+        first = self.upload(self.logo)
+        second = self.upload(self.logo)
+
+        self.assertNotIn('duplicate_of', first)
+        self.assertEqual(second['status'], 'done')
+        self.assertEqual(second['duplicate_of'], first['filename'])
+        self.assertNotEqual(second['filename'], first['filename'])
+        self.assertTrue(os.path.samefile(os.path.join(self.upload_dir, first['filename']),
+                                         os.path.join(self.upload_dir, second['filename'])))
+        self.assertTrue(os.path.samefile(os.path.join(self.thumbnail_dir, first['filename']),
+                                         os.path.join(self.thumbnail_dir, second['filename'])))
+        self.assertEqual(os.listdir(os.path.join(self.test_dir, 'data', 'incoming')), [])
+
+    def test_delete_keeps_bytes_used_by_alias(self):
+        """Test that deleting one name leaves the alias intact."""
+        first = self.upload(self.logo)
+        second = self.upload(self.logo)
+
+        self.client.post(f"/delete/{first['filename']}")
+
+        response = self.client.get(f"/cdn/{second['filename']}")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Image.open(BytesIO(response.data)).size, (90, 90))
+        self.assertEqual(self.client.get(f"/cdn/thumbnails/{second['filename']}").status_code, 200)
+
+    def test_different_content_is_not_deduplicated(self):
+        """Test that different bytes are processed separately."""
+        img_io = BytesIO()
+        Image.new('RGB', (90, 90), color='silver').save(img_io, format='PNG')
+
+        first = self.upload(self.logo)
+        second = self.upload(img_io.getvalue())
+
+        self.assertNotIn('duplicate_of', second)
+        self.assertFalse(os.path.samefile(os.path.join(self.upload_dir, first['filename']),
+                                          os.path.join(self.upload_dir, second['filename'])))
+
+
+
+class MandaditosCDNHttpCachingTest(MandaditosCDNAppTestCase):
+    """Tests for ETag, Cache-Control, conditional and range handling on /cdn/."""
+
+    def setUp(self):
+        super().setUp()
+        img_io = BytesIO()
+        Image.new('RGB', (300, 300), color='maroon').save(img_io, format='JPEG')
+        img_io.seek(0)
+        response = self.client.post('/upload', data={'file': (img_io, 'photo.jpg')},
+                                    headers={'Accept': 'application/json'})
+        self.filename = response.get_json()['filename']
+        with self.app.app_context():
+            from app import get_asset_index
+            self.asset = get_asset_index().get(self.filename)
+
+    def test_strong_etag_from_content_hash(self):
+        """Test that files carry a strong ETag and immutable caching."""
+        response = self.client.get(f'/cdn/{self.filename}')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['ETag'], f'"{self.asset["content_hash"]}"')
+        self.assertIn('immutable', response.headers['Cache-Control'])
+        self.assertIn('max-age=31536000', response.headers['Cache-Control'])
+
+        thumb = self.client.get(f'/cdn/thumbnails/{self.filename}')
+        self.assertEqual(thumb.headers['ETag'], f'"{self.asset["thumbnail_hash"]}"')
+
+    def test_conditional_request_skips_file(self):
+        """Test that a matching If-None-Match answers 304 without opening the file."""
+        etag = f'"{self.asset["content_hash"]}"'
+        with mock.patch('app.send_from_directory') as send:
+            response = self.client.get(f'/cdn/{self.filename}', headers={'If-None-Match': etag})
+
+        send.assert_not_called()
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers['ETag'], etag)
+        self.assertIn('immutable', response.headers['Cache-Control'])
+
+        response = self.client.get(f'/cdn/128x128/{self.filename}',
+                                   headers={'If-None-Match': f'"{self.asset["content_hash"]}-128x128-contain-q80.webp"'})
+        self.assertEqual(response.status_code, 304)
+
+    def test_range_request(self):
+        """Test that byte ranges are honoured."""
+        response = self.client.get(f'/cdn/{self.filename}', headers={'Range': 'bytes=0-9'})
+
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(len(response.data), 10)
+        self.assertTrue(response.headers['Content-Range'].startswith('bytes 0-9/'))
+
+        stale = self.client.get(f'/cdn/{self.filename}', headers={'Range': 'bytes=0-9', 'If-Range': '"other"'})
+        self.assertEqual(stale.status_code, 200)
+
+    def test_x_accel_redirect_mode(self):
+        """Test handing the transfer to nginx with X-Accel-Redirect."""
+        self.app.config['X_ACCEL_REDIRECT_PREFIX'] = '/_accel'
+
+        response = self.client.get(f'/cdn/{self.filename}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['X-Accel-Redirect'], f'/_accel/content/{self.filename}')
+        self.assertEqual(response.content_type, 'image/webp')
+        self.assertEqual(response.data, b'')
+
+        thumb = self.client.get(f'/cdn/thumbnails/{self.filename}')
+        self.assertEqual(thumb.headers['X-Accel-Redirect'], f'/_accel/thumbnails/{self.filename}')
+
+        self.assertEqual(self.client.get('/cdn/nonexistent.webp').status_code, 404)
+
+        # Representación negociada: nginx solo reenvía ETag y Vary si nginx.conf los copia
+        jpeg = self.client.get(f'/cdn/{self.filename}', headers={'Accept': 'image/jpeg'})
+        self.assertTrue(jpeg.headers['X-Accel-Redirect'].startswith('/_accel/derivatives/'))
+        self.assertIn('Accept', jpeg.vary)
+        self.assertTrue(jpeg.headers['ETag'])
+
+    def test_nginx_forwards_app_headers_on_x_accel(self):
+        """Test that every internal nginx location re-emits the app's ETag and Vary."""
+        import re
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'nginx.conf')) as f:
+            config = f.read()
+
+        blocks = re.findall(r'location (/_accel/\S+|~ \S+) \{(.*?)(?=\n\s*(?:location|\}))', config, re.S)
+        self.assertEqual(len([path for path, _ in blocks if path.startswith('/_accel/')]), 5)
+        for path, block in blocks:
+            self.assertIn('add_header ETag $upstream_http_etag always;', block, path)
+            self.assertIn('add_header Vary $upstream_http_vary always;', block, path)
+            if path.startswith('/_accel/'):
+                self.assertIn('etag off;', block, path)
+
+
+
+try:
+    import boto3
+    from moto import mock_aws
+except ImportError:
+    boto3 = mock_aws = None
+
+
+class MandaditosCDNStorageTest(unittest.TestCase):
+    """Tests for the storage backend interface with the local filesystem."""
+
+    def setUp(self):
+        from storage import LocalStorage
+
+        self.test_dir = tempfile.mkdtemp()
+        self.storage = LocalStorage({area: os.path.join(self.test_dir, area) for area in ('content', 'thumbnails', 'variants')})
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def put(self, name, data):
+        source = os.path.join(self.test_dir, 'source')
+        with open(source, 'wb') as f:
+            f.write(data)
+        self.storage.put('content', name, source)
+
+    def test_put_stat_stream_delete(self):
+        """Test the basic backend operations."""
+        self.put('a.webp', b'0123456789')
+
+        self.assertEqual(self.storage.stat('content', 'a.webp').size, 10)
+        self.assertEqual(self.storage.get('content', 'a.webp'), b'0123456789')
+        self.assertEqual(b''.join(self.storage.stream('content', 'a.webp', 2, 5)), b'23456')
+        self.assertEqual(list(self.storage.list('content')), ['a.webp'])
+
+        self.storage.copy('content', 'a.webp', 'b.webp')
+        self.storage.delete('content', 'a.webp')
+        self.assertIsNone(self.storage.stat('content', 'a.webp'))
+        self.assertEqual(self.storage.get('content', 'b.webp'), b'0123456789')
+
+    def test_rejects_paths(self):
+        """Test that names with paths never reach the filesystem."""
+        self.assertIsNone(self.storage.local_path('content', '../secret'))
+        self.assertIsNone(self.storage.stat('content', '.hidden'))
+
+
+class MandaditosCDNAtomicWriteTest(unittest.TestCase):
+    """Tests for temp-file-and-rename writes, fsync modes and startup recovery."""
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.folders = {area: os.path.join(self.test_dir, area) for area in ('content', 'thumbnails', 'variants')}
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def source(self, data=b'0123456789'):
+        path = os.path.join(self.test_dir, 'source')
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def test_readers_never_see_partial_files(self):
+        """Test that the target only appears once complete and survives a failed rewrite."""
+        import atomic
+
+        path = os.path.join(self.test_dir, 'a.webp')
+        with atomic.atomic_write(path) as f:
+            f.write(b'first')
+            self.assertFalse(os.path.exists(path))
+        with self.assertRaises(RuntimeError):
+            with atomic.atomic_write(path) as f:
+                f.write(b'half')
+                raise RuntimeError('worker killed')
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), b'first')
+        self.assertEqual(os.listdir(self.test_dir), ['a.webp'])
+        if os.name == 'posix':
+            self.assertEqual(os.stat(path).st_mode & 0o777, atomic.FILE_MODE)
+
+    def test_put_across_filesystems(self):
+        """Test that a move between volumes goes through a temp file next to the target."""
+        import atomic
+        from storage import LocalStorage
+
+        source = self.source()
+        real_replace = os.replace
+
+        def replace(src, dst):
+            if src == source:
+                raise OSError(18, 'Invalid cross-device link')
+            return real_replace(src, dst)
+
+        with mock.patch.object(atomic.os, 'replace', side_effect=replace):
+            LocalStorage(self.folders).put('content', 'a.webp', source)
+        self.assertFalse(os.path.exists(source))
+        self.assertEqual(os.listdir(self.folders['content']), ['a.webp'])
+        with open(os.path.join(self.folders['content'], 'a.webp'), 'rb') as f:
+            self.assertEqual(f.read(), b'0123456789')
+
+    def test_fsync_modes(self):
+        """Test what each durability mode flushes to disk."""
+        import atomic
+        from storage import LocalStorage
+
+        for mode, file_syncs, folder_syncs in (('none', 0, 0), ('file', 1, 0), ('full', 1, 1)):
+            with mock.patch.object(atomic, '_datasync') as datasync, mock.patch.object(atomic.os, 'fsync') as fsync:
+                LocalStorage(self.folders, fsync=mode).put('content', f'{mode}.webp', self.source())
+            self.assertEqual((datasync.call_count, fsync.call_count), (file_syncs, folder_syncs), mode)
+
+        with self.assertRaises(ValueError):
+            LocalStorage(self.folders, fsync='always')
+
+    def test_startup_recovery(self):
+        """Test that leftovers of interrupted writes are removed unless they may still be in progress."""
+        from app import app, recover_interrupted_writes
+
+        config = {key: app.config[key] for key in ('UPLOAD_FOLDER', 'THUMBNAIL_FOLDER', 'VARIANT_FOLDER', 'DATA_FOLDER')}
+        app.config.update(UPLOAD_FOLDER=self.folders['content'], THUMBNAIL_FOLDER=self.folders['thumbnails'],
+                          VARIANT_FOLDER=self.folders['variants'], DATA_FOLDER=os.path.join(self.test_dir, 'data'))
+        self.addCleanup(app.config.update, config)
+
+        stale = [
+            os.path.join(self.folders['content'], '.a.webp.x1.tmp'),
+            os.path.join(self.folders['thumbnails'], '.a.webp.x2.tmp'),
+            os.path.join(self.test_dir, 'data', 'jobs', '.job.json.x3.tmp'),
+            os.path.join(self.test_dir, 'data', 'derivatives', 'a.webp', '.64x64-contain-q80.webp.x4.tmp'),
+        ]
+        fresh = os.path.join(self.folders['variants'], '.a-320w.webp.x5.tmp')
+        kept = [os.path.join(self.folders['content'], 'a.webp'),
+                os.path.join(self.test_dir, 'data', 'derivatives', 'a.webp', '64x64-contain-q80.webp')]
+        for path in stale + kept + [fresh]:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(b'partial')
+        for path in stale + kept:
+            os.utime(path, (time.time() - 3600, time.time() - 3600))
+
+        report = recover_interrupted_writes()
+        self.assertEqual(report.total_files, len(stale))
+        self.assertFalse(any(os.path.exists(path) for path in stale))
+        self.assertTrue(all(os.path.exists(path) for path in kept + [fresh]))
+
+
+@unittest.skipUnless(mock_aws, 'boto3 and moto are required for the S3 backend tests')
+class MandaditosCDNS3StorageTest(MandaditosCDNAppTestCase):
+    """Tests for the S3 backend against moto's in-memory S3."""
+
+    def setUp(self):
+        self.env = mock.patch.dict(os.environ, {
+            'AWS_ACCESS_KEY_ID': 'testing', 'AWS_SECRET_ACCESS_KEY': 'testing', 'AWS_DEFAULT_REGION': 'us-east-1',
+        })
+        self.env.start()
+        self.aws = mock_aws()
+        self.aws.start()
+        self.s3 = boto3.client('s3', region_name='us-east-1')
+        self.s3.create_bucket(Bucket='cdn-test')
+
+        super().setUp()
+        self.app.config['STORAGE_BACKEND'] = 's3'
+        self.app.config['S3_BUCKET'] = 'cdn-test'
+        self.app.config['S3_PREFIX'] = 'cdn/'
+
+    def tearDown(self):
+        super().tearDown()
+        self.aws.stop()
+        self.env.stop()
+
+    def upload(self, color='purple'):
+        img_io = BytesIO()
+        Image.new('RGB', (800, 400), color=color).save(img_io, format='JPEG')
+        response = self.client.post('/upload', data={'file': (BytesIO(img_io.getvalue()), 'photo.jpg')},
+                                    headers={'Accept': 'application/json'})
+        self.assertEqual(response.status_code, 201)
+        return response.get_json()['filename']
+
+    def keys(self):
+        return sorted(item['Key'] for item in self.s3.list_objects_v2(Bucket='cdn-test').get('Contents', []))
+
+    def test_upload_serve_and_delete(self):
+        """Test that uploads land in the bucket, are served through the cache and deleted."""
+        filename = self.upload()
+        stem = filename.rsplit('.', 1)[0]
+
+        self.assertEqual(self.keys(), [f'cdn/content/{filename}', f'cdn/thumbnails/{filename}',
+                                       f'cdn/variants/{stem}-320w.webp', f'cdn/variants/{stem}-640w.webp'])
+        self.assertFalse(os.path.exists(os.path.join(self.upload_dir, filename)))
+
+        response = self.client.get(f'/cdn/{filename}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, self.s3.get_object(Bucket='cdn-test', Key=f'cdn/content/{filename}')['Body'].read())
+        response.close()
+
+        self.client.post(f'/delete/{filename}')
+        self.assertEqual(self.keys(), [])
+        self.assertEqual(self.client.get(f'/cdn/{filename}').status_code, 404)
+
+    def test_read_through_cache(self):
+        """Test that a node without a local copy downloads it once and then serves it locally."""
+        filename = self.upload()
+        shutil.rmtree(os.path.join(self.test_dir, 'data', 'storage-cache'))
+
+        from app import get_storage
+        s3_client = get_storage().client
+        with mock.patch.object(s3_client, 'download_fileobj', wraps=s3_client.download_fileobj) as download:
+            self.client.get(f'/cdn/{filename}').close()
+            self.client.get(f'/cdn/{filename}').close()
+        self.assertEqual(download.call_count, 1)
+
+    def test_duplicates_copy_server_side_and_reindex(self):
+        """Test that duplicate uploads copy objects and the index can be rebuilt from the bucket."""
+        first = self.upload()
+        second = self.upload()
+        self.assertIn(f'cdn/content/{second}', self.keys())
+
+        from asset_index import open_index
+        from app import asset_index_path
+        asset_index = open_index(asset_index_path())
+        asset_index.remove(first)
+        result = self.app.test_cli_runner().invoke(args=['reindex'])
+        self.assertIn('2 archivos', result.output)
+        self.assertIsNotNone(asset_index.get(first)['thumbnail'])
+
+
+def asgi_request(path, headers=(), method='GET', extensions=None):
+    """Runs one request through the ASGI application and collects the response."""
+    from asgi import application
+
+    scope = {
+        'type': 'http', 'http_version': '1.1', 'method': method, 'scheme': 'http', 'path': path,
+        'root_path': '', 'query_string': b'', 'server': ('testserver', 80),
+        'headers': [(name.lower().encode(), value.encode()) for name, value in headers],
+        'extensions': extensions or {},
+    }
+    messages = []
+
+    async def receive():
+        # The request has no body; the client "disconnects" only after the response
+        await asyncio.sleep(3600)
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(application(scope, receive, send))
+    start = messages[0]
+    response_headers = {name.decode(): value.decode() for name, value in start['headers']}
+    body = b''.join(m.get('body', b'') for m in messages[1:])
+    return start['status'], response_headers, body, messages
+
+
+class MandaditosCDNAsgiTest(MandaditosCDNAppTestCase):
+    """Tests for the async /cdn/ entry point."""
+
+    def setUp(self):
+        super().setUp()
+        img_io = BytesIO()
+        Image.new('RGB', (300, 200), color='maroon').save(img_io, format='PNG')
+        response = self.client.post('/upload', data={'file': (BytesIO(img_io.getvalue()), 'photo.png')},
+                                    headers={'Accept': 'application/json'})
+        self.filename = response.get_json()['filename']
+        with open(os.path.join(self.upload_dir, self.filename), 'rb') as f:
+            self.content = f.read()
+
+    def request(self, path, headers=(), method='GET', extensions=None):
+        return asgi_request(path, headers, method, extensions)
+
+    def test_serves_file_with_cache_headers(self):
+        """Test a full download with ETag and immutable caching."""
+        status, headers, body, _ = self.request(f'/cdn/{self.filename}')
+
+        self.assertEqual(status, 200)
+        self.assertEqual(body, self.content)
+        self.assertEqual(headers['content-type'], 'image/webp')
+        self.assertEqual(headers['content-length'], str(len(self.content)))
+        self.assertIn('immutable', headers['cache-control'])
+        self.assertEqual(headers['etag'], self.client.get(f'/cdn/{self.filename}').headers['ETag'])
+
+    def test_conditional_and_range_requests(self):
+        """Test 304 revalidation and byte ranges."""
+        etag = self.request(f'/cdn/{self.filename}')[1]['etag']
+
+        status, _, body, _ = self.request(f'/cdn/{self.filename}', [('If-None-Match', etag)])
+        self.assertEqual((status, body), (304, b''))
+
+        status, headers, body, _ = self.request(f'/cdn/{self.filename}', [('Range', 'bytes=10-19')])
+        self.assertEqual(status, 206)
+        self.assertEqual(body, self.content[10:20])
+        self.assertEqual(headers['content-range'], f'bytes 10-19/{len(self.content)}')
+
+        status, _, _, _ = self.request(f'/cdn/{self.filename}', [('Range', 'bytes=99999999-')])
+        self.assertEqual(status, 416)
+
+    def test_thumbnails_and_missing_files(self):
+        """Test thumbnails, HEAD requests and 404s."""
+        status, headers, body, _ = self.request(f'/cdn/thumbnails/{self.filename}', method='HEAD')
+        self.assertEqual(status, 200)
+        self.assertEqual(body, b'')
+        self.assertGreater(int(headers['content-length']), 0)
+
+        self.assertEqual(self.request('/cdn/missing.webp')[0], 404)
+        self.assertEqual(self.request('/cdn/..%2Fapp.py')[0], 404)
+
+    def test_zero_copy_extension(self):
+        """Test that servers offering sendfile get the file instead of chunks."""
+        _, _, _, messages = self.request(f'/cdn/{self.filename}', extensions={'http.response.pathsend': {}})
+        self.assertEqual(messages[-1]['type'], 'http.response.pathsend')
+        self.assertEqual(messages[-1]['path'], os.path.join(self.upload_dir, self.filename))
+
+    def test_other_routes_use_flask(self):
+        """Test that non-CDN routes are delegated to the WSGI app."""
+        status, headers, body, _ = self.request('/metrics')
+        self.assertEqual(status, 200)
+        self.assertIn(b'cdn_request_seconds', body)
+
+
+class MandaditosCDNResponsiveVariantTest(MandaditosCDNAppTestCase):
+    """Tests for responsive variants generated at upload time."""
+
+    def setUp(self):
+        super().setUp()
+        img_io = BytesIO()
+        Image.new('RGB', (1000, 500), color='indigo').save(img_io, format='JPEG')
+        self.photo = img_io.getvalue()
+
+    def upload(self):
+        response = self.client.post('/upload', data={'file': (BytesIO(self.photo), 'photo.jpg')},
+                                    headers={'Accept': 'application/json'})
+        return response.get_json()['filename']
+
+    def test_upload_generates_smaller_variants(self):
+        """Test that only widths below the original are generated, keeping the aspect ratio."""
+        filename = self.upload()
+        stem = filename.rsplit('.', 1)[0]
+
+        self.assertEqual(sorted(os.listdir(self.variant_dir)), [f'{stem}-320w.webp', f'{stem}-640w.webp'])
+        with Image.open(os.path.join(self.variant_dir, f'{stem}-640w.webp')) as img:
+            self.assertEqual(img.size, (640, 320))
+
+        response = self.client.get(f'/cdn/variants/{stem}-320w.webp')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content_type, 'image/webp')
+        self.assertTrue(response.headers['ETag'].endswith('-320w.webp"'))
+
+    def test_index_exposes_srcset(self):
+        """Test that the listing carries a ready-made srcset."""
+        filename = self.upload()
+        stem = filename.rsplit('.', 1)[0]
+
+        response = self.client.get('/')
+        self.assertIn(f'/cdn/variants/{stem}-320w.webp 320w, '.encode(), response.data)
+        self.assertIn(f'/cdn/{filename} 1000w'.encode(), response.data)
+
+    def test_duplicate_and_delete_handle_variants(self):
+        """Test that aliases link the variants and deletes remove them."""
+        first = self.upload()
+        second = self.upload()
+        first_stem, second_stem = first.rsplit('.', 1)[0], second.rsplit('.', 1)[0]
+        self.assertTrue(os.path.samefile(os.path.join(self.variant_dir, f'{first_stem}-640w.webp'),
+                                         os.path.join(self.variant_dir, f'{second_stem}-640w.webp')))
+
+        self.client.post(f'/delete/{first}')
+        self.assertEqual(sorted(os.listdir(self.variant_dir)), [f'{second_stem}-320w.webp', f'{second_stem}-640w.webp'])
+
+    def test_16_bit_grayscale_png_is_converted(self):
+        """Test that a 16-bit grayscale PNG (mode I;16) still gets its WebP, variants and thumbnail."""
+        img = Image.new('I;16', (1000, 500))
+        img.putdata([(x * 65) % 65536 for x in range(1000)] * 500)
+        img_io = BytesIO()
+        img.save(img_io, format='PNG')
+        img_io.seek(0)
+        with Image.open(img_io) as reopened:
+            self.assertIn(reopened.mode, ('I;16', 'I'))
+        img_io.seek(0)
+
+        response = self.client.post('/upload', data={'file': (img_io, 'depth.png')},
+                                    headers={'Accept': 'application/json'})
+        self.assertEqual(response.status_code, 201)
+        filename = response.get_json()['filename']
+        stem = filename.rsplit('.', 1)[0]
+
+        self.assertTrue(os.path.exists(os.path.join(self.upload_dir, filename)))
+        self.assertTrue(os.path.exists(os.path.join(self.thumbnail_dir, filename)))
+        self.assertEqual(sorted(os.listdir(self.variant_dir)), [f'{stem}-320w.webp', f'{stem}-640w.webp'])
+
+    def test_unsupported_formats_are_ignored(self):
+        """Test that formats the installed Pillow cannot encode are dropped."""
+        from pipeline import supported_variant_formats
+
+        self.assertEqual(supported_variant_formats(['webp', 'heic']), ['webp'])
+
+
+class MandaditosCDNSingleDecodeTest(unittest.TestCase):
+    """Tests for the single-decode conversion and reduced JPEG thumbnail path."""
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def jpeg(self, size, orientation=None):
+        path = os.path.join(self.test_dir, 'source.jpg')
+        img = Image.new('RGB', size, color='navy')
+        exif = Image.Exif()
+        if orientation:
+            exif[0x0112] = orientation
+        img.save(path, 'JPEG', exif=exif.tobytes())
+        return path
+
+    def test_convert_decodes_source_once(self):
+        """Test that the WebP, variants and thumbnail come from one decode of the source."""
+        import pipeline
+
+        source = self.jpeg((1200, 800), orientation=6)
+        webp_path = os.path.join(self.test_dir, 'out.webp')
+        thumb_path = os.path.join(self.test_dir, 'thumb.webp')
+        with mock.patch.object(pipeline.Image, 'open', wraps=Image.open) as opened:
+            variants = pipeline.convert_image(source, webp_path, os.path.join(self.test_dir, 'variants'),
+                                              [320], ['webp'], thumb_path=thumb_path)
+
+        self.assertEqual(opened.call_count, 1)
+        self.assertEqual(variants, [(320, 'webp')])
+        # Orientation 6 rotates the image: the portrait orientation must reach every output
+        with Image.open(webp_path) as img:
+            self.assertEqual(img.size, (800, 1200))
+        with Image.open(thumb_path) as img:
+            self.assertEqual(img.size, (167, 250))
+
+    def test_create_thumbnail_uses_jpeg_draft(self):
+        """Test that large JPEG thumbnails are decoded at a reduced scale."""
+        from PIL import JpegImagePlugin
+        import pipeline
+
+        source = self.jpeg((4000, 3000))
+        thumb_path = os.path.join(self.test_dir, 'thumb.webp')
+        with mock.patch.object(JpegImagePlugin.JpegImageFile, 'draft',
+                               autospec=True, side_effect=JpegImagePlugin.JpegImageFile.draft) as draft:
+            pipeline.create_thumbnail(source, thumb_path)
+
+        self.assertTrue(draft.called)
+        with Image.open(thumb_path) as img:
+            self.assertEqual(img.size, (250, 188))
+
+
+class MandaditosCDNAnimationTest(MandaditosCDNAppTestCase):
+    """Tests for animated GIF to animated WebP conversion."""
+
+    def upload_gif(self):
+        colors = ['red', 'green', 'blue', 'yellow']
+        frames = [Image.new('RGB', (800, 400), color=color).convert('P') for color in colors]
+        gif = BytesIO()
+        frames[0].save(gif, format='GIF', save_all=True, append_images=frames[1:],
+                       duration=[100, 200, 300, 400], loop=0, disposal=2)
+        response = self.client.post('/upload', data={'file': (BytesIO(gif.getvalue()), 'banner.gif')},
+                                    headers={'Accept': 'application/json'})
+        self.assertEqual(response.status_code, 201)
+        return response.get_json()['filename']
+
+    def frames(self, path):
+        with Image.open(path) as img:
+            durations, colors = [], []
+            for index in range(img.n_frames):
+                img.seek(index)
+                img.load()
+                durations.append(img.info['duration'])
+                colors.append(img.convert('RGB').getpixel((0, 0)))
+            return img.size, img.info.get('loop'), durations, colors
+
+    def test_frames_are_a_lazy_pillow_image(self):
+        """Test that appended frames are a real multi-frame Image decoded one frame per seek."""
+        from pipeline import AnimationFrames
+
+        frames = [Image.new('RGB', (80, 40), color=color) for color in ('red', 'green', 'blue')]
+        gif = BytesIO()
+        frames[0].save(gif, format='GIF', save_all=True, append_images=frames[1:], duration=[10, 20, 30])
+        with Image.open(gif) as img:
+            durations = [0] * img.n_frames
+            lazy = AnimationFrames(img, durations, (40, 20))
+            self.assertIsInstance(lazy, Image.Image)
+            self.assertEqual(lazy.n_frames, 2)
+            self.assertEqual(durations, [0, 20, 0])  # Solo el cuadro pedido se decodifica
+            lazy.seek(1)
+            self.assertEqual((lazy.size, lazy.convert('RGB').getpixel((0, 0))), ((40, 20), (0, 0, 255)))
+            self.assertEqual(durations, [0, 20, 30])
+
+    def test_gif_becomes_animated_webp(self):
+        """Test that every frame, its timing and the loop count survive the conversion."""
+        filename = self.upload_gif()
+
+        size, loop, durations, colors = self.frames(os.path.join(self.upload_dir, filename))
+        self.assertEqual(size, (800, 400))
+        self.assertEqual(loop, 0)
+        self.assertEqual(durations, [100, 200, 300, 400])
+        self.assertEqual([max(range(3), key=color.__getitem__) for color in colors[:3]], [0, 1, 2])
+        # Animated files do not get static responsive variants
+        self.assertFalse(os.path.exists(self.app.config['VARIANT_FOLDER']) and os.listdir(self.app.config['VARIANT_FOLDER']))
+
+    def test_animated_thumbnail(self):
+        """Test that the thumbnail is animated and scaled down by default."""
+        filename = self.upload_gif()
+
+        size, _, durations, _ = self.frames(os.path.join(self.thumbnail_dir, filename))
+        self.assertEqual(size, (250, 125))
+        self.assertEqual(durations, [100, 200, 300, 400])
+
+    def test_poster_thumbnail(self):
+        """Test the static poster-frame thumbnail option."""
+        self.app.config['ANIMATED_THUMBNAILS'] = 'poster'
+        filename = self.upload_gif()
+
+        with Image.open(os.path.join(self.thumbnail_dir, filename)) as thumb:
+            self.assertFalse(getattr(thumb, 'is_animated', False))
+            self.assertEqual(thumb.size, (250, 125))
+
+
+class MandaditosCDNSvgTest(MandaditosCDNAppTestCase):
+    """Tests for SVG sanitization, pre-compressed copies and rasterized thumbnails."""
+
+    EDITOR_SVG = b"""<?xml version="1.0" encoding="UTF-8" standalone="no"?>
+<!-- Created with Inkscape (http://www.inkscape.org/) -->
+<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink"
+     xmlns:inkscape="http://www.inkscape.org/namespaces/inkscape"
+     xmlns:sodipodi="http://sodipodi.sourceforge.net/DTD/sodipodi-0.dtd"
+     width="200" height="100" inkscape:version="1.3" onload="alert(1)">
+  <metadata><title>Logo</title></metadata>
+  <sodipodi:namedview id="base" pagecolor="#ffffff"/>
+  <script>alert(document.cookie)</script>
+  <g inkscape:label="Capa 1" inkscape:groupmode="layer">
+    <a xlink:href="javascript:alert(1)"><rect width="200" height="100" fill="#ff0000"/></a>
+    <use xlink:href="#dot"/>
+    <text x="10" y="50">Hola <tspan>mundo</tspan></text>
+  </g>
+</svg>
+"""
+
+    def upload(self, payload=None, name='logo.svg'):
+        # Padding that survives minification so the compressed copies are worth keeping
+        payload = payload or self.EDITOR_SVG.replace(b'</g>', b'<circle r="1"/>' * 50 + b'</g>')
+        return self.client.post('/upload', data={'file': (BytesIO(payload), name)},
+                                headers={'Accept': 'application/json'})
+
+    def test_svg_is_sanitized_and_minified(self):
+        """Test that comments, metadata, editor namespaces and scripts are stripped."""
+        response = self.upload(self.EDITOR_SVG)
+        self.assertEqual(response.status_code, 201)
+        filename = response.get_json()['filename']
+        self.assertTrue(filename.endswith('.svg'))
+
+        with open(os.path.join(self.upload_dir, filename), 'rb') as f:
+            stored = f.read()
+        self.assertLess(len(stored), len(self.EDITOR_SVG))
+        for removed in (b'<!--', b'<?xml', b'inkscape', b'sodipodi', b'metadata', b'script', b'onload',
+                        b'javascript:', b'\n  '):
+            self.assertNotIn(removed, stored)
+        for kept in (b'xmlns="http://www.w3.org/2000/svg"', b'<rect width="200" height="100" fill="#ff0000"/>',
+                     b'xlink:href="#dot"', b'<text x="10" y="50">Hola <tspan>mundo</tspan></text>'):
+            self.assertIn(kept, stored)
+
+    def test_allowlist_blocks_script_bypasses(self):
+        """Test that animations, obfuscated schemes and foreign elements cannot smuggle script."""
+        payload = b"""<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink"
+     xmlns:html="http://www.w3.org/1999/xhtml">
+  <a href="#top"><set attributeName="href" to="javascript:alert(1)"/><rect width="5" height="5"/></a>
+  <a><animate attributeName="xlink:href" values="javascript:alert(2)"/><circle r="3"/></a>
+  <set attributeName="onclick" to="alert(3)"/>
+  <a href="jav&#x09;ascript:alert(4)"><text>tab</text></a>
+  <a xlink:href=" &#x0A;JavaScript:alert(5)"><text>newline</text></a>
+  <image href="data:text/html;base64,PHNjcmlwdD4="/>
+  <html:iframe src="javascript:alert(6)"/>
+  <handler type="application/ecmascript">alert(7)</handler>
+  <animate attributeName="fill" values="red;blue" dur="1s"/>
+  <image href="https://example.com/a.png" width="1" height="1"/>
+</svg>"""
+        cleaned = svg_tools.sanitize(payload)
+        for removed in (b'javascript', b'JavaScript', b'alert', b'iframe', b'xhtml', b'handler', b'<set',
+                        b'text/html', b'onclick'):
+            self.assertNotIn(removed, cleaned)
+        for kept in (b'href="#top"', b'<animate attributeName="fill" values="red;blue" dur="1s"/>',
+                     b'href="https://example.com/a.png"', b'<text>tab</text>'):
+            self.assertIn(kept, cleaned)
+
+    def test_entities_and_broken_xml_are_rejected(self):
+        """Test that SVG files that cannot be parsed safely fail the conversion."""
+        bomb = (b'<?xml version="1.0"?><!DOCTYPE svg [<!ENTITY a "aaaaaaaaaa">]>'
+                b'<svg xmlns="http://www.w3.org/2000/svg"><text>&a;</text></svg>')
+        self.assertEqual(self.upload(bomb).status_code, 422)
+        self.assertEqual(self.upload(b'<svg xmlns="http://www.w3.org/2000/svg"><g></svg>').status_code, 422)
+        self.assertEqual(os.listdir(self.upload_dir), ['thumbnails'])
+
+    def test_gzip_copy_is_negotiated(self):
+        """Test that Accept-Encoding picks the pre-compressed copy with its own ETag."""
+        filename = self.upload().get_json()['filename']
+        with open(os.path.join(self.upload_dir, filename), 'rb') as f:
+            stored = f.read()
+        self.assertTrue(os.path.exists(os.path.join(self.upload_dir, filename + '.gz')))
+
+        plain = self.client.get(f'/cdn/{filename}')
+        self.assertEqual(plain.data, stored)
+        self.assertNotIn('Content-Encoding', plain.headers)
+        self.assertIn('Accept-Encoding', plain.headers['Vary'])
+
+        compressed = self.client.get(f'/cdn/{filename}', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(compressed.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(compressed.mimetype, 'image/svg+xml')
+        self.assertIn('Accept-Encoding', compressed.headers['Vary'])
+        self.assertEqual(gzip.decompress(compressed.data), stored)
+        self.assertNotEqual(compressed.headers['ETag'], plain.headers['ETag'])
+
+        revalidated = self.client.get(f'/cdn/{filename}', headers={'Accept-Encoding': 'gzip',
+                                                                    'If-None-Match': compressed.headers['ETag']})
+        self.assertEqual(revalidated.status_code, 304)
+        self.assertIn('Accept-Encoding', revalidated.headers['Vary'])
+
+        refused = self.client.get(f'/cdn/{filename}', headers={'Accept-Encoding': 'gzip;q=0, identity'})
+        self.assertEqual(refused.data, stored)
+
+    @unittest.skipUnless(svg_tools.brotli, 'brotli is not installed')
+    def test_brotli_is_preferred(self):
+        """Test that brotli wins when the client accepts both encodings."""
+        filename = self.upload().get_json()['filename']
+        response = self.client.get(f'/cdn/{filename}', headers={'Accept-Encoding': 'gzip, deflate, br'})
+        self.assertEqual(response.headers['Content-Encoding'], 'br')
+        self.assertEqual(svg_tools.brotli.decompress(response.data), self.client.get(f'/cdn/{filename}').data)
+
+    def test_asgi_serves_compressed_copy(self):
+        """Test that the async entry point applies the same negotiation."""
+        filename = self.upload().get_json()['filename']
+        status, headers, body, _ = asgi_request(f'/cdn/{filename}', [('Accept-Encoding', 'gzip')])
+
+        self.assertEqual(status, 200)
+        self.assertEqual(headers['content-encoding'], 'gzip')
+        self.assertEqual(headers['content-type'], 'image/svg+xml')
+        self.assertEqual(headers['vary'], 'Accept-Encoding')
+        self.assertEqual(gzip.decompress(body), self.client.get(f'/cdn/{filename}').data)
+
+    def test_rasterized_thumbnail(self):
+        """Test that the thumbnail is a WebP named after the SVG and is deleted with it."""
+        with mock.patch('svg.rasterize', return_value=Image.new('RGB', (250, 125), 'red')) as rasterize:
+            filename = self.upload().get_json()['filename']
+        self.assertEqual(rasterize.call_args[0][1], 250)
+
+        thumbnail = f'{filename}.webp'
+        response = self.client.get(f'/cdn/thumbnails/{thumbnail}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'image/webp')
+        self.assertIsNotNone(response.headers.get('ETag'))
+        self.assertIn(f'/cdn/thumbnails/{thumbnail}', self.client.get('/').get_data(as_text=True))
+
+        self.client.post(f'/delete/{filename}')
+        self.assertEqual(sorted(os.listdir(self.thumbnail_dir)), [])
+        self.assertEqual(sorted(os.listdir(self.upload_dir)), ['thumbnails'])
+
+    @unittest.skipUnless(svg_tools.cairosvg, 'cairosvg or libcairo2 is not installed')
+    def test_cairosvg_renders_thumbnail(self):
+        """Test that the real rasterizer produces a 250px wide WebP thumbnail."""
+        filename = self.upload().get_json()['filename']
+        with Image.open(os.path.join(self.thumbnail_dir, f'{filename}.webp')) as thumbnail:
+            self.assertEqual(thumbnail.format, 'WEBP')
+            self.assertEqual(thumbnail.size, (250, 125))
+
+    def test_without_rasterizer_there_is_no_thumbnail(self):
+        """Test that SVG uploads still work when cairosvg is not available."""
+        with mock.patch.object(svg_tools, 'cairosvg', None):
+            filename = self.upload().get_json()['filename']
+        self.assertEqual(os.listdir(self.thumbnail_dir), [])
+        self.assertEqual(self.client.get(f'/cdn/{filename}').status_code, 200)
+
+    def test_reindex_restores_encodings_and_thumbnail(self):
+        """Test that rebuilding the index skips compressed copies and finds the SVG thumbnail."""
+        with mock.patch('svg.rasterize', return_value=Image.new('RGB', (250, 125), 'red')):
+            filename = self.upload().get_json()['filename']
+        from asset_index import open_index
+        from app import asset_index_path
+        asset_index = open_index(asset_index_path())
+        asset_index.remove(filename)
+
+        result = self.app.test_cli_runner().invoke(args=['reindex'])
+        self.assertIn('1 archivos', result.output)
+        asset = asset_index.get(filename)
+        self.assertEqual(asset['thumbnail'], f'{filename}.webp')
+        self.assertIn('gzip', asset['encodings'].split(','))
+        response = self.client.get(f'/cdn/{filename}', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+
+
+class MandaditosCDNContentNegotiationTest(MandaditosCDNAppTestCase):
+    """Tests for Accept-based format negotiation on /cdn/<filename>."""
+
+    MODERN = 'image/avif,image/webp,image/apng,image/svg+xml,image/*,*/*;q=0.8'
+    WEBP_ONLY = 'image/webp,image/apng,image/*,*/*;q=0.8'
+    LEGACY = 'image/png,image/svg+xml,image/*;q=0.8,*/*;q=0.5'
+
+    def upload(self):
+        img_io = BytesIO()
+        Image.new('RGB', (400, 200), color='teal').save(img_io, format='PNG')
+        response = self.client.post('/upload', data={'file': (BytesIO(img_io.getvalue()), 'photo.png')},
+                                    headers={'Accept': 'application/json'})
+        return response.get_json()['filename']
+
+    def test_webp_is_default(self):
+        """Test that clients without image types in Accept get the published WebP."""
+        filename = self.upload()
+        for accept in (None, '*/*', self.WEBP_ONLY, self.MODERN):
+            headers = {'Accept': accept} if accept else {}
+            response = self.client.get(f'/cdn/{filename}', headers=headers)
+            self.assertEqual(response.mimetype, 'image/webp', accept)
+            self.assertIn('Accept', response.headers['Vary'])
+
+    def test_legacy_clients_get_cached_jpeg(self):
+        """Test the JPEG fallback: own ETag, Content-Length, revalidation and disk cache."""
+        filename = self.upload()
+        webp = self.client.get(f'/cdn/{filename}')
+
+        response = self.client.get(f'/cdn/{filename}', headers={'Accept': self.LEGACY})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'image/jpeg')
+        self.assertEqual(int(response.headers['Content-Length']), len(response.data))
+        self.assertEqual(response.headers['Vary'], 'Accept')
+        self.assertNotEqual(response.headers['ETag'], webp.headers['ETag'])
+        with Image.open(BytesIO(response.data)) as img:
+            self.assertEqual((img.format, img.size), ('JPEG', (400, 200)))
+        self.assertTrue(os.path.exists(os.path.join(self.app.config['DATA_FOLDER'], 'derivatives', filename,
+                                                    'original-q80-white.jpeg')))
+
+        revalidated = self.client.get(f'/cdn/{filename}', headers={'Accept': self.LEGACY,
+                                                                    'If-None-Match': response.headers['ETag']})
+        self.assertEqual(revalidated.status_code, 304)
+        self.assertEqual(revalidated.headers['Vary'], 'Accept')
+
+        # An explicit q=0 for WebP also falls back
+        refused = self.client.get(f'/cdn/{filename}', headers={'Accept': 'image/webp;q=0,image/*'})
+        self.assertEqual(refused.mimetype, 'image/jpeg')
+
+    def test_highest_q_wins(self):
+        """Test that q-values are honored instead of taking the first acceptable format."""
+        filename = self.upload()
+        response = self.client.get(f'/cdn/{filename}', headers={'Accept': 'image/webp;q=0.1,image/jpeg'})
+        self.assertEqual(response.mimetype, 'image/jpeg')
+        response = self.client.get(f'/cdn/{filename}', headers={'Accept': 'image/webp;q=0.9,image/jpeg;q=0.5'})
+        self.assertEqual(response.mimetype, 'image/webp')
+
+    def test_transparency_is_flattened_on_white(self):
+        """Test that transparent areas become white in the JPEG fallback instead of their hidden color."""
+        img = Image.new('RGBA', (100, 100), (255, 0, 0, 0))
+        img.paste((0, 0, 255, 255), (0, 0, 50, 100))
+        img_io = BytesIO()
+        img.save(img_io, format='PNG')
+        filename = self.client.post('/upload', data={'file': (BytesIO(img_io.getvalue()), 'logo.png')},
+                                    headers={'Accept': 'application/json'}).get_json()['filename']
+
+        response = self.client.get(f'/cdn/{filename}', headers={'Accept': 'image/jpeg'})
+        with Image.open(BytesIO(response.data)) as jpeg:
+            self.assertEqual(jpeg.mode, 'RGB')
+            self.assertTrue(all(channel > 240 for channel in jpeg.getpixel((90, 50))))
+            red, green, blue = jpeg.getpixel((10, 50))
+            self.assertGreater(blue, 200)
+            self.assertLess(red, 40)
+
+    def test_full_width_avif_is_negotiated(self):
+        """Test that a stored full-width AVIF is picked only when the client lists it."""
+        self.app.config['VARIANT_FORMATS'] = ['webp', 'avif']
+        # Pillow here has no AVIF encoder: any codec exercises the same path
+        with mock.patch.dict('pipeline.VARIANT_FORMATS', {'avif': 'PNG'}):
+            filename = self.upload()
+        stem = filename.rsplit('.', 1)[0]
+        self.assertIn(f'{stem}-400w.avif', os.listdir(self.variant_dir))
+
+        from app import get_storage
+        with self.app.app_context():
+            store = get_storage()
+        with mock.patch.object(store, 'local_path', wraps=store.local_path) as local_path:
+            response = self.client.get(f'/cdn/{filename}', headers={'Accept': self.MODERN})
+        # Only the chosen copy is looked up on disk
+        self.assertEqual(local_path.call_count, 1)
+        self.assertEqual(response.mimetype, 'image/avif')
+        self.assertEqual(response.headers['ETag'], self.client.get(f'/cdn/variants/{stem}-400w.avif').headers['ETag'])
+        self.assertEqual(self.client.get(f'/cdn/{filename}', headers={'Accept': self.WEBP_ONLY}).mimetype, 'image/webp')
+
+    def test_asgi_negotiates_format(self):
+        """Test that the async entry point applies the same negotiation."""
+        filename = self.upload()
+        status, headers, body, _ = asgi_request(f'/cdn/{filename}', [('Accept', self.LEGACY)])
+
+        self.assertEqual(status, 200)
+        self.assertEqual(headers['content-type'], 'image/jpeg')
+        self.assertEqual(headers['vary'], 'Accept')
+        self.assertEqual(int(headers['content-length']), len(body))
+        self.assertEqual(headers['etag'], self.client.get(f'/cdn/{filename}', headers={'Accept': self.LEGACY}).headers['ETag'])
+
+
+class MandaditosCDNCleanupTest(MandaditosCDNAppTestCase):
+    """Tests for bulk deletes and the gc command."""
+
+    def upload(self, color='navy', size=(800, 400)):
+        img_io = BytesIO()
+        Image.new('RGB', size, color=color).save(img_io, format='PNG')
+        response = self.client.post('/upload', data={'file': (BytesIO(img_io.getvalue()), 'photo.png')},
+                                    headers={'Accept': 'application/json'})
+        return response.get_json()['filename']
+
+    def upload_svg(self):
+        payload = b'<svg xmlns="http://www.w3.org/2000/svg">' + b'<circle r="1"/>' * 50 + b'</svg>'
+        response = self.client.post('/upload', data={'file': (BytesIO(payload), 'icon.svg')},
+                                    headers={'Accept': 'application/json'})
+        return response.get_json()['filename']
+
+    def all_files(self):
+        return sorted(os.path.relpath(os.path.join(root, name), self.test_dir)
+                      for root, _, names in os.walk(self.test_dir) for name in names
+                      if not name.startswith('assets.sqlite3') and not root.endswith(('.locks', 'jobs')))
+
+    def make_old(self, *paths):
+        for path in paths:
+            os.utime(path, (time.time() - 7200, time.time() - 7200))
+
+    def test_batch_delete(self):
+        """Test deleting several files, with their copies, in one request."""
+        photo = self.upload('navy')
+        icon = self.upload_svg()
+        kept = self.upload('olive')
+        self.client.get(f'/cdn/{photo}', headers={'Accept': 'image/png'})  # cached JPEG copy
+
+        response = self.client.post('/delete/batch', json={'filenames': [photo, icon, 'missing.webp', '../app.py', photo]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(), {'deleted': [photo, icon], 'not_found': ['missing.webp'],
+                                               'invalid': ['../app.py']})
+
+        stem = kept.rsplit('.', 1)[0]
+        self.assertEqual(self.all_files(), sorted([
+            os.path.join('uploads', kept), os.path.join('uploads', 'thumbnails', kept),
+            os.path.join('variants', f'{stem}-320w.webp'), os.path.join('variants', f'{stem}-640w.webp'),
+        ]))
+        self.assertEqual(self.client.get(f'/cdn/{photo}').status_code, 404)
+
+    def test_batch_delete_form_and_limits(self):
+        """Test form input, empty requests and the per-request limit."""
+        first, second = self.upload('navy'), self.upload('olive')
+        response = self.client.post('/delete/batch', data={'filenames': [first, second]})
+        self.assertEqual(response.get_json()['deleted'], [first, second])
+
+        self.assertEqual(self.client.post('/delete/batch', json={'filenames': []}).status_code, 400)
+        self.assertEqual(self.client.post('/delete/batch', json={'filenames': 'a.webp'}).status_code, 400)
+        with mock.patch('app.MAX_BATCH_DELETE', 2):
+            self.assertEqual(self.client.post('/delete/batch', json={'filenames': ['a', 'b', 'c']}).status_code, 413)
+
+    def test_gc_removes_orphans(self):
+        """Test that gc removes leftovers of crashed uploads and deletes, and reports the bytes."""
+        kept = self.upload('olive')
+        gone = self.upload('navy')
+        icon = self.upload_svg()
+        self.client.get(f'/cdn/{gone}', headers={'Accept': 'image/png'})  # cached JPEG copy
+        # A crash after the main file was removed leaves every other copy behind
+        os.remove(os.path.join(self.upload_dir, gone))
+        os.remove(os.path.join(self.upload_dir, icon))
+        incoming = os.path.join(self.data_dir, 'incoming')
+        with open(os.path.join(incoming, 'abandoned.png'), 'wb') as f:
+            f.write(b'x' * 1000)
+        os.makedirs(os.path.join(incoming, 'abandoned-job', 'thumbnails'))
+        with open(os.path.join(self.data_dir, 'jobs', '.job.abc.tmp'), 'w') as f:
+            f.write('{')
+        for root, dirs, names in os.walk(self.test_dir):
+            self.make_old(*(os.path.join(root, name) for name in dirs + names))
+        with self.app.app_context():
+            from app import get_asset_index
+            get_asset_index().db.execute('UPDATE assets SET created_at = ?', (time.time() - 7200,))
+        # Recent files may belong to an upload in progress
+        with open(os.path.join(self.thumbnail_dir, 'in-progress.webp'), 'wb') as f:
+            f.write(b'x')
+
+        runner = self.app.test_cli_runner()
+        before = self.all_files()
+        result = runner.invoke(args=['gc', '--dry-run'])
+        self.assertIn('Se liberarían', result.output)
+        self.assertEqual(self.all_files(), before)
+
+        result = runner.invoke(args=['gc'])
+        self.assertIn('miniaturas: 1', result.output)
+        self.assertIn('variantes: 2', result.output)
+        self.assertIn('precomprimidos: 2' if svg_tools.brotli else 'precomprimidos: 1', result.output)
+        self.assertIn('índice: 2', result.output)
+        self.assertIn('caché de variantes: 1', result.output)
+        self.assertIn('subidas abandonadas: 2', result.output)
+        self.assertIn('temporales: 1', result.output)
+        self.assertIn('estados de trabajos: 3', result.output)
+
+        stem = kept.rsplit('.', 1)[0]
+        self.assertEqual(self.all_files(), sorted([
+            os.path.join('uploads', kept), os.path.join('uploads', 'thumbnails', kept),
+            os.path.join('uploads', 'thumbnails', 'in-progress.webp'),
+            os.path.join('variants', f'{stem}-320w.webp'), os.path.join('variants', f'{stem}-640w.webp'),
+        ]))
+        self.assertFalse(os.path.exists(os.path.join(self.data_dir, 'jobs', '.job.abc.tmp')))
+        with self.app.app_context():
+            from app import get_asset_index
+            self.assertEqual(get_asset_index().filenames(), [kept])
+
+        result = runner.invoke(args=['gc'])
+        self.assertIn('Liberados 0.0 MB en 0 archivos', result.output)
+
+    def test_gc_expires_finished_job_statuses(self):
+        """Test that gc removes old done/failed job statuses but keeps recent and unfinished ones."""
+        import jobs
+
+        jobs_dir = os.path.join(self.data_dir, 'jobs')
+        for job_id, status in (('old-done', jobs.DONE), ('old-failed', jobs.FAILED), ('old-queued', jobs.QUEUED),
+                               ('new-done', jobs.DONE)):
+            jobs.write_status(jobs_dir, job_id, status=status)
+        self.make_old(*(os.path.join(jobs_dir, f'old-{name}.json') for name in ('done', 'failed', 'queued')))
+
+        result = self.app.test_cli_runner().invoke(args=['gc'])
+        self.assertIn('estados de trabajos: 2', result.output)
+        self.assertEqual(sorted(os.listdir(jobs_dir)), ['new-done.json', 'old-queued.json'])
+
+
+class MandaditosCDNStreamingUploadTest(MandaditosCDNAppTestCase):
+    """Tests for chunked uploads validated while the body is being read."""
+
+    def setUp(self):
+        super().setUp()
+        self.app.config['MAX_UPLOAD_MB'] = 1
+        self.app.config['MAX_IMAGE_PIXELS'] = 10000
+
+    def image_bytes(self, size=(60, 40), format='JPEG'):
+        img_io = BytesIO()
+        Image.new('RGB', size, color='teal').save(img_io, format=format)
+        return img_io.getvalue()
+
+    def upload(self, payload, filename):
+        return self.client.post('/upload', data={'file': (BytesIO(payload), filename)},
+                                headers={'Accept': 'application/json'})
+
+    def assertNothingStored(self):
+        self.assertEqual([f for f in os.listdir(self.upload_dir) if f != 'thumbnails'], [])
+        self.assertEqual(os.listdir(os.path.join(self.test_dir, 'data', 'incoming')), [])
+
+    def test_oversized_file_is_rejected(self):
+        """Test that a file above MAX_UPLOAD_MB is rejected with 413 and removed."""
+        payload = self.image_bytes() + b'\0' * (2 * 1024 * 1024)
+        response = self.upload(payload, 'big.jpg')
+
+        self.assertEqual(response.status_code, 413)
+        self.assertNothingStored()
+
+    def test_content_must_match_an_image_format(self):
+        """Test that the real bytes are sniffed instead of trusting the extension."""
+        response = self.upload(b'<html>not an image</html>' * 10, 'fake.jpg')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('imagen', response.get_json()['error'])
+        self.assertNothingStored()
+
+    def test_too_many_pixels_is_rejected(self):
+        """Test that images above MAX_IMAGE_PIXELS are rejected from their header."""
+        response = self.upload(self.image_bytes((200, 200), 'PNG'), 'huge.png')
+
+        self.assertEqual(response.status_code, 413)
+        self.assertNothingStored()
+
+    def test_webp_dimensions_are_read_from_header(self):
+        """Test that WebP headers are parsed for the pixel check."""
+        from uploads import webp_dimensions
+
+        for size in [(60, 40), (200, 150)]:
+            self.assertEqual(webp_dimensions(self.image_bytes(size, 'WEBP')[:64]), size)
+
+    def test_svg_is_sniffed(self):
+        """Test that SVG uploads must contain an svg element."""
+        svg = b'<?xml version="1.0"?><svg xmlns="http://www.w3.org/2000/svg"></svg>'
+        self.assertEqual(self.upload(svg, 'icon.svg').status_code, 201)
+        self.assertEqual(self.upload(b'plain text', 'icon.svg').status_code, 400)
+
+    def multipart(self, parts, boundary='xyz'):
+        body = b''
+        for name, filename, payload in parts:
+            body += (f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                     f'Content-Type: application/octet-stream\r\n\r\n').encode() + payload + b'\r\n'
+        return body + f'--{boundary}--\r\n'.encode()
+
+    def post_raw(self, url, body, boundary='xyz'):
+        return self.client.post(url, data=body, content_type=f'multipart/form-data; boundary={boundary}',
+                                headers={'Accept': 'application/json'})
+
+    def test_truncated_body_is_rejected(self):
+        """Test that a multipart body cut in the middle of a file returns 400 and stores nothing."""
+        body = self.multipart([('file', 'cut.jpg', self.image_bytes())])
+        response = self.post_raw('/upload', body[:len(body) // 2])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('mal formado', response.get_json()['error'])
+        self.assertNothingStored()
+
+        # Cortado antes de la cabecera del archivo
+        self.assertEqual(self.post_raw('/upload', b'--xyz\r\nContent-Disp').status_code, 400)
+
+    def test_truncated_batch_reports_processed_files(self):
+        """Test that the batch endpoint stops at a malformed part and reports what was already queued."""
+        body = self.multipart([('files', 'one.jpg', self.image_bytes()), ('files', 'two.jpg', self.image_bytes())])
+        response = self.post_raw('/upload/batch', body[:-len(self.image_bytes()) // 2 - 20])
+
+        self.assertEqual(response.status_code, 400)
+        data = response.get_json()
+        self.assertEqual([entry['name'] for entry in data['files']], ['one.jpg'])
+        self.assertEqual(data['files'][0]['status'], 'done')
+
+    def test_request_above_max_content_length(self):
+        """Test that a request larger than MAX_CONTENT_LENGTH gets a JSON 413."""
+        previous = self.app.config['MAX_CONTENT_LENGTH']
+        self.app.config['MAX_CONTENT_LENGTH'] = 1024
+        try:
+            response = self.upload(self.image_bytes() + b'\0' * 4096, 'big.jpg')
+        finally:
+            self.app.config['MAX_CONTENT_LENGTH'] = previous
+        self.assertEqual(response.status_code, 413)
+        self.assertIn('tamaño máximo', response.get_json()['error'])
+
+    def test_batch_rejects_only_invalid_files(self):
+        """Test that a rejected file does not stop the rest of the batch."""
+        response = self.client.post('/upload/batch', data={
+            'files': [
+                (BytesIO(b'garbage' * 100), 'one.jpg'),
+                (BytesIO(self.image_bytes()), 'two.jpg'),
+            ]
+        })
+
+        data = response.get_json()
+        self.assertEqual(data['summary'], {'rejected': 1, 'done': 1})
+        self.assertEqual(data['files'][0]['name'], 'one.jpg')
+
+
+class MandaditosCDNMetricsTest(MandaditosCDNAppTestCase):
+    """Tests for the Prometheus metrics endpoint."""
+
+    def sample(self, name, **labels):
+        from prometheus_client import REGISTRY
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def jpeg_bytes(self):
+        img_io = BytesIO()
+        Image.new('RGB', (400, 300), color='olive').save(img_io, format='JPEG')
+        return img_io.getvalue()
+
+    def test_upload_records_stage_timings(self):
+        """Test that every pipeline stage and the request itself are observed."""
+        before = {stage: self.sample('cdn_upload_stage_seconds_count', stage=stage)
+                  for stage in ('receive', 'decode', 'encode', 'variants', 'thumbnail', 'index')}
+        requests_before = self.sample('cdn_request_seconds_count', endpoint='upload_file')
+        payload = self.jpeg_bytes()
+
+        response = self.client.post('/upload', data={'file': (BytesIO(payload), 'photo.jpg')},
+                                    headers={'Accept': 'application/json'})
+        self.assertEqual(response.status_code, 201)
+
+        for stage, count in before.items():
+            self.assertEqual(self.sample('cdn_upload_stage_seconds_count', stage=stage), count + 1, stage)
+        self.assertEqual(self.sample('cdn_request_seconds_count', endpoint='upload_file'), requests_before + 1)
+        self.assertGreater(self.sample('cdn_request_bytes_in_total', endpoint='upload_file'), len(payload))
+
+    def test_conversion_failures_are_counted(self):
+        """Test that an image that cannot be decoded increments the failure counter."""
+        before = self.sample('cdn_conversion_failures_total')
+        payload = self.jpeg_bytes()
+        # The header is intact (passes validation) but the pixel data is cut off
+        truncated = payload[:len(payload) // 2]
+
+        response = self.client.post('/upload', data={'file': (BytesIO(truncated), 'broken.jpg')},
+                                    headers={'Accept': 'application/json'})
+
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(self.sample('cdn_conversion_failures_total'), before + 1)
+
+    def test_metrics_endpoint(self):
+        """Test that /metrics exposes the text format with bytes served."""
+        filename = self.client.post('/upload', data={'file': (BytesIO(self.jpeg_bytes()), 'photo.jpg')},
+                                    headers={'Accept': 'application/json'}).get_json()['filename']
+        self.client.get(f'/cdn/{filename}')
+
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith('text/plain'))
+        self.assertIn(b'cdn_upload_stage_seconds_bucket{le="0.005",stage="decode"}', response.data)
+        self.assertIn(b'cdn_response_bytes_out_total{endpoint="serve_file"}', response.data)
+        self.assertIn(b'cdn_processing_queue_depth', response.data)
+
+
+class MandaditosCDNStartupTest(unittest.TestCase):
+    """Tests for the pre-fork startup checks, warm-up and gunicorn hooks."""
+
+    def setUp(self):
+        self.app = app
+        self.test_dir = tempfile.mkdtemp()
+        self.saved_config = dict(self.app.config)
+        self.app.config['UPLOAD_FOLDER'] = os.path.join(self.test_dir, 'content')
+        self.app.config['THUMBNAIL_FOLDER'] = os.path.join(self.test_dir, 'content', 'thumbnails')
+        self.app.config['VARIANT_FOLDER'] = os.path.join(self.test_dir, 'variants')
+        self.app.config['DATA_FOLDER'] = os.path.join(self.test_dir, 'data')
+
+    def tearDown(self):
+        self.app.config.clear()
+        self.app.config.update(self.saved_config)
+        shutil.rmtree(self.test_dir)
+
+    def test_prepare_startup(self):
+        """Test that startup creates the folders, recovers temp files and warms up the codecs."""
+        from app import prepare_startup
+
+        stale = os.path.join(self.test_dir, 'variants', '.a-320w.webp.x1.tmp')
+        os.makedirs(os.path.dirname(stale))
+        with open(stale, 'wb') as f:
+            f.write(b'partial')
+        os.utime(stale, (time.time() - 3600, time.time() - 3600))
+
+        with mock.patch('builtins.print') as printed:
+            prepare_startup()
+        for key in ('UPLOAD_FOLDER', 'THUMBNAIL_FOLDER', 'VARIANT_FOLDER', 'DATA_FOLDER'):
+            self.assertTrue(os.path.isdir(self.app.config[key]), key)
+        self.assertFalse(os.path.exists(stale))
+        self.assertIn('WEBP, JPEG, PNG', printed.call_args_list[-1].args[0])
+
+    def test_startup_builds_interrupted_index(self):
+        """Test that startup finishes an index whose first build died half-way, and only builds it once."""
+        from app import asset_index_path, prepare_startup
+        from asset_index import AssetIndex, is_built
+
+        content = self.app.config['UPLOAD_FOLDER']
+        os.makedirs(content)
+        for i in range(10):
+            Image.new('RGB', (8, 8), color='teal').save(os.path.join(content, f'{i}.webp'))
+        # Lo que deja un worker que murió a mitad de la primera reconstrucción
+        partial = AssetIndex(asset_index_path())
+        for i in range(3):
+            partial.add(f'{i}.webp', size=1)
+        self.assertFalse(is_built(asset_index_path()))
+
+        with mock.patch('builtins.print') as printed:
+            prepare_startup()
+        self.assertTrue(is_built(asset_index_path()))
+        self.assertEqual(partial.count(), 10)
+        self.assertIn('✅ Índice construido: 10 archivos', [call.args[0] for call in printed.call_args_list])
+
+        with mock.patch('jobs.JobQueue') as pool, mock.patch('builtins.print'):
+            prepare_startup()
+        pool.assert_not_called()
+
+    def test_startup_rejects_invalid_config(self):
+        """Test that every problem is reported before the workers are forked."""
+        from app import prepare_startup, startup_problems
+
+        blocker = os.path.join(self.test_dir, 'not-a-folder')
+        with open(blocker, 'w') as f:
+            f.write('')
+        self.app.config['DATA_FOLDER'] = blocker
+        self.app.config['STORAGE_BACKEND'] = 's3'
+        self.app.config['S3_BUCKET'] = ''
+
+        problems = startup_problems()
+        self.assertIn('STORAGE_BACKEND=s3 requiere S3_BUCKET.', problems)
+        self.assertTrue(any(blocker in problem for problem in problems))
+        with self.assertRaises(RuntimeError):
+            prepare_startup()
+
+    def test_time_to_first_request(self):
+        """Test that only the first request after a fork is observed."""
+        import metrics
+        from prometheus_client import REGISTRY
+
+        def count():
+            return REGISTRY.get_sample_value('cdn_time_to_first_request_seconds_count') or 0
+
+        before = count()
+        with mock.patch('builtins.print'):
+            metrics.mark_process_started()
+            self.assertIsNotNone(metrics.observe_first_request())
+            self.assertIsNone(metrics.observe_first_request())
+            metrics.observe_request('index', 0.01, 0, 10)
+        self.assertEqual(count(), before + 1)
+
+    def test_stale_multiprocess_files_are_cleared(self):
+        """Test that metric files left by processes of a previous run are removed, but not this process's."""
+        import metrics
+
+        folder = os.path.join(self.test_dir, 'prometheus')
+        os.makedirs(folder)
+        own = f'histogram_{os.getpid()}.db'
+        for name in ('counter_999991.db', 'gauge_livesum_999992.db', own, 'README'):
+            open(os.path.join(folder, name), 'w').close()
+
+        with mock.patch.dict(os.environ, {'PROMETHEUS_MULTIPROC_DIR': folder}):
+            self.assertEqual(metrics.clear_multiprocess_dir(), 2)
+        self.assertEqual(sorted(os.listdir(folder)), ['README', own])
+        with mock.patch.dict(os.environ, {'PROMETHEUS_MULTIPROC_DIR': ''}):
+            self.assertEqual(metrics.clear_multiprocess_dir(), 0)
+
+    def test_gunicorn_hooks(self):
+        """Test the gunicorn config: preload, startup failure and worker bookkeeping."""
+        import runpy
+
+        config = runpy.run_path(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gunicorn.conf.py'))
+        self.assertTrue(config['preload_app'])
+
+        server = mock.Mock()
+        calls = mock.Mock()
+        with mock.patch('metrics.clear_multiprocess_dir', calls.clear), \
+                mock.patch('app.prepare_startup', calls.prepare_startup):
+            calls.prepare_startup.side_effect = RuntimeError('S3_BUCKET')
+            with self.assertRaises(SystemExit):
+                config['on_starting'](server)
+        server.log.error.assert_called_once()
+        # Stale metrics are cleared before anything else runs in the master
+        self.assertEqual([name for name, _, _ in calls.mock_calls], ['clear', 'prepare_startup'])
+
+        with mock.patch('metrics.mark_process_dead') as mark_process_dead:
+            config['child_exit'](server, mock.Mock(pid=1234))
+        mark_process_dead.assert_called_once_with(1234)
+        with mock.patch('metrics.mark_process_started') as mark_process_started:
+            config['post_fork'](server, mock.Mock())
+        mark_process_started.assert_called_once()
+
+    def test_asgi_lifespan_runs_startup(self):
+        """Test that the ASGI server fails to start on an invalid configuration."""
+        from asgi import lifespan
+
+        async def run():
+            messages = [{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}]
+            sent = []
+
+            async def receive():
+                return messages.pop(0)
+
+            async def send(message):
+                sent.append(message)
+            await lifespan(receive, send)
+            return sent
+
+        with mock.patch('builtins.print'):
+            self.assertEqual([m['type'] for m in asyncio.run(run())],
+                             ['lifespan.startup.complete', 'lifespan.shutdown.complete'])
+        self.app.config['STORAGE_BACKEND'] = 'ftp'
+        self.assertEqual([m['type'] for m in asyncio.run(run())], ['lifespan.startup.failed'])
+
+
+class MandaditosCDNSimilarityTest(MandaditosCDNAppTestCase):
+    """Tests for perceptual hashing and near-duplicate search."""
+
+    def product_shot(self, size, angle=0):
+        """A gradient with a dark block: enough structure for a meaningful hash."""
+        img = Image.linear_gradient('L').rotate(angle).resize(size).convert('RGB')
+        img.paste('navy', (size[0] // 4, size[1] // 3, size[0] // 2, size[1] * 2 // 3))
+        return img
+
+    def upload(self, img, fmt='PNG', name='image.png'):
+        img_io = BytesIO()
+        img.save(img_io, format=fmt)
+        img_io.seek(0)
+        response = self.client.post('/upload', data={'file': (img_io, name)},
+                                    headers={'Accept': 'application/json'})
+        return response.get_json()['filename']
+
+    def test_finds_resized_and_recompressed_copies(self):
+        """Test that a smaller JPEG re-save of a shot is found and an unrelated image is not."""
+        original = self.upload(self.product_shot((640, 480)))
+        copy = self.upload(self.product_shot((320, 240)), fmt='JPEG', name='copy.jpg')
+        other = self.upload(self.product_shot((640, 480), angle=90))
+
+        response = self.client.get(f'/api/files/{original}/similar')
+        self.assertEqual(response.status_code, 200)
+        data = response.get_json()
+        self.assertEqual(len(data['hash']), 16)
+        found = {f['filename']: f['distance'] for f in data['files']}
+        self.assertIn(copy, found)
+        self.assertLessEqual(found[copy], 2)
+        self.assertNotIn(other, found)
+        self.assertNotIn(original, found)
+        self.assertTrue(data['files'][0]['thumbnail_url'])
+
+    def test_deduplicated_alias_keeps_hash(self):
+        """Test that an upload served from an existing file reuses its perceptual hash."""
+        img = self.product_shot((200, 200))
+        first = self.upload(img)
+        second = self.upload(img)
+
+        data = self.client.get(f'/api/files/{second}/similar?distance=0').get_json()
+        self.assertIsNotNone(data['hash'])
+        self.assertEqual([(f['filename'], f['distance']) for f in data['files']], [(first, 0)])
+
+    def test_index_matches_brute_force(self):
+        """Test that the multi-index lookup returns exactly what a full scan would."""
+        import random
+        import similarity
+        from asset_index import AssetIndex
+
+        rng = random.Random(21)
+        asset_index = AssetIndex(os.path.join(self.test_dir, 'hashes.sqlite3'))
+        query = rng.getrandbits(64)
+        hashes = {}
+        for i in range(400):
+            value = query
+            # Cerca de la consulta a distintas distancias, más algunos al azar
+            for bit in rng.sample(range(64), rng.randint(0, 14)):
+                value ^= 1 << bit
+            if i % 4 == 0:
+                value = rng.getrandbits(64)
+            hashes[f'{i:04d}.webp'] = value
+            asset_index.add(f'{i:04d}.webp', size=1, **similarity.hash_columns(value))
+        asset_index.add('none.webp', size=1)
+
+        for max_distance in (0, 3, 6, similarity.MAX_DISTANCE):
+            expected = sorted((similarity.distance(query, value), name) for name, value in hashes.items()
+                              if similarity.distance(query, value) <= max_distance)
+            found = [(row['distance'], row['filename']) for row in asset_index.similar(query, max_distance, limit=1000)]
+            self.assertEqual(found, expected)
+        self.assertEqual(len(asset_index.similar(query, 10, limit=5)), 5)
+
+    def test_hash_is_signed_in_sqlite(self):
+        """Test that hashes with the high bit set round-trip through the index."""
+        import similarity
+
+        columns = similarity.hash_columns(0xFFFF00000000FFFF)
+        self.assertLess(columns['dhash'], 0)
+        self.assertEqual(similarity.from_signed(columns['dhash']), 0xFFFF00000000FFFF)
+        self.assertEqual([columns[c] for c in similarity.CHUNK_COLUMNS], [0xFFFF, 0, 0, 0xFFFF])
+        self.assertEqual(similarity.distance(columns['dhash'], 0xFFFF00000000FFFE), 1)
+
+    def test_errors(self):
+        """Test unknown files and out-of-range distances."""
+        filename = self.upload(self.product_shot((100, 100)))
+        self.assertEqual(self.client.get('/api/files/missing.webp/similar').status_code, 404)
+        self.assertEqual(self.client.get(f'/api/files/{filename}/similar?distance=40').status_code, 400)
+        self.assertEqual(self.client.get(f'/api/files/{filename}/similar?distance=-1').status_code, 400)
+
+
+class MandaditosCDNBenchmarkTest(unittest.TestCase):
+    """Tests for the benchmark harness helpers."""
+
+    def test_percentiles(self):
+        """Test nearest-rank percentiles."""
+        from benchmark import percentile
+
+        values = [float(i) for i in range(1, 101)]
+        self.assertEqual(percentile(values, 50), 50.0)
+        self.assertEqual(percentile(values, 99), 99.0)
+        self.assertEqual(percentile([3.0], 99), 3.0)
+
+    def test_compare_flags_regressions(self):
+        """Test that only cases slower than the allowed margin are reported."""
+        from benchmark import compare
+
+        baseline = {'results': {'upload[a.jpg]': {'p50': 0.100}, 'serve_file[a.jpg]': {'p50': 0.010}}}
+        results = {
+            'upload[a.jpg]': {'p50': 0.140},
+            'serve_file[a.jpg]': {'p50': 0.011},
+            'index[10000][first_page]': {'p50': 0.5},
+        }
+
+        regressions = compare(results, baseline, 0.25)
+        self.assertEqual([item['name'] for item in regressions], ['upload[a.jpg]'])
+
+
 if __name__ == '__main__':
     # Run tests with verbosity
     unittest.main(verbosity=2)
@@ -0,0 +1,199 @@
+from io import BytesIO
+from PIL import Image
+from werkzeug.exceptions import ClientDisconnected, RequestEntityTooLarge
+from werkzeug.sansio.multipart import Data, Epilogue, File, MultipartDecoder, NeedData
+
+CHUNK_SIZE = 64 * 1024
+# Bytes que se acumulan como máximo para leer la cabecera de la imagen
+SNIFF_LIMIT = 256 * 1024
+SVG_SNIFF_BYTES = 4096
+
+EXTENSION_FORMATS = {
+    'jpg': 'jpeg',
+    'jpeg': 'jpeg',
+    'png': 'png',
+    'gif': 'gif',
+    'webp': 'webp',
+    'svg': 'svg',
+}
+
+
+class UploadRejected(Exception):
+    """El archivo se rechaza mientras se recibe; ``status`` es el código HTTP sugerido."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+class InvalidBody(UploadRejected):
+    """El cuerpo multipart está truncado, mal formado o excede el máximo: no se puede seguir leyendo."""
+
+
+def read_body(stream, chunk_size):
+    try:
+        return stream.read(chunk_size)
+    except ClientDisconnected:
+        raise InvalidBody('La subida se interrumpió antes de terminar.')
+    except RequestEntityTooLarge:
+        raise InvalidBody('La petición supera el tamaño máximo permitido.', 413)
+
+
+def sniff_format(head):
+    """Identifica el formato real por sus primeros bytes (sin confiar en la extensión)."""
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'jpeg'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        return 'gif'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    text = head[:SVG_SNIFF_BYTES].lstrip(b'\xef\xbb\xbf \t\r\n')
+    if text.startswith((b'<?xml', b'<svg', b'<!--', b'<!DOCTYPE')) and b'<svg' in text:
+        return 'svg'
+    return None
+
+
+def webp_dimensions(head):
+    """Lee el tamaño del lienzo de un WebP desde su primer chunk (VP8X, VP8 o VP8L)."""
+    chunk = head[12:16]
+    if chunk == b'VP8X' and len(head) >= 30:
+        return (int.from_bytes(head[24:27], 'little') + 1, int.from_bytes(head[27:30], 'little') + 1)
+    if chunk == b'VP8 ' and len(head) >= 30:
+        return (int.from_bytes(head[26:28], 'little') & 0x3fff, int.from_bytes(head[28:30], 'little') & 0x3fff)
+    if chunk == b'VP8L' and len(head) >= 25:
+        bits = int.from_bytes(head[21:25], 'little')
+        return ((bits & 0x3fff) + 1, ((bits >> 14) & 0x3fff) + 1)
+    raise ValueError('Cabecera WebP incompleta')
+
+def image_dimensions(head, fmt):
+    if fmt == 'webp':
+        return webp_dimensions(head)
+    # Image.open solo lee la cabecera, no decodifica los pixeles
+    with Image.open(BytesIO(head)) as img:
+        return img.size
+
+
+class UploadValidator:
+    """Valida un archivo bloque a bloque: tamaño máximo, formato real y número de pixeles.
+
+    La cabecera se revisa en cuanto llegan suficientes bytes, así un archivo
+    inválido o una "bomba de descompresión" se rechaza sin recibirlo completo.
+    """
+
+    def __init__(self, ext, max_bytes, max_pixels):
+        self.ext = ext
+        self.max_bytes = max_bytes
+        self.max_pixels = max_pixels
+        self.size = 0
+        self.head = b''
+        self.format = None
+        self.dimensions = None
+
+    @property
+    def validated(self):
+        return self.format is not None
+
+    def feed(self, chunk):
+        self.size += len(chunk)
+        if self.max_bytes and self.size > self.max_bytes:
+            raise UploadRejected(f'El archivo supera el máximo de {self.max_bytes // (1024 * 1024)} MB.', 413)
+        if not self.validated:
+            self.head += chunk[:SNIFF_LIMIT - len(self.head)]
+            self._check(final=False)
+
+    def finish(self):
+        if not self.validated:
+            self._check(final=True)
+
+    def _check(self, final):
+        expected = EXTENSION_FORMATS.get(self.ext)
+        if expected == 'svg':
+            if len(self.head) < SVG_SNIFF_BYTES and not final:
+                return
+            if sniff_format(self.head) != 'svg':
+                raise UploadRejected('El contenido no es un SVG válido.')
+            self.format = 'svg'
+            return
+
+        if len(self.head) < 16 and not final:
+            return
+        detected = sniff_format(self.head)
+        if detected is None or detected == 'svg':
+            raise UploadRejected('El contenido no es una imagen válida.')
+        try:
+            width, height = image_dimensions(self.head, detected)
+        except Image.DecompressionBombError:
+            raise UploadRejected('La imagen tiene demasiados pixeles.', 413)
+        except Exception:
+            # La cabecera (ej. SOF de JPEG tras un EXIF grande) aún no llegó completa
+            if final or len(self.head) >= SNIFF_LIMIT:
+                raise UploadRejected('No se pudo leer la cabecera de la imagen.')
+            return
+        if self.max_pixels and width * height > self.max_pixels:
+            raise UploadRejected(f'La imagen tiene demasiados pixeles ({width}x{height}).', 413)
+        self.format = detected
+        self.dimensions = (width, height)
+
+
+class StreamedFile:
+    """Parte de archivo de un formulario multipart que se lee por bloques."""
+
+    def __init__(self, name, filename, events):
+        self.name = name
+        self.filename = filename
+        self._events = events
+        self.exhausted = False
+
+    def chunks(self):
+        while not self.exhausted:
+            event = next(self._events, None)
+            if event is None:
+                # El cuerpo terminó con error (ver ``InvalidBody``): no queda nada que leer
+                self.exhausted = True
+                return
+            # Se marca antes de entregar el bloque: si quien lo consume se
+            # detiene (archivo rechazado), drain() no debe leer la parte siguiente
+            if not event.more_data:
+                self.exhausted = True
+            if event.data:
+                yield event.data
+
+    def drain(self):
+        for _ in self.chunks():
+            pass
+
+
+def iter_multipart_files(stream, boundary, chunk_size=CHUNK_SIZE):
+    """Recorre los archivos de un cuerpo multipart sin cargarlo completo en memoria.
+
+    Cada ``StreamedFile`` debe consumirse antes de pedir el siguiente; lo que
+    no se lea se descarta. Los campos que no son archivos se ignoran. Si el
+    cuerpo está truncado o mal formado se lanza ``InvalidBody``.
+    """
+    decoder = MultipartDecoder(boundary.encode())
+
+    def events():
+        while True:
+            try:
+                event = decoder.next_event()
+            except ValueError:
+                raise InvalidBody('El cuerpo de la petición está incompleto o mal formado.')
+            if isinstance(event, NeedData):
+                decoder.receive_data(read_body(stream, chunk_size) or None)
+            elif isinstance(event, Epilogue):
+                return
+            else:
+                yield event
+
+    event_stream = events()
+    for event in event_stream:
+        if isinstance(event, File):
+            part = StreamedFile(event.name, event.filename, (e for e in event_stream if isinstance(e, Data)))
+            yield part
+            part.drain()
+
+def iter_stream(stream, chunk_size=CHUNK_SIZE):
+    return iter(lambda: stream.read(chunk_size), b'')
@@ -0,0 +1,58 @@
+"""Arranque en caliente: lo que cada worker pagaría en su primera petición se hace antes del fork.
+
+Con ``preload_app`` (ver ``gunicorn.conf.py``) estas funciones corren una
+sola vez en el master: los plugins de Pillow ya registrados, las bibliotecas
+de los códecs ya inicializadas y la tabla de mimetypes ya cargada pasan a
+cada worker con el fork, sin costo extra.
+"""
+import mimetypes
+import os
+import tempfile
+from io import BytesIO
+from PIL import Image, ImageOps
+
+# Formatos que se codifican en el camino de una subida o de /cdn/ (AVIF solo si está disponible)
+CODEC_FORMATS = ('WEBP', 'JPEG', 'PNG', 'GIF', 'AVIF')
+MIME_EXTENSIONS = ('.webp', '.avif', '.jpg', '.png', '.gif', '.svg', '.gz', '.br', '.html', '.css', '.js', '.json')
+
+
+def warm_up_codecs(formats=CODEC_FORMATS):
+    """Registra todos los plugins y hace un ciclo codificar/decodificar/redimensionar por formato.
+
+    Devuelve los formatos que se pudieron inicializar.
+    """
+    Image.init()
+    img = Image.new('RGB', (64, 64), 'gray')
+    ImageOps.exif_transpose(img)
+    img.resize((16, 16), Image.LANCZOS, reducing_gap=3.0)
+    warmed = []
+    for fmt in formats:
+        if fmt not in Image.SAVE:
+            continue
+        buffer = BytesIO()
+        img.save(buffer, format=fmt)
+        buffer.seek(0)
+        with Image.open(buffer) as decoded:
+            decoded.load()
+        warmed.append(fmt)
+    return warmed
+
+def warm_up_mimetypes():
+    mimetypes.init()
+    for ext in MIME_EXTENSIONS:
+        mimetypes.guess_type('x' + ext)
+
+def check_folders(folders):
+    """Crea las carpetas que falten y prueba que se pueda escribir en cada una.
+
+    Devuelve la lista de problemas encontrados (vacía si todo está bien).
+    """
+    problems = []
+    for folder in dict.fromkeys(folders):
+        try:
+            os.makedirs(folder, exist_ok=True)
+            with tempfile.TemporaryFile(dir=folder):
+                pass
+        except OSError as e:
+            problems.append(f'No se puede escribir en {folder}: {e.strerror or e}')
+    return problems